@@ -48,11 +48,14 @@ def confirm_transaction(client, tx_sig):
 
 
 ACCOUNT_INFO_LAYOUT = cStruct(
+    "tag" / Int8ul,
     "eth_acc" / Bytes(20),
     "nonce" / Int8ul,
     "trx_count" / Bytes(8),
     "signer_acc" / Bytes(32),
-    "code_size" / Int32ul
+    "code_acc" / Bytes(32),
+    "is_blocked" / Int8ul,
+    "blocked_by" / Bytes(32),
 )
 
 class AccountInfo(NamedTuple):
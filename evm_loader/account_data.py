@@ -0,0 +1,261 @@
+import base64
+import struct
+from base58 import b58encode
+
+# Mirror of program/src/account_data.rs: a tag byte followed by the packed
+# fields of the variant, all integers little endian.
+EMPTY_TAG = 0
+ACCOUNT_TAG = 1
+CONTRACT_TAG = 2
+STORAGE_TAG = 3
+
+_u8 = struct.Struct('<B')
+_u32 = struct.Struct('<I')
+_u64 = struct.Struct('<Q')
+
+
+class AccountDataError(Exception):
+    pass
+
+
+class _Field:
+    """Field at a fixed offset of the packed data, decoded on every access."""
+
+    def __init__(self, offset, size, fmt=None):
+        self.offset = offset
+        self.size = size
+        self.fmt = fmt
+
+    def __get__(self, view, owner):
+        if view is None:
+            return self
+        if self.fmt is None:
+            return bytes(view.data[self.offset:self.offset+self.size])
+        return self.fmt.unpack_from(view.data, self.offset)[0]
+
+    def __set__(self, view, value):
+        if self.fmt is None:
+            value = bytes(value)
+            if len(value) != self.size:
+                raise AccountDataError("Expected {} bytes, got {}".format(self.size, len(value)))
+            view.data[self.offset:self.offset+self.size] = value
+        else:
+            self.fmt.pack_into(view.data, self.offset, value)
+
+
+class _View:
+    """Variant of AccountData backed by a memoryview of the account data
+    (starting at the tag byte). Nothing is decoded until a field is read;
+    fields can be assigned when the underlying buffer is writable."""
+
+    __slots__ = ('data',)
+    TAG = None
+    SIZE = 0
+
+    def __init__(self, data):
+        self.data = memoryview(data)
+        if len(self.data) < self.size():
+            raise AccountDataError("{} needs {} bytes, got {}".format(
+                    type(self).__name__, self.size(), len(self.data)))
+
+    @classmethod
+    def size(cls):
+        return cls.SIZE + 1
+
+    @classmethod
+    def _prepare(cls, dst):
+        """Checks of AccountData::pack: the destination is either empty or
+        already holds this variant, and is large enough."""
+        dst = memoryview(dst)
+        if len(dst) < 1 or len(dst) < cls.size():
+            raise AccountDataError("AccountDataTooSmall")
+        if dst[0] != cls.TAG and dst[0] != EMPTY_TAG:
+            raise AccountDataError("InvalidAccountData")
+        dst[0] = cls.TAG
+        return cls(dst)
+
+    def __repr__(self):
+        fields = ("{}={!r}".format(name, getattr(self, name)) for name in self.FIELDS)
+        return "{}({})".format(type(self).__name__, ", ".join(fields))
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.data[:self.size()] == other.data[:other.size()]
+
+
+class Empty(_View):
+    __slots__ = ()
+    TAG = EMPTY_TAG
+    FIELDS = ()
+
+    @classmethod
+    def pack(cls, dst):
+        if len(dst) < 1:
+            raise AccountDataError("AccountDataTooSmall")
+        dst[0] = EMPTY_TAG
+        return cls(dst)
+
+
+class Account(_View):
+    __slots__ = ()
+    TAG = ACCOUNT_TAG
+    SIZE = 20+1+8+32+32+1+32
+    FIELDS = ('ether', 'nonce', 'trx_count', 'signer', 'code_account', 'blocked')
+
+    ether = _Field(1, 20)
+    nonce = _Field(21, 1, _u8)
+    trx_count = _Field(22, 8, _u64)
+    signer = _Field(30, 32)
+    code_account = _Field(62, 32)
+    is_blocked = _Field(94, 1, _u8)
+    blocked_by = _Field(95, 32)
+
+    @property
+    def blocked(self):
+        """Storage account holding the lock, None if not blocked."""
+        return self.blocked_by if self.is_blocked else None
+
+    @blocked.setter
+    def blocked(self, storage):
+        if storage is None:
+            self.is_blocked = 0
+        else:
+            self.is_blocked = 1
+            self.blocked_by = storage
+
+    @classmethod
+    def pack(cls, dst, ether, nonce, trx_count, signer, code_account=bytes(32), blocked=None):
+        view = cls._prepare(dst)
+        view.ether = ether
+        view.nonce = nonce
+        view.trx_count = trx_count
+        view.signer = bytes(signer)
+        view.code_account = bytes(code_account)
+        view.blocked = None if blocked is None else bytes(blocked)
+        return view
+
+
+class Contract(_View):
+    __slots__ = ()
+    TAG = CONTRACT_TAG
+    SIZE = 32+4
+    FIELDS = ('owner', 'code_size')
+
+    owner = _Field(1, 32)
+    code_size = _Field(33, 4, _u32)
+
+    @property
+    def code(self):
+        begin = self.size()
+        return self.data[begin:begin+self.code_size]
+
+    def storage(self):
+        """Hamt storage of the contract, which follows the code."""
+        from hamt import Hamt
+        return Hamt(self.data[self.size()+self.code_size:])
+
+    @classmethod
+    def pack(cls, dst, owner, code_size):
+        view = cls._prepare(dst)
+        view.owner = bytes(owner)
+        view.code_size = code_size
+        return view
+
+
+class Storage(_View):
+    __slots__ = ()
+    TAG = STORAGE_TAG
+    SIZE = 20+8+8+8+8
+    FIELDS = ('caller', 'nonce', 'accounts_len', 'executor_data_size', 'evm_data_size')
+
+    caller = _Field(1, 20)
+    nonce = _Field(21, 8, _u64)
+    accounts_len = _Field(29, 8, _u64)
+    executor_data_size = _Field(37, 8, _u64)
+    evm_data_size = _Field(45, 8, _u64)
+
+    @property
+    def accounts(self):
+        """Keys of the accounts blocked by the iterative call, as in
+        StorageAccount::accounts."""
+        begin = self.size()
+        end = begin + self.accounts_len * 32
+        if end > len(self.data):
+            raise AccountDataError("Storage accounts region {} outside of data".format(end))
+        return [bytes(self.data[pos:pos+32]) for pos in range(begin, end, 32)]
+
+    @classmethod
+    def pack(cls, dst, caller, nonce, accounts_len, executor_data_size=0, evm_data_size=0):
+        view = cls._prepare(dst)
+        view.caller = caller
+        view.nonce = nonce
+        view.accounts_len = accounts_len
+        view.executor_data_size = executor_data_size
+        view.evm_data_size = evm_data_size
+        return view
+
+
+VARIANTS = {cls.TAG: cls for cls in (Empty, Account, Contract, Storage)}
+
+
+def unpack(data):
+    """AccountData::unpack: a view of the variant selected by the tag."""
+    data = memoryview(data)
+    if len(data) < 1:
+        raise AccountDataError("InvalidAccountData: no data")
+    cls = VARIANTS.get(data[0])
+    if cls is None:
+        raise AccountDataError("InvalidAccountData: tag {}".format(data[0]))
+    return cls(data)
+
+
+def blocked_by(info, program_id):
+    """Storage (base58) blocking the account of a base64 account info,
+    None for unblocked accounts and accounts that aren't an Account of
+    `program_id`."""
+    if info is None or info['owner'] != str(program_id):
+        return None
+    try:
+        view = unpack(base64.b64decode(info['data'][0]))
+    except AccountDataError:
+        return None
+    if not isinstance(view, Account) or view.blocked is None:
+        return None
+    return b58encode(bytes(view.blocked)).decode()
+
+
+def tag_filter(tag):
+    """getProgramAccounts filter selecting one AccountData variant."""
+    return {'memcmp': {'offset': 0, 'bytes': b58encode(bytes([tag])).decode()}}
+
+
+def decode_program_accounts(response, tag=None):
+    """Decode a base64 getProgramAccounts response in one pass into
+    {pubkey: view}. Accounts of other variants than `tag` (when given)
+    and accounts that can't be unpacked are skipped."""
+    result = {}
+    for entry in response['result']:
+        data = base64.b64decode(entry['account']['data'][0])
+        if not data or (tag is not None and data[0] != tag):
+            continue
+        try:
+            result[entry['pubkey']] = unpack(data)
+        except AccountDataError:
+            continue
+    return result
+
+
+def getProgramAccounts(client, program_id, tag=None, data_slice=None):
+    """Every account of `program_id` (optionally of one variant) decoded.
+    `data_slice` is a (length) or (offset, length) limit on the data
+    returned per account, e.g. to fetch only the headers."""
+    from solana.rpc.types import RPCMethod
+    opts = {'encoding': 'base64'}
+    if tag is not None:
+        opts['filters'] = [tag_filter(tag)]
+    if data_slice is not None:
+        (offset, length) = data_slice if isinstance(data_slice, tuple) else (0, data_slice)
+        opts['dataSlice'] = {'offset': offset, 'length': length}
+    response = client._provider.make_request(RPCMethod("getProgramAccounts"), str(program_id), opts)
+    if 'error' in response:
+        raise Exception("getProgramAccounts failed: {}".format(response['error']))
+    return decode_program_accounts(response, tag)
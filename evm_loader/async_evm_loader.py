@@ -0,0 +1,326 @@
+import asyncio
+import base64
+import itertools
+import json
+import time
+import aiohttp
+from solana.transaction import AccountMeta, TransactionInstruction, Transaction
+from solana.rpc.api import SendTransactionError
+from solana.rpc.types import TxOpts
+from solana.publickey import PublicKey
+import account_data
+from base58 import b58encode
+from solana_utils import (solana_url, EVM_LOADER, CREATE_ACCOUNT_LAYOUT, system, solana2ether,
+                          accountWithSeed)
+from iterative_call import (keccak_instruction, partial_call_instruction, continue_instruction, StepCountTuner,
+                            StepCounts, ContinuePipeline, history_key)
+from blockhash_cache import BlockhashTracker
+from evm_receipts import find_receipt
+
+
+class AsyncClient:
+    """JSON-RPC client of a Solana node for asyncio.
+
+    Methods take the same arguments and return the same responses as their
+    counterparts of solana.rpc.api.Client (with the SendTransactionError of
+    solana-py.patch). Requests share one aiohttp session whose connector
+    keeps up to `limit` connections open, so many requests can be in flight
+    at once. The recent blockhash used by `send_transaction` is kept in a
+    BlockhashTracker, as BlockhashCache does for the blocking client, and
+    asked again once it is `refresh_slots` old or about to expire."""
+
+    def __init__(self, url=solana_url, limit=100, timeout=30, refresh_slots=4, poll_interval=1.0,
+                 confirm_timeout=30):
+        self.url = url
+        self.limit = limit
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self.confirm_timeout = confirm_timeout
+        self.session = None
+        self.request_ids = itertools.count(1)
+        self.blockhashes = BlockhashTracker(refresh_slots=refresh_slots)
+        self.blockhash_lock = None
+
+    async def make_request(self, method, *params):
+        if self.session is None:
+            self.session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.limit),
+                                                 timeout=aiohttp.ClientTimeout(total=self.timeout))
+        request = {"jsonrpc": "2.0", "id": next(self.request_ids), "method": method, "params": params}
+        async with self.session.post(self.url, json=request) as response:
+            response.raise_for_status()
+            return json.loads(await response.text())
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def get_balance(self, pubkey, commitment="max"):
+        return await self.make_request("getBalance", str(pubkey), {"commitment": commitment})
+
+    async def get_account_info(self, pubkey, commitment="max", encoding="base64", data_slice=None):
+        opts = {"encoding": encoding, "commitment": commitment}
+        if data_slice is not None:
+            opts["dataSlice"] = {"offset": data_slice.offset, "length": data_slice.length}
+        return await self.make_request("getAccountInfo", str(pubkey), opts)
+
+    async def get_slot(self, commitment="max"):
+        return await self.make_request("getSlot", {"commitment": commitment})
+
+    async def get_recent_blockhash(self, commitment="max"):
+        return await self.make_request("getRecentBlockhash", {"commitment": commitment})
+
+    async def get_confirmed_transaction(self, tx_sig, encoding="json"):
+        return await self.make_request("getConfirmedTransaction", tx_sig, encoding)
+
+    async def get_signature_statuses(self, signatures):
+        return await self.make_request("getSignatureStatuses", [str(signature) for signature in signatures])
+
+    async def request_airdrop(self, pubkey, lamports, commitment="max"):
+        return await self.make_request("requestAirdrop", str(pubkey), lamports, {"commitment": commitment})
+
+    async def recent_blockhash(self):
+        if self.blockhash_lock is None:
+            self.blockhash_lock = asyncio.Lock()
+        async with self.blockhash_lock:
+            current = self.blockhashes.current
+            if current is None or self.blockhashes.is_due(current) or self.blockhashes.is_expiring(current):
+                response = await self.get_recent_blockhash(self.blockhashes.commitment)
+                current = self.blockhashes.update(response, await self.get_slot("recent"))
+            return current.blockhash
+
+    async def send_transaction(self, txn, *signers, opts=TxOpts()):
+        txn.recent_blockhash = await self.recent_blockhash()
+        txn.sign(*signers)
+        return await self.send_raw_transaction(txn.serialize(), opts=opts)
+
+    async def send_raw_transaction(self, txn, opts=TxOpts()):
+        if isinstance(txn, bytes):
+            txn = base64.b64encode(txn).decode("utf-8")
+        resp = await self.make_request("sendTransaction", txn, {
+            "skipPreflight": opts.skip_preflight,
+            "preflightCommitment": opts.preflight_commitment,
+            "encoding": "base64",
+        })
+        if resp.get("error"):
+            raise SendTransactionError(resp.get("error"))
+        if not resp.get("result"):
+            raise Exception("Failed to send transaction")
+        if opts.skip_confirmation:
+            return resp
+        return await self.confirm_transaction(resp["result"])
+
+    async def confirm_transaction(self, tx_sig):
+        """getConfirmedTransaction response of `tx_sig` once it is there."""
+        deadline = time.monotonic() + self.confirm_timeout
+        while True:
+            resp = await self.get_confirmed_transaction(tx_sig)
+            if resp.get("result"):
+                return resp
+            if time.monotonic() >= deadline:
+                raise Exception("Unable to confirm transaction %s" % tx_sig)
+            await asyncio.sleep(self.poll_interval)
+
+
+async def getBalance(client, account):
+    return (await client.get_balance(account))['result']['value']
+
+
+async def getAccountData(client, account, expected_length):
+    info = (await client.get_account_info(account))['result']['value']
+    if info is None:
+        raise Exception("Can't get information about {}".format(account))
+
+    data = base64.b64decode(info['data'][0])
+    if len(data) != expected_length:
+        raise Exception("Wrong data length for account data {}".format(account))
+    return data
+
+
+async def getTransactionCount(client, sol_account):
+    info = await getAccountData(client, sol_account, account_data.Account.size())
+    return account_data.unpack(info).trx_count
+
+
+async def neon_cli_call(arguments, url=solana_url):
+    process = await asyncio.create_subprocess_shell('neon-cli --url {} {}'.format(url, arguments),
+                                                    stdout=asyncio.subprocess.PIPE)
+    (output, _) = await process.communicate()
+    if process.returncode != 0:
+        raise Exception("neon-cli error: exit code {}".format(process.returncode))
+    return output.decode()
+
+
+class AsyncEvmLoader:
+    """EvmLoader for asyncio: methods that talk to the node or to neon-cli
+    are coroutines, so one process can drive many calls over one
+    AsyncClient. The loader has to be deployed already."""
+
+    def __init__(self, acc, client, programId=EVM_LOADER, tuner=None, begin_steps=10, opts=None,
+                 pipeline_window=1, poll_interval=0.4, pending_timeout=60):
+        self.acc = acc
+        self.client = client
+        self.loader_id = programId
+        self.tuner = tuner or StepCountTuner()
+        self.begin_steps = begin_steps
+        self.opts = opts or TxOpts(skip_confirmation=False, preflight_commitment="root")
+        self.pipeline_window = pipeline_window
+        self.poll_interval = poll_interval
+        self.pending_timeout = pending_timeout
+
+    def _signer(self):
+        return self.acc.get_acc()
+
+    async def deploy(self, contract_path):
+        output = await neon_cli_call("deploy --evm_loader {} {}".format(self.loader_id, contract_path),
+                                     self.client.url)
+        return json.loads(output.splitlines()[-1])
+
+    async def ether2program(self, ether):
+        if isinstance(ether, str):
+            if ether.startswith('0x'): ether = ether[2:]
+        else: ether = ether.hex()
+        output = await neon_cli_call("create-program-address --evm_loader {} {}".format(self.loader_id, ether),
+                                     self.client.url)
+        items = output.rstrip().split(' ')
+        return (items[0], int(items[1]))
+
+    async def createEtherAccount(self, ether):
+        if isinstance(ether, str):
+            if ether.startswith('0x'): ether = ether[2:]
+        else: ether = ether.hex()
+        (sol, nonce) = await self.ether2program(ether)
+        trx = Transaction()
+        base = self._signer().public_key()
+        trx.add(TransactionInstruction(
+            program_id=self.loader_id,
+            data=bytes.fromhex('02000000')+CREATE_ACCOUNT_LAYOUT.build(dict(
+                lamports=10**9,
+                space=0,
+                ether=bytes.fromhex(ether),
+                nonce=nonce)),
+            keys=[
+                AccountMeta(pubkey=base, is_signer=True, is_writable=False),
+                AccountMeta(pubkey=PublicKey(sol), is_signer=False, is_writable=True),
+                AccountMeta(pubkey=system, is_signer=False, is_writable=False),
+            ]))
+        await self.client.send_transaction(trx, self._signer(), opts=self.opts)
+        return sol
+
+    async def deployChecked(self, location, creator=None):
+        from web3 import Web3
+        if creator is None:
+            creator = solana2ether("6ghLBF2LZAooDnmUMVm8tdNK6jhcAQhtbQiC7TgVnQ2r")
+        with open(location, mode='rb') as file:
+            fileHash = Web3.keccak(file.read())
+            ether = bytes(Web3.keccak(b'\xff' + creator + bytes(32) + fileHash)[-20:])
+        program = await self.ether2program(ether)
+        info = await self.client.get_account_info(program[0])
+        if info['result']['value'] is None:
+            res = await self.deploy(location)
+            return (res['programId'], bytes.fromhex(res['ethereum'][2:]), res['codeId'])
+        elif info['result']['value']['owner'] != self.loader_id:
+            raise Exception("Invalid owner for account {}".format(program))
+        else:
+            code = self.ether2seed(ether)
+            return (program[0], ether, code[0])
+
+    def ether2seed(self, ether):
+        if isinstance(ether, str):
+            if ether.startswith('0x'): ether = ether[2:]
+        else: ether = ether.hex()
+        seed = b58encode(bytes.fromhex(ether)).decode('utf8')
+        acc = accountWithSeed(self._signer().public_key(), seed, PublicKey(self.loader_id))
+        return (acc, 255)
+
+    async def call(self, accounts, from_addr, sign, msg):
+        """CallFromRawEthereumTX; returns the confirmed transaction."""
+        trx = Transaction()
+        trx.add(keccak_instruction(len(msg), data_start=1))
+        trx.add(TransactionInstruction(program_id=self.loader_id,
+                                       data=bytes.fromhex("05") + from_addr + sign + msg,
+                                       keys=list(accounts)))
+        return (await self.client.send_transaction(trx, self._signer(), opts=self.opts))['result']
+
+    async def iterative_call(self, storage, accounts, from_addr, sign, msg, key=None):
+        """PartialCallFromRawEthereumTX and Continue until OnReturn, as
+        IterativeCaller.call does; returns the confirmed transaction with
+        the OnReturn."""
+        if key is None:
+            key = history_key(accounts[0].pubkey, msg)
+        storage = PublicKey(storage)
+        trx = Transaction()
+        trx.add(keccak_instruction(len(msg)))
+        trx.add(partial_call_instruction(self.loader_id, storage, accounts, self.begin_steps,
+                                         from_addr, sign, msg))
+        await self.client.send_transaction(trx, self._signer(), opts=self.opts)
+        return await self.run(storage, accounts, key)
+
+    async def step(self, storage, accounts, step_count, opts=None):
+        trx = Transaction()
+        trx.add(continue_instruction(self.loader_id, storage, accounts, step_count))
+        return (await self.client.send_transaction(trx, self._signer(), opts=opts or self.opts))['result']
+
+    async def run(self, storage, accounts, key=None):
+        """IterativeCaller.run: Continues until the call returns."""
+        if self.pipeline_window > 1:
+            return await self.run_pipelined(storage, accounts, key)
+
+        counts = StepCounts(self.tuner, key, self.loader_id)
+        while True:
+            try:
+                result = await self.step(storage, accounts, counts.steps)
+            except Exception as err:
+                if not counts.failed(err):
+                    raise
+                continue
+            if counts.confirmed(result):
+                return result
+
+    async def run_pipelined(self, storage, accounts, key=None):
+        """IterativeCaller.run_pipelined: `pipeline_window` Continues in flight."""
+        pipeline = ContinuePipeline(self.tuner, key, self.loader_id, self.pipeline_window, self.pending_timeout)
+        opts = TxOpts(skip_confirmation=True, skip_preflight=True)
+
+        while pipeline.result is None:
+            for step_count in iter(pipeline.next_step_count, None):
+                pipeline.sent(await self.step(storage, accounts, step_count, opts), step_count, time.monotonic())
+
+            await asyncio.sleep(self.poll_interval)
+
+            signatures = list(pipeline.in_flight)
+            statuses = (await self.client.get_signature_statuses(signatures))['result']['value'] if signatures else []
+            pipeline.update(signatures, statuses, time.monotonic())
+
+            for signature in list(pipeline.unfetched):
+                trx_result = (await self.client.get_confirmed_transaction(signature))['result']
+                if pipeline.fetched(signature, trx_result):
+                    break
+
+            if pipeline.stalled():
+                for signature in pipeline.lost:
+                    trx_result = (await self.client.get_confirmed_transaction(signature))['result']
+                    if trx_result is not None and find_receipt(trx_result) is not None:
+                        return trx_result
+                raise Exception("Storage {} was released without OnReturn".format(storage))
+
+        await self._drain(pipeline.undrained())
+        return pipeline.result
+
+    async def _drain(self, signatures):
+        """Wait up to `pending_timeout` until `signatures` have a status."""
+        pending = set(signatures)
+        deadline = time.monotonic() + self.pending_timeout
+        while pending and time.monotonic() < deadline:
+            await asyncio.sleep(self.poll_interval)
+            signatures = list(pending)
+            statuses = (await self.client.get_signature_statuses(signatures))['result']['value']
+            for (signature, status) in zip(signatures, statuses):
+                if status is not None:
+                    pending.discard(signature)
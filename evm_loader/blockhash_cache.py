@@ -0,0 +1,167 @@
+import threading
+import time
+from typing import NamedTuple
+from solana.rpc.types import TxOpts
+
+# A transaction is processed while its blockhash is one of the last
+# MAX_PROCESSING_AGE blockhashes of the bank (sdk/src/clock.rs)
+MAX_PROCESSING_AGE = 150
+DEFAULT_SLOT_TIME = 0.4
+
+
+class RecentBlockhash(NamedTuple):
+    blockhash: str
+    slot: int                # slot of the getRecentBlockhash context
+    last_valid_slot: int
+    fetched_at: float        # time.monotonic() of the answer
+    tip_slot: int            # slot the node was processing then
+
+
+def is_blockhash_not_found(err):
+    return "blockhashnotfound" in str(err).lower().replace(" ", "").replace("_", "")
+
+
+class BlockhashTracker:
+    """The blockhash bookkeeping of BlockhashCache without the I/O: the
+    current RecentBlockhash built from the answers of getRecentBlockhash
+    and getSlot, and how close a hash is to expiring. The asyncio client
+    (async_evm_loader) does its own requests around it.
+
+    The hash is asked at `commitment`, whose context slot is behind the
+    tip (about 32 slots for "max"), so expiry is measured from the slot
+    the node is processing, asked along with the hash."""
+
+    def __init__(self, refresh_slots=4, slot_time=DEFAULT_SLOT_TIME, max_age=MAX_PROCESSING_AGE,
+                 margin_slots=20, commitment="max"):
+        self.refresh_slots = refresh_slots
+        self.slot_time = slot_time
+        self.max_age = max_age
+        self.margin_slots = margin_slots
+        self.commitment = commitment
+        self.lock = threading.Lock()
+        self.current = None
+        self.stats = {'fetches': 0, 'errors': 0, 'resigned': 0, 'retries': 0}
+
+    def update(self, response, tip):
+        """Make the hash of getRecentBlockhash `response` current, with the
+        getSlot("recent") answer `tip`; returns the current RecentBlockhash."""
+        result = response.get('result') if isinstance(response, dict) else None
+        if not result:
+            raise RuntimeError("failed to get recent blockhash: {}".format(response))
+        if not isinstance(tip, dict) or tip.get('result') is None:
+            raise RuntimeError("failed to get the current slot: {}".format(tip))
+        slot = result['context']['slot']
+        recent = RecentBlockhash(result['value']['blockhash'], slot, slot + self.max_age, time.monotonic(),
+                                 max(slot, tip['result']))
+        with self.lock:
+            self.stats['fetches'] += 1
+            if self.current is None or recent.slot >= self.current.slot:
+                self.current = recent
+            return self.current
+
+    def estimated_slot(self):
+        """Slot the node is processing, extrapolated from the last answer."""
+        current = self.current
+        if current is None:
+            return None
+        return current.tip_slot + int((time.monotonic() - current.fetched_at) / self.slot_time)
+
+    def is_expiring(self, recent, margin_slots=None):
+        if margin_slots is None:
+            margin_slots = self.margin_slots
+        return self.estimated_slot() + margin_slots > recent.last_valid_slot
+
+    def is_due(self, recent):
+        """`recent` is older than `refresh_slots`: a newer hash is due."""
+        return time.monotonic() - recent.fetched_at >= self.refresh_slots * self.slot_time
+
+
+class BlockhashCache(BlockhashTracker):
+    """Recent blockhash shared by every sender of a client.
+
+    solana-py's `send_transaction` asks for a blockhash before each
+    transaction; `send_transaction` here signs with the cached one and uses
+    `send_raw_transaction`. A background thread refreshes the blockhash
+    every `refresh_slots` slots, so `get` never waits for the RPC, except
+    for the very first hash. The thread starts on the first `get`.
+
+    Every hash carries the last slot it can be processed in; `resign` signs
+    a prepared transaction again when its hash is about to expire."""
+
+    def __init__(self, client, refresh_slots=4, slot_time=DEFAULT_SLOT_TIME,
+                 max_age=MAX_PROCESSING_AGE, margin_slots=20, commitment="max"):
+        super().__init__(refresh_slots, slot_time, max_age, margin_slots, commitment)
+        self.client = client
+        self.thread = None
+        self.stopped = threading.Event()
+
+    def fetch(self):
+        """Ask the cluster for a new blockhash and make it current."""
+        response = self.client.get_recent_blockhash(self.commitment)
+        return self.update(response, self.client.get_slot("recent"))
+
+    def _refresh(self):
+        while not self.stopped.wait(self.refresh_slots * self.slot_time):
+            try:
+                self.fetch()
+            except Exception:
+                with self.lock:
+                    self.stats['errors'] += 1
+
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.stopped.clear()
+                self.thread = threading.Thread(target=self._refresh, daemon=True)
+                self.thread.start()
+
+    def stop(self):
+        with self.lock:
+            thread = self.thread
+            self.thread = None
+        self.stopped.set()
+        if thread is not None:
+            thread.join()
+
+    def get(self):
+        """Current RecentBlockhash; fetched now only if the cached one is
+        missing or expiring (the refresh thread is behind)."""
+        self.start()
+        current = self.current
+        if current is None or self.is_expiring(current):
+            current = self.fetch()
+        return current
+
+    def sign(self, trx, *signers):
+        """Set the cached blockhash and sign; returns the RecentBlockhash used."""
+        recent = self.get()
+        trx.recent_blockhash = recent.blockhash
+        trx.sign(*signers)
+        return recent
+
+    def resign(self, trx, recent, *signers):
+        """Sign `trx` again with a fresh blockhash if `recent`, the one it
+        was signed with, is about to expire. Returns the blockhash in use."""
+        if not self.is_expiring(recent):
+            return recent
+        with self.lock:
+            self.stats['resigned'] += 1
+        return self.sign(trx, *signers)
+
+    def send_transaction(self, trx, *signers, opts=TxOpts()):
+        """`Client.send_transaction` with the cached blockhash. A node that
+        doesn't know the hash yet answers BlockhashNotFound: the
+        transaction is then signed with a newly fetched hash and sent once
+        more."""
+        self.sign(trx, *signers)
+        try:
+            return self.client.send_raw_transaction(trx.serialize(), opts=opts)
+        except Exception as err:
+            if not is_blockhash_not_found(err):
+                raise
+        with self.lock:
+            self.stats['retries'] += 1
+        recent = self.fetch()
+        trx.recent_blockhash = recent.blockhash
+        trx.sign(*signers)
+        return self.client.send_raw_transaction(trx.serialize(), opts=opts)
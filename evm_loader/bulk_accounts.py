@@ -0,0 +1,178 @@
+import time
+from hashlib import sha256
+from base58 import b58encode
+from solana.transaction import AccountMeta, TransactionInstruction, Transaction
+from solana.rpc.types import TxOpts
+from solana.publickey import PublicKey
+from solana_utils import http_client, CREATE_ACCOUNT_LAYOUT, system, getMultipleAccounts
+from blockhash_cache import BlockhashCache
+from call_packer import PACKET_DATA_SIZE, transaction_size
+
+# Curve25519 field and the d of the twisted Edwards form of ed25519
+ED25519_P = 2**255 - 19
+ED25519_D = (-121665 * pow(121666, ED25519_P - 2, ED25519_P)) % ED25519_P
+
+
+def is_on_curve(key):
+    """Whether 32 bytes decompress to an ed25519 point, as
+    CompressedEdwardsY::decompress decides: y (sign bit cleared, reduced
+    mod p) is on the curve when (y^2 - 1) / (d*y^2 + 1) is a square."""
+    y = int.from_bytes(key, 'little') & ((1 << 255) - 1)
+    y2 = y * y % ED25519_P
+    u = (y2 - 1) % ED25519_P
+    v = (ED25519_D * y2 + 1) % ED25519_P
+    w = u * pow(v, ED25519_P - 2, ED25519_P) % ED25519_P
+    return w == 0 or pow(w, (ED25519_P - 1) // 2, ED25519_P) == 1
+
+
+def create_program_address(seeds, program_id):
+    """Pubkey::create_program_address; None when the hash is on the curve."""
+    key = sha256(b''.join(bytes(seed) for seed in seeds) + bytes(PublicKey(program_id)) +
+                 b"ProgramDerivedAddress").digest()
+    return None if is_on_curve(key) else b58encode(key).decode()
+
+
+def find_program_address(seeds, program_id):
+    """Pubkey::find_program_address: (address, nonce) with the highest
+    nonce giving an address off the curve."""
+    for nonce in range(255, 0, -1):
+        address = create_program_address(list(seeds) + [bytes([nonce])], program_id)
+        if address is not None:
+            return (address, nonce)
+    raise Exception("Unable to find a viable program address nonce")
+
+
+def ether_bytes(ether):
+    if isinstance(ether, str):
+        return bytes.fromhex(ether[2:] if ether.startswith('0x') else ether)
+    return bytes(ether)
+
+
+def create_account_instruction(program_id, funding, ether, sol, nonce, lamports):
+    return TransactionInstruction(
+        program_id=program_id,
+        data=bytes.fromhex('02000000')+CREATE_ACCOUNT_LAYOUT.build(dict(
+            lamports=lamports,
+            space=0,
+            ether=ether,
+            nonce=nonce)),
+        keys=[
+            AccountMeta(pubkey=funding, is_signer=True, is_writable=True),
+            AccountMeta(pubkey=PublicKey(sol), is_signer=False, is_writable=True),
+            AccountMeta(pubkey=system, is_signer=False, is_writable=False),
+        ])
+
+
+class BulkAccountCreator:
+    """Creates many Ethereum accounts of the loader, as
+    EvmLoader.createEtherAccount does one by one.
+
+    Addresses are derived locally (the same find_program_address as
+    `neon-cli create-program-address`). Accounts that exist already are
+    found with batched getMultipleAccounts and skipped. The remaining
+    CreateAccount instructions are packed into as few transactions as
+    fit a packet, and at most `window` transactions are in flight at
+    once. Transactions that fail or don't confirm within `timeout` are
+    retried in the next round, after the existence check runs again. The
+    chain is the only state, so an interrupted run is resumed by running
+    it again with the same addresses."""
+
+    def __init__(self, signer, program_id, client=http_client, lamports=10**9, window=16, timeout=60,
+                 poll_interval=0.4, rounds=3, max_size=PACKET_DATA_SIZE, blockhash_cache=None):
+        self.signer = signer
+        self.program_id = program_id
+        self.client = client
+        self.lamports = lamports
+        self.window = window
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self.rounds = rounds
+        self.max_size = max_size
+        self.blockhash_cache = blockhash_cache or BlockhashCache(client)
+        self.stats = {'derived': 0, 'existing': 0, 'created': 0, 'transactions': 0, 'failed': 0}
+
+    def derive(self, ethers):
+        """[(ether, solana address, nonce)] in the order of `ethers`."""
+        derived = []
+        for ether in ethers:
+            ether = ether_bytes(ether)
+            (sol, nonce) = find_program_address([ether], self.program_id)
+            derived.append((ether, sol, nonce))
+        self.stats['derived'] += len(derived)
+        return derived
+
+    def missing(self, derived):
+        """The accounts of `derived` that don't exist yet."""
+        (_, infos) = getMultipleAccounts(self.client, [sol for (_, sol, _) in derived], data_slice=0)
+        return [item for (item, info) in zip(derived, infos) if info is None]
+
+    def pack(self, derived):
+        """Split the CreateAccount instructions into transactions."""
+        payer = self.signer.public_key()
+        batches = []
+        batch = []
+        for (ether, sol, nonce) in derived:
+            instruction = create_account_instruction(self.program_id, payer, ether, sol, nonce, self.lamports)
+            if batch and transaction_size(payer, batch + [instruction]) > self.max_size:
+                batches.append(batch)
+                batch = []
+            batch.append(instruction)
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def _send(self, instructions):
+        trx = Transaction()
+        trx.add(*instructions)
+        opts = TxOpts(skip_confirmation=True, preflight_commitment="confirmed")
+        return self.blockhash_cache.send_transaction(trx, self.signer, opts=opts)["result"]
+
+    def send(self, batches):
+        """Send `batches` keeping at most `window` unconfirmed; returns the
+        number of batches that failed."""
+        pending = list(reversed(batches))
+        in_flight = {}      # signature -> (batch, sent_at)
+        failed = 0
+        while pending or in_flight:
+            while pending and len(in_flight) < self.window:
+                batch = pending.pop()
+                try:
+                    signature = self._send(batch)
+                except Exception:
+                    failed += 1
+                    continue
+                in_flight[signature] = (batch, time.monotonic())
+                self.stats['transactions'] += 1
+
+            time.sleep(self.poll_interval)
+            signatures = list(in_flight)
+            statuses = self.client.get_signature_statuses(signatures)['result']['value'] if signatures else []
+            now = time.monotonic()
+            for (signature, status) in zip(signatures, statuses):
+                (batch, sent_at) = in_flight[signature]
+                if status is not None and status.get('err') is not None:
+                    failed += 1
+                elif status is not None and status.get('confirmationStatus') in ('confirmed', 'finalized'):
+                    self.stats['created'] += len(batch)
+                elif now - sent_at < self.timeout:
+                    continue
+                else:
+                    failed += 1
+                del in_flight[signature]
+        self.stats['failed'] += failed
+        return failed
+
+    def create(self, ethers):
+        """Create the accounts of `ethers` that don't exist; returns
+        [(ether, solana address, nonce)] for all of them."""
+        derived = self.derive(ethers)
+        missing = self.missing(derived)
+        self.stats['existing'] += len(derived) - len(missing)
+        for _ in range(self.rounds):
+            if not missing:
+                return derived
+            self.send(self.pack(missing))
+            missing = self.missing(missing)
+        if missing:
+            raise Exception("{} accounts were not created".format(len(missing)))
+        return derived
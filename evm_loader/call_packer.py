@@ -0,0 +1,193 @@
+import struct
+from typing import NamedTuple, List
+from solana.transaction import AccountMeta, TransactionInstruction, Transaction
+from solana.rpc.types import TxOpts
+from solana.publickey import PublicKey
+from solana_utils import http_client
+from evm_receipts import iter_receipts
+from iterative_call import keccakprog
+
+# Limits of a legacy Solana transaction: the serialized transaction must
+# fit into one packet, account indexes are u8
+PACKET_DATA_SIZE = 1232
+MAX_ACCOUNT_KEYS = 64
+
+SIGNATURE_SIZE = 64
+PUBKEY_SIZE = 32
+MESSAGE_HEADER_SIZE = 3
+SIGNATURE_OFFSETS_SIZE = 11
+
+# Offsets inside CallFromRawEthereumTX data: tag, from_addr, sign, msg
+CALL_DATA_START = 1
+ETH_ADDRESS_SIZE = 20
+ETH_SIGNATURE_SIZE = 65
+
+
+class EvmCall(NamedTuple):
+    """Signed EVM call (eth_tx_utils.make_instruction_data_from_tx) and the
+    account metas of its CallFromRawEthereumTX (iterative_call.call_accounts)."""
+    from_addr: bytes
+    sign: bytes
+    msg: bytes
+    accounts: List[AccountMeta]
+
+
+def shortvec_length(value):
+    """Size of the compact-u16 encoding of `value`."""
+    size = 1
+    while value >= 0x80:
+        value >>= 7
+        size += 1
+    return size
+
+
+def multi_secp256k1_data(checks):
+    """secp256k1 program data verifying one signature per (instruction_index,
+    msg_len): each signature is read from CallFromRawEthereumTX data at
+    `instruction_index`."""
+    if len(checks) > 255:
+        raise Exception("Too many signatures for one instruction: {}".format(len(checks)))
+    eth_address_offset = CALL_DATA_START
+    signature_offset = eth_address_offset + ETH_ADDRESS_SIZE
+    message_data_offset = signature_offset + ETH_SIGNATURE_SIZE
+
+    data = struct.pack("B", len(checks))
+    for (instruction_index, msg_len) in checks:
+        if not 0 <= instruction_index <= 255:
+            raise Exception("Invalid index for instruction - {}".format(instruction_index))
+        data += struct.pack("<HBHBHHB", signature_offset, instruction_index,
+                            eth_address_offset, instruction_index,
+                            message_data_offset, msg_len, instruction_index)
+    return data
+
+
+def secp256k1_instruction(data):
+    return TransactionInstruction(program_id=keccakprog, data=data,
+            keys=[AccountMeta(pubkey=PublicKey(keccakprog), is_signer=False, is_writable=False)])
+
+
+def call_instruction(program_id, call):
+    return TransactionInstruction(program_id=program_id,
+            data=bytes.fromhex("05") + call.from_addr + call.sign + call.msg,
+            keys=list(call.accounts))
+
+
+def packed_instructions(program_id, calls):
+    """Instructions of one transaction executing `calls`, and the index of
+    the CallFromRawEthereumTX of every call.
+
+    The first instruction verifies the signatures of all calls. A
+    CallFromRawEthereumTX only checks that the instruction right before it
+    belongs to the secp256k1 program, so every later call is preceded by a
+    secp256k1 instruction with no signatures (a single byte of data)."""
+    indexes = [1 + 2*i for i in range(len(calls))]
+    instructions = [secp256k1_instruction(multi_secp256k1_data(
+            [(index, len(call.msg)) for (index, call) in zip(indexes, calls)]))]
+    for (i, call) in enumerate(calls):
+        if i > 0:
+            instructions.append(secp256k1_instruction(struct.pack("B", 0)))
+        instructions.append(call_instruction(program_id, call))
+    return (instructions, indexes)
+
+
+def account_keys(payer, instructions):
+    """Distinct account keys of the message: the fee payer, the accounts
+    and the programs of the instructions."""
+    keys = {str(payer)}
+    for instruction in instructions:
+        keys.add(str(instruction.program_id))
+        keys.update(str(meta.pubkey) for meta in instruction.keys)
+    return keys
+
+
+def transaction_size(payer, instructions, signers=1):
+    """Size of the serialized transaction, without building it."""
+    keys = len(account_keys(payer, instructions))
+    size = shortvec_length(signers) + signers*SIGNATURE_SIZE
+    size += MESSAGE_HEADER_SIZE + shortvec_length(keys) + keys*PUBKEY_SIZE + PUBKEY_SIZE
+    size += shortvec_length(len(instructions))
+    for instruction in instructions:
+        size += 1 + shortvec_length(len(instruction.keys)) + len(instruction.keys)
+        size += shortvec_length(len(instruction.data)) + len(instruction.data)
+    return size
+
+
+class CallPacker:
+    """Sends independent EVM calls several per transaction.
+
+    Calls are packed greedily in order: a call goes to the first batch that
+    still fits it within `max_size` bytes and `max_account_keys` accounts,
+    but never before a batch with an earlier call of the same caller, so
+    the nonces of a caller stay in order. A batch is executed atomically:
+    if one of its calls fails the whole transaction fails."""
+
+    def __init__(self, signer, program_id, client=http_client, opts=None,
+                 max_size=PACKET_DATA_SIZE, max_account_keys=MAX_ACCOUNT_KEYS, max_calls=None):
+        self.signer = signer
+        self.program_id = program_id
+        self.client = client
+        self.opts = opts or TxOpts(skip_confirmation=False, preflight_commitment="root")
+        self.max_size = max_size
+        self.max_account_keys = max_account_keys
+        self.max_calls = max_calls
+
+    def fits(self, calls):
+        if self.max_calls is not None and len(calls) > self.max_calls:
+            return False
+        (instructions, _) = packed_instructions(self.program_id, calls)
+        payer = self.signer.public_key()
+        return (len(account_keys(payer, instructions)) <= self.max_account_keys and
+                transaction_size(payer, instructions) <= self.max_size)
+
+    def pack(self, calls):
+        """Split `calls` into batches, each fitting one transaction.
+        Returns lists of indexes into `calls`."""
+        batches = []
+        last_batch = {}     # from_addr -> last batch with a call of this caller
+        for (i, call) in enumerate(calls):
+            if not self.fits([call]):
+                raise Exception("Call {} doesn't fit into a transaction".format(i))
+            start = last_batch.get(bytes(call.from_addr), 0)
+            for number in range(start, len(batches)):
+                if self.fits([calls[j] for j in batches[number]] + [call]):
+                    batches[number].append(i)
+                    break
+            else:
+                number = len(batches)
+                batches.append([i])
+            last_batch[bytes(call.from_addr)] = number
+        return batches
+
+    def transaction(self, calls):
+        """Transaction of one batch and the instruction index of every call."""
+        (instructions, indexes) = packed_instructions(self.program_id, calls)
+        trx = Transaction()
+        trx.add(*instructions)
+        return (trx, indexes)
+
+    def send(self, calls):
+        """Send one batch; returns the signature and the instruction index
+        of every call."""
+        (trx, indexes) = self.transaction(calls)
+        signature = self.client.send_transaction(trx, self.signer, opts=self.opts)["result"]
+        return (signature, indexes)
+
+    def call(self, calls):
+        """Execute `calls` and return their EvmReceipts in the same order."""
+        receipts = [None] * len(calls)
+        sent = []
+        for batch in self.pack(calls):
+            (signature, indexes) = self.send([calls[i] for i in batch])
+            sent.append((signature, dict(zip(indexes, batch))))
+        for (signature, positions) in sent:
+            result = self.client.get_confirmed_transaction(signature)['result']
+            for (index, receipt) in receipts_by_instruction(result, self.program_id).items():
+                if index in positions:
+                    receipts[positions[index]] = receipt
+        return receipts
+
+
+def receipts_by_instruction(result, program_id=None):
+    """EvmReceipts of a confirmed transaction keyed by the index of the
+    instruction that produced them."""
+    return {receipt.instruction_index: receipt for receipt in iter_receipts([result], program_id)}
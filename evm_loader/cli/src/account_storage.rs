@@ -15,10 +15,13 @@ use evm_loader::{
     solidity_account::SolidityAccount,
 };
 use std::borrow::BorrowMut;
-use std::cell::RefCell; 
+use std::cell::{Cell, RefCell};
 use std::rc::Rc;
 use crate::Config;
 
+// Limit of getMultipleAccounts
+const MAX_MULTIPLE_ACCOUNTS: usize = 100;
+
 #[derive(Serialize, Deserialize, Debug)]
 struct AccountJSON {
     address: String,
@@ -56,10 +59,75 @@ impl SolanaNewAccount {
     }
 }
 
+/// Accounts fetched from Solana, shared by the emulations of one slot.
+/// Emulation never writes to the fetched data, so an entry stays valid
+/// until the slot changes.
+pub struct AccountCache {
+    slot: Cell<u64>,
+    timestamp: Cell<i64>,
+    accounts: RefCell<HashMap<H160, Option<(Account, Option<Account>)>>>,
+    hits: Cell<u64>,
+    misses: Cell<u64>,
+}
+
+impl AccountCache {
+    pub fn new() -> AccountCache {
+        Self {
+            slot: Cell::new(0),
+            timestamp: Cell::new(0),
+            accounts: RefCell::new(HashMap::new()),
+            hits: Cell::new(0),
+            misses: Cell::new(0),
+        }
+    }
+
+    /// Drop the cached accounts when the cluster moved to a new slot.
+    pub fn update_slot(&self, config: &Config) {
+        let slot = match config.rpc_client.get_slot() {
+            Ok(slot) => slot,
+            Err(_) => {
+                eprintln!("Get slot error");
+                return;
+            }
+        };
+        if slot == self.slot.get() {
+            return;
+        }
+
+        eprintln!("Slot {}: drop {} cached accounts (hits {}, misses {})",
+                slot, self.accounts.borrow().len(), self.hits.get(), self.misses.get());
+        self.accounts.borrow_mut().clear();
+        self.slot.set(slot);
+        self.timestamp.set(config.rpc_client.get_block_time(slot).unwrap_or(0));
+    }
+
+    fn lookup(&self, address: &H160) -> Option<Option<(Account, Option<Account>)>> {
+        self.accounts.borrow().get(address).cloned()
+    }
+
+    fn insert(&self, address: H160, entry: Option<(Account, Option<Account>)>) {
+        self.accounts.borrow_mut().insert(address, entry);
+    }
+
+    fn get(&self, config: &Config, address: &H160) -> Option<(Account, Option<Account>)> {
+        if let Some(entry) = self.accounts.borrow().get(address) {
+            self.hits.set(self.hits.get() + 1);
+            return entry.clone();
+        }
+        self.misses.set(self.misses.get() + 1);
+        let entry = EmulatorAccountStorage::get_account_from_solana(config, address);
+        self.accounts.borrow_mut().insert(*address, entry.clone());
+        entry
+    }
+}
+
 pub struct EmulatorAccountStorage<'a> {
     accounts: RefCell<HashMap<H160, SolanaAccount>>,
     new_accounts: RefCell<HashMap<H160, SolanaNewAccount>>,
+    prefetched: RefCell<HashMap<H160, Option<(Account, Option<Account>)>>>,
+    lazy_accounts: RefCell<Vec<H160>>,
     config: &'a Config,
+    cache: Option<&'a AccountCache>,
     contract_id: H160,
     caller_id: H160,
     block_number: u64,
@@ -97,7 +165,10 @@ impl<'a> EmulatorAccountStorage<'a> {
         Self {
             accounts: RefCell::new(HashMap::new()),
             new_accounts: RefCell::new(HashMap::new()),
+            prefetched: RefCell::new(HashMap::new()),
+            lazy_accounts: RefCell::new(Vec::new()),
             config: config,
+            cache: None,
             contract_id: contract_id,
             caller_id: caller_id,
             block_number: slot,
@@ -105,6 +176,23 @@ impl<'a> EmulatorAccountStorage<'a> {
         }
     }
 
+    /// Storage that takes accounts, slot and timestamp from `cache` and
+    /// adds the accounts it has to fetch to it.
+    pub fn with_cache(config: &'a Config, contract_id: H160, caller_id: H160, cache: &'a AccountCache) -> EmulatorAccountStorage<'a> {
+        Self {
+            accounts: RefCell::new(HashMap::new()),
+            new_accounts: RefCell::new(HashMap::new()),
+            prefetched: RefCell::new(HashMap::new()),
+            lazy_accounts: RefCell::new(Vec::new()),
+            config: config,
+            cache: Some(cache),
+            contract_id: contract_id,
+            caller_id: caller_id,
+            block_number: cache.slot.get(),
+            block_timestamp: cache.timestamp.get(),
+        }
+    }
+
     pub fn get_account_from_solana(config: &'a Config, address: &H160) -> Option<(Account, Option<Account>)> {
         let solana_address =  Pubkey::find_program_address(&[&address.to_fixed_bytes()], &config.evm_loader).0;
         eprintln!("Not found account for 0x{} => {}", &hex::encode(&address.as_fixed_bytes()), &solana_address.to_string());
@@ -153,13 +241,99 @@ impl<'a> EmulatorAccountStorage<'a> {
         }    
     }
 
+    fn get_multiple_accounts(config: &Config, keys: &[Pubkey]) -> HashMap<Pubkey, Option<Account>> {
+        let mut result = HashMap::new();
+        for chunk in keys.chunks(MAX_MULTIPLE_ACCOUNTS) {
+            match config.rpc_client.get_multiple_accounts_with_commitment(chunk, CommitmentConfig::recent()) {
+                Ok(response) => result.extend(chunk.iter().cloned().zip(response.value.into_iter())),
+                // The accounts of a failed chunk are fetched one by one if they are used
+                Err(err) => eprintln!("get_multiple_accounts error: {}", err),
+            }
+        }
+        result
+    }
+
+    /// Same as get_account_from_solana for many addresses, with one
+    /// getMultipleAccounts for the accounts and one for their code accounts
+    /// (per 100 keys). Addresses that couldn't be fetched are left out.
+    pub fn get_accounts_from_solana(config: &Config, addresses: &[H160]) -> Vec<(H160, Option<(Account, Option<Account>)>)> {
+        let keys: Vec<Pubkey> = addresses.iter()
+            .map(|address| Pubkey::find_program_address(&[&address.to_fixed_bytes()], &config.evm_loader).0)
+            .collect();
+        let accounts = Self::get_multiple_accounts(config, &keys);
+
+        let mut result = Vec::new();
+        let mut found = Vec::new();
+        for (address, key) in addresses.iter().zip(keys.iter()) {
+            match accounts.get(key) {
+                None => continue,
+                Some(None) => result.push((*address, None)),
+                Some(Some(acc)) => match AccountData::unpack(&acc.data) {
+                    Ok(AccountData::Account(data)) => found.push((*address, acc.clone(), data.code_account)),
+                    _ => result.push((*address, None)),
+                },
+            }
+        }
+
+        let no_code = Pubkey::new_from_array([0u8; 32]);
+        let code_keys: Vec<Pubkey> = found.iter()
+            .map(|(_, _, code_account)| *code_account)
+            .filter(|code_account| *code_account != no_code)
+            .collect();
+        let code_accounts = Self::get_multiple_accounts(config, &code_keys);
+
+        for (address, acc, code_account) in found {
+            if code_account == no_code {
+                result.push((address, Some((acc, None))));
+            } else if let Some(code) = code_accounts.get(&code_account) {
+                result.push((address, Some((acc, code.clone()))));
+            }
+        }
+
+        result
+    }
+
+    /// Load the accounts of `addresses` (e.g. the accounts used by a previous
+    /// emulation of the same call) before execution instead of one by one
+    /// when the executor reaches them.
+    pub fn prefetch(&self, addresses: &[H160]) {
+        let mut prefetched = self.prefetched.borrow_mut();
+        let mut missing = Vec::new();
+        for address in addresses {
+            match self.cache.and_then(|cache| cache.lookup(address)) {
+                Some(entry) => { prefetched.insert(*address, entry); },
+                None => missing.push(*address),
+            }
+        }
+
+        for (address, entry) in Self::get_accounts_from_solana(&self.config, &missing) {
+            if let Some(cache) = self.cache {
+                cache.insert(address, entry.clone());
+            }
+            prefetched.insert(address, entry);
+        }
+        eprintln!("Prefetched {} of {} accounts", prefetched.len(), addresses.len());
+    }
+
     fn create_acc_if_not_exists(&self, address: &H160) -> bool {
         let mut accounts = self.accounts.borrow_mut(); 
         let mut new_accounts = self.new_accounts.borrow_mut(); 
         if accounts.get(address).is_none() {
             let solana_address =  Pubkey::find_program_address(&[&address.to_fixed_bytes()], &self.config.evm_loader).0;
 
-            match Self::get_account_from_solana(&self.config, address) {
+            let prefetched = self.prefetched.borrow().get(address).cloned();
+            let account = match prefetched {
+                Some(entry) => entry,
+                None => {
+                    self.lazy_accounts.borrow_mut().push(*address);
+                    match self.cache {
+                        Some(cache) => cache.get(&self.config, address),
+                        None => Self::get_account_from_solana(&self.config, address),
+                    }
+                }
+            };
+
+            match account {
                 Some((acc, code_account)) => {
                     accounts.insert(address.clone(), SolanaAccount::new(acc, solana_address, code_account));
                     true
@@ -211,6 +385,11 @@ impl<'a> EmulatorAccountStorage<'a> {
     }
 
     pub fn get_used_accounts(&self, status: &String, result: &std::vec::Vec<u8>)
+    {
+        println!("{}", self.used_accounts_json(status, result).to_string());
+    }
+
+    pub fn used_accounts_json(&self, status: &String, result: &std::vec::Vec<u8>) -> serde_json::Value
     {
         let mut arr = Vec::new();
 
@@ -250,9 +429,18 @@ impl<'a> EmulatorAccountStorage<'a> {
                 });
         }    
 
-        let js = json!({"accounts": arr, "result": &hex::encode(&result), "exit_status": &status}).to_string();
+        let lazy_accounts: Vec<String> = self.lazy_accounts.borrow().iter()
+            .map(|address| "0x".to_string() + &hex::encode(&address.to_fixed_bytes()))
+            .collect();
+
+        json!({"accounts": arr, "result": &hex::encode(&result), "exit_status": &status, "lazy_accounts": lazy_accounts})
+    }
 
-        println!("{}", js);
+    /// Addresses of the accounts the emulation used, existing or not.
+    pub fn used_addresses(&self) -> Vec<H160> {
+        let mut addresses: Vec<H160> = self.accounts.borrow().keys().cloned().collect();
+        addresses.extend(self.new_accounts.borrow().keys().cloned());
+        addresses
     }
 }
 
@@ -1,5 +1,5 @@
 mod account_storage;
-use crate::account_storage::EmulatorAccountStorage;
+use crate::account_storage::{AccountCache, EmulatorAccountStorage};
 
 use evm_loader::{
     instruction::EvmInstruction,
@@ -29,10 +29,11 @@ use serde_json::json;
 use std::{
     cmp::min,
     collections::HashMap,
-    io::{Read},
+    io::{self, BufRead, Read, Write},
     fs::File,
     env, str::FromStr,
     net::{SocketAddr, UdpSocket},
+    panic::{catch_unwind, AssertUnwindSafe},
     process::exit,
     sync::Arc,
     thread::sleep,
@@ -81,11 +82,9 @@ pub struct Config {
     signer: Box<dyn Signer>,
 }
 
-fn command_emulate(config: &Config, contract_id: H160, caller_id: H160, data: Vec<u8>) -> CommandResult {
-    let account_storage = EmulatorAccountStorage::new(config, contract_id, caller_id);
-
+fn emulate(account_storage: &EmulatorAccountStorage, contract_id: H160, caller_id: H160, data: Vec<u8>) -> (String, Vec<u8>) {
     let (exit_reason, result, applies_logs) = {
-        let backend = SolanaBackend::new(&account_storage, None);
+        let backend = SolanaBackend::new(account_storage, None);
         let config = evm::Config::istanbul();
         let mut executor = StackExecutor::new(&backend, usize::max_value(), &config);
     
@@ -124,11 +123,108 @@ fn command_emulate(config: &Config, contract_id: H160, caller_id: H160, data: Ve
         debug!("Not succeed execution");
     }
 
+    (status, result)
+}
+
+fn command_emulate(config: &Config, contract_id: H160, caller_id: H160, data: Vec<u8>, hints: &[H160]) -> CommandResult {
+    let account_storage = EmulatorAccountStorage::new(config, contract_id, caller_id);
+    if !hints.is_empty() {
+        account_storage.prefetch(hints);
+    }
+
+    let (status, result) = emulate(&account_storage, contract_id, caller_id, data);
+
     account_storage.get_used_accounts(&status, &result);
 
     Ok(())
 }
 
+fn request_str<'a>(request: &'a serde_json::Value, name: &str) -> Result<&'a str, Error> {
+    request[name].as_str().ok_or_else(|| format!("Missing field {}", name).into())
+}
+
+// Parse a batch request:
+// {"id": ..., "contract": "0x..", "caller": "0x..", "data": "0x..", "hints": ["0x..", ...]}
+fn parse_emulate_request(request: &serde_json::Value) -> Result<(H160, H160, Vec<u8>, Vec<H160>), Error> {
+    let contract = H160::from_str(make_clean_hex(request_str(request, "contract")?)).map_err(|e| e.to_string())?;
+    let caller = H160::from_str(make_clean_hex(request_str(request, "caller")?)).map_err(|e| e.to_string())?;
+    let data = hex::decode(make_clean_hex(request_str(request, "data").unwrap_or(""))).map_err(|e| e.to_string())?;
+    let mut hints = Vec::new();
+    if let Some(values) = request["hints"].as_array() {
+        for value in values {
+            let address = value.as_str().ok_or("Hint is not a string")?;
+            hints.push(H160::from_str(make_clean_hex(address)).map_err(|e| e.to_string())?);
+        }
+    }
+    Ok((contract, caller, data, hints))
+}
+
+// Accounts used by the previous emulation of a contract method, keyed by
+// contract and selector
+type EmulateHints = HashMap<(H160, Vec<u8>), Vec<H160>>;
+
+fn emulate_request(config: &Config, cache: &AccountCache, learned: &mut EmulateHints, line: &str) -> serde_json::Value {
+    let request: serde_json::Value = match serde_json::from_str(line) {
+        Ok(request) => request,
+        Err(err) => return json!({"id": null, "error": err.to_string()}),
+    };
+    let id = request["id"].clone();
+
+    let (contract, caller, data, mut hints) = match parse_emulate_request(&request) {
+        Ok(args) => args,
+        Err(err) => return json!({"id": id, "error": err.to_string()}),
+    };
+    let key = (contract, data[..min(4, data.len())].to_vec());
+    if let Some(previous) = learned.get(&key) {
+        hints.extend(previous.iter().cloned());
+    }
+    hints.push(caller);
+    hints.push(contract);
+    hints.sort();
+    hints.dedup();
+
+    cache.update_slot(config);
+    // RPC failures panic deep in the account storage; report them for this
+    // request and keep serving the others
+    let response = catch_unwind(AssertUnwindSafe(|| {
+        let account_storage = EmulatorAccountStorage::with_cache(config, contract, caller, cache);
+        account_storage.prefetch(&hints);
+        let (status, result) = emulate(&account_storage, contract, caller, data);
+        (account_storage.used_accounts_json(&status, &result), account_storage.used_addresses())
+    }));
+
+    match response {
+        Ok((mut response, used)) => {
+            learned.insert(key, used);
+            response["id"] = id;
+            response
+        },
+        Err(_) => json!({"id": id, "error": "emulation panicked"}),
+    }
+}
+
+fn command_emulate_batch(config: &Config) -> CommandResult {
+    let cache = AccountCache::new();
+    let mut learned = EmulateHints::new();
+    let stdin = io::stdin();
+    let stdout = io::stdout();
+
+    for line in stdin.lock().lines() {
+        let line = line?;
+        if line.trim().is_empty() {
+            continue;
+        }
+
+        let response = emulate_request(config, &cache, &mut learned, &line);
+
+        let mut out = stdout.lock();
+        writeln!(out, "{}", response.to_string())?;
+        out.flush()?;
+    }
+
+    Ok(())
+}
+
 fn command_create_program_address (
     config: &Config,
     seed: &str,
@@ -588,7 +684,7 @@ fn command_get_ether_account_data (
 }
 
 fn make_clean_hex<'a>(in_str: &'a str) -> &'a str {
-    if &in_str[..2] == "0x" {
+    if in_str.starts_with("0x") {
         &in_str[2..]
     } else {        
         &in_str
@@ -721,6 +817,21 @@ fn main() {
                         .validator(is_valid_hexdata)
                         .help("Transaction data")
                 )
+                .arg(
+                    Arg::with_name("hints")
+                        .long("hints")
+                        .value_name("ADDRESSES")
+                        .takes_value(true)
+                        .multiple(true)
+                        .use_delimiter(true)
+                        .validator(is_valid_h160)
+                        .help("Addresses to load before execution, e.g. the accounts of a previous emulation")
+                )
+        )
+        .subcommand(
+            SubCommand::with_name("emulate-batch")
+                .about("Emulate Ethereum transactions read from stdin, one JSON request per line \
+                        ({\"id\", \"contract\", \"caller\", \"data\"}), writing one JSON result per line")
         )
         .subcommand(
             SubCommand::with_name("create-ether-account")
@@ -851,8 +962,14 @@ fn main() {
                 let contract = h160_of(&arg_matches, "contract").unwrap();
                 let sender = h160_of(&arg_matches, "sender").unwrap();
                 let data = hexdata_of(&arg_matches, "data").unwrap();
+                let hints: Vec<H160> = arg_matches.values_of("hints")
+                    .map(|values| values.map(|value| H160::from_str(&make_clean_hex(value)).unwrap()).collect())
+                    .unwrap_or_default();
 
-                command_emulate(&config, contract, sender, data)
+                command_emulate(&config, contract, sender, data, &hints)
+            }
+            ("emulate-batch", Some(_)) => {
+                command_emulate_batch(&config)
             }
             ("create-program-address", Some(arg_matches)) => {
                 let seed = arg_matches.value_of("seed").unwrap().to_string();
@@ -0,0 +1,222 @@
+import base64
+import json
+import threading
+import time
+from collections import OrderedDict
+from hashlib import blake2b
+from solana_utils import http_client, getMultipleAccounts
+
+
+def _hex(value):
+    if isinstance(value, (bytes, bytearray)):
+        return value.hex()
+    value = value.lower()
+    return value[2:] if value.startswith('0x') else value
+
+
+def used_solana_accounts(result):
+    """Solana accounts an emulation read, from the "accounts" list printed
+    by `get_used_accounts`: each Ethereum account and its code account.
+    Accounts that didn't exist ("new") matter too: creating one can change
+    the result."""
+    keys = []
+    for account in result['accounts']:
+        keys.append(account['account'])
+        if account.get('contract'):
+            keys.append(account['contract'])
+    return keys
+
+
+def fingerprint(info):
+    """Version of an account for change detection: lamports, owner and a
+    hash of the data; None for a missing account."""
+    if info is None:
+        return None
+    data = base64.b64decode(info['data'][0])
+    return (info['lamports'], info['owner'], blake2b(data, digest_size=16).digest())
+
+
+class _Entry:
+    __slots__ = ('result', 'accounts', 'fingerprints', 'slot', 'size')
+
+    def __init__(self, result, accounts, fingerprints, slot, size):
+        self.result = result
+        self.accounts = accounts
+        self.fingerprints = fingerprints
+        self.slot = slot
+        self.size = size
+
+
+class EmulationCache:
+    """Results of `neon-cli emulate` keyed by (contract, caller, calldata).
+
+    An entry remembers the accounts the call used and their versions
+    (lamports, owner, data hash). Within the slot it was checked in, an
+    entry is returned as is; in a later slot its accounts are fetched again
+    (one getMultipleAccounts shared by every entry checked in that slot)
+    and the entry is dropped if any of them changed. `invalidate_accounts`
+    drops the entries of accounts known to change, e.g. after sending a
+    transaction that writes them.
+
+    Account versions are read before the emulation, so a change that
+    lands while it runs makes the entry fail its next check instead of
+    going unnoticed. The accounts of a call are only known from an earlier
+    emulation of it: the first result of a call is returned but not
+    cached, and its accounts are remembered so the next emulation can be.
+    Network requests are made without holding the lock."""
+
+    def __init__(self, client=http_client, max_entries=10000, max_bytes=64*1024*1024, slot_interval=0.4):
+        self.client = client
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.slot_interval = slot_interval
+
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()     # key -> _Entry, least recently used first
+        self.by_account = {}             # solana account -> set of keys
+        self.bytes = 0
+        self.slot = 0
+        self.slot_time = 0.0
+        self.versions = {}               # versions read in self.slot
+        self.known_accounts = OrderedDict()  # key -> accounts used by its last emulation
+        self.stats_counters = {'hits': 0, 'misses': 0, 'invalidations': 0, 'evictions': 0, 'validations': 0}
+
+    @staticmethod
+    def key(contract, caller, data):
+        return (_hex(contract), _hex(caller), _hex(data))
+
+    def current_slot(self):
+        """Slot of the cluster, asked at most once per `slot_interval`."""
+        now = time.monotonic()
+        if now - self.slot_time >= self.slot_interval:
+            self._set_slot(self.client.get_slot()['result'])
+            self.slot_time = now
+        return self.slot
+
+    def _set_slot(self, slot):
+        with self.lock:
+            if slot != self.slot:
+                self.slot = slot
+                self.versions = {}
+
+    def _read_versions(self, accounts):
+        """Versions of `accounts` in the current slot, fetching only those
+        not read in this slot yet. Called without the lock."""
+        with self.lock:
+            slot = self.slot
+            versions = {account: self.versions[account] for account in accounts if account in self.versions}
+        missing = [account for account in accounts if account not in versions]
+        if missing:
+            (_, infos) = getMultipleAccounts(self.client, missing)
+            fetched = dict(zip(missing, (fingerprint(info) for info in infos)))
+            versions.update(fetched)
+            with self.lock:
+                if self.slot == slot:
+                    self.versions.update(fetched)
+        return [versions[account] for account in accounts]
+
+    def get(self, contract, caller, data):
+        """Cached result of the call, None if it must be emulated."""
+        key = self.key(contract, caller, data)
+        slot = self.current_slot()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.stats_counters['misses'] += 1
+                return None
+            if entry.slot == slot:
+                self.entries.move_to_end(key)
+                self.stats_counters['hits'] += 1
+                return entry.result
+
+        versions = self._read_versions(entry.accounts)
+        with self.lock:
+            self.stats_counters['validations'] += 1
+            if self.entries.get(key) is not entry or versions != entry.fingerprints:
+                if self.entries.get(key) is entry:
+                    self._remove(key)
+                    self.stats_counters['invalidations'] += 1
+                self.stats_counters['misses'] += 1
+                return None
+            entry.slot = slot
+            self.entries.move_to_end(key)
+            self.stats_counters['hits'] += 1
+            return entry.result
+
+    def read_versions(self, contract, caller, data):
+        """{account: version} of the accounts the call used last time; to
+        be read before emulating it and passed to `put`."""
+        key = self.key(contract, caller, data)
+        with self.lock:
+            accounts = self.known_accounts.get(key, ())
+        return dict(zip(accounts, self._read_versions(accounts)))
+
+    def put(self, contract, caller, data, result, versions=None, slot=None):
+        """Store the result of an emulation (a dict with the "accounts"
+        list), given the `versions` of `read_versions` taken before it ran
+        in `slot`. Failed emulations aren't cached, nor are results that
+        used accounts without a version from before the emulation."""
+        if result.get('exit_status') != 'succeed':
+            return
+        key = self.key(contract, caller, data)
+        accounts = used_solana_accounts(result)
+        with self.lock:
+            self.known_accounts[key] = accounts
+            self.known_accounts.move_to_end(key)
+            while len(self.known_accounts) > self.max_entries:
+                self.known_accounts.popitem(last=False)
+            if versions is None or any(account not in versions for account in accounts):
+                return
+            fingerprints = [versions[account] for account in accounts]
+            size = len(json.dumps(result)) + sum(len(k) for k in key) + 64*len(accounts)
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = _Entry(result, accounts, fingerprints, self.slot if slot is None else slot, size)
+            self.bytes += size
+            for account in accounts:
+                self.by_account.setdefault(account, set()).add(key)
+            self._evict()
+
+    def emulate(self, contract, caller, data, emulator):
+        """Cached result, or the result of `emulator(contract, caller,
+        data)` (e.g. EmulatorClient.emulate), which is then cached."""
+        result = self.get(contract, caller, data)
+        if result is None:
+            slot = self.current_slot()
+            versions = self.read_versions(contract, caller, data)
+            result = emulator(contract, caller, data)
+            self.put(contract, caller, data, result, versions, slot)
+        return result
+
+    def invalidate_accounts(self, accounts):
+        """Drop every entry that used one of the Solana `accounts`."""
+        with self.lock:
+            for account in accounts:
+                self.versions.pop(str(account), None)
+                for key in list(self.by_account.get(str(account), ())):
+                    self._remove(key)
+                    self.stats_counters['invalidations'] += 1
+
+    def _remove(self, key):
+        entry = self.entries.pop(key)
+        self.bytes -= entry.size
+        for account in entry.accounts:
+            keys = self.by_account.get(account)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.by_account[account]
+
+    def _evict(self):
+        while self.entries and (len(self.entries) > self.max_entries or self.bytes > self.max_bytes):
+            self._remove(next(iter(self.entries)))
+            self.stats_counters['evictions'] += 1
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.stats_counters)
+            lookups = stats['hits'] + stats['misses']
+            stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+            stats['entries'] = len(self.entries)
+            stats['bytes'] = self.bytes
+            return stats
@@ -0,0 +1,122 @@
+import json
+import subprocess
+import threading
+from concurrent.futures import Future
+from solana_utils import solana_url, EVM_LOADER
+
+
+class EmulatorError(Exception):
+    pass
+
+
+class EmulatorClient:
+    """Long-lived `neon-cli emulate-batch` process.
+
+    Requests are written as JSON lines and answered in order by the same
+    process, which keeps the accounts it downloaded for the current slot.
+    `submit` doesn't wait for the answer, so many calls can be in flight;
+    `emulate` and `emulate_many` are the blocking forms. The result of a
+    request is the JSON printed by `neon-cli emulate`:
+    {"accounts": [...], "result": "<hex>", "exit_status": "succeed",
+    "lazy_accounts": [...]}.
+
+    The process prefetches the accounts a method used the last time it was
+    emulated, plus any `hints` (e.g. the "accounts" of an earlier result);
+    "lazy_accounts" lists the accounts that were fetched one by one during
+    execution.
+
+    A process that exits fails the requests in flight and is started again
+    on the next request."""
+
+    def __init__(self, evm_loader=EVM_LOADER, url=solana_url, command=None):
+        self.command = command or ['neon-cli', '--url', url, '--evm_loader', evm_loader, 'emulate-batch']
+        self.lock = threading.Lock()
+        # Writes get their own lock: a writer blocked on a full pipe must
+        # not stop the reader from draining answers
+        self.write_lock = threading.Lock()
+        self.process = None
+        self.pending = {}
+        self.next_id = 0
+
+    def _start(self):
+        self.process = subprocess.Popen(self.command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                        universal_newlines=True, bufsize=1)
+        reader = threading.Thread(target=self._read, args=(self.process,), daemon=True)
+        reader.start()
+
+    def _read(self, process):
+        for line in process.stdout:
+            try:
+                response = json.loads(line)
+            except ValueError:
+                continue
+            with self.lock:
+                future = self.pending.pop(response.get('id'), None)
+            if future is None:
+                continue
+            if 'error' in response:
+                future.set_exception(EmulatorError(response['error']))
+            else:
+                future.set_result(response)
+
+        process.wait()
+        with self.lock:
+            if self.process is process:
+                self.process = None
+            failed = list(self.pending.values())
+            self.pending.clear()
+        for future in failed:
+            future.set_exception(EmulatorError("neon-cli exited with code {}".format(process.returncode)))
+
+    def submit(self, contract, caller, data, hints=()):
+        """Send one emulation; returns a Future of its result."""
+        future = Future()
+        with self.lock:
+            if self.process is None:
+                self._start()
+            process = self.process
+            request_id = self.next_id
+            self.next_id += 1
+            self.pending[request_id] = future
+
+        request = {'id': request_id, 'contract': _hex(contract), 'caller': _hex(caller), 'data': _hex(data)}
+        if hints:
+            request['hints'] = [_hex(address) for address in hints]
+        try:
+            with self.write_lock:
+                process.stdin.write(json.dumps(request) + '\n')
+                process.stdin.flush()
+        except (BrokenPipeError, OSError, ValueError) as err:
+            with self.lock:
+                owned = self.pending.pop(request_id, None)
+            if owned is not None:
+                future.set_exception(EmulatorError("Can't write to neon-cli: {}".format(err)))
+        return future
+
+    def emulate(self, contract, caller, data, hints=(), timeout=None):
+        return self.submit(contract, caller, data, hints).result(timeout)
+
+    def emulate_many(self, calls, timeout=None):
+        """Results of (contract, caller, data[, hints]) calls, all sent
+        before the first answer is awaited."""
+        futures = [self.submit(*call) for call in calls]
+        return [future.result(timeout) for future in futures]
+
+    def close(self):
+        with self.lock:
+            process = self.process
+        if process is not None:
+            process.stdin.close()
+            process.wait()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _hex(value):
+    if isinstance(value, (bytes, bytearray)):
+        return value.hex()
+    return value[2:] if value.startswith('0x') else value
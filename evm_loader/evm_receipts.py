@@ -0,0 +1,130 @@
+from base58 import b58decode
+from typing import NamedTuple, List, Optional
+
+# First byte of the instructions the evm_loader invokes on itself
+# (see program/src/instruction.rs: on_return and on_event)
+ON_RETURN_TAG = 6
+ON_EVENT_TAG = 7
+
+# OnReturn exit statuses below this value are ExitSucceed codes (0x11..0x13),
+# 0xd0 is Revert, 0xe* are ExitError and 0xf* are ExitFatal codes
+FIRST_FAILED_STATUS = 0xd0
+
+
+class EvmLog(NamedTuple):
+    """Log emitted through OnEvent. `address`, `topics` and `data` are
+    memoryviews into the decoded instruction data."""
+    address: memoryview
+    topics: List[memoryview]
+    data: memoryview
+    signature: str
+    slot: int
+    instruction_index: int
+    log_index: int
+    transaction_index: Optional[int] = None  # position in the block, if known
+
+
+class EvmReceipt(NamedTuple):
+    """Result of one EVM call: the OnReturn of an evm_loader instruction
+    and the OnEvent logs emitted before it."""
+    signature: str
+    slot: int
+    instruction_index: int
+    exit_status: int
+    return_data: memoryview
+    logs: List[EvmLog]
+
+    @property
+    def status(self):
+        """Ethereum receipt status: 1 on success, 0 on revert or error."""
+        return 1 if self.exit_status < FIRST_FAILED_STATUS else 0
+
+
+def decode_on_return(data):
+    """Split OnReturn instruction data into (exit_status, return_data)."""
+    data = memoryview(data)
+    if data[0] != ON_RETURN_TAG:
+        raise Exception("Not an OnReturn instruction: tag {}".format(data[0]))
+    return (data[1], data[2:])
+
+
+def decode_on_event(data):
+    """Split OnEvent instruction data into (address, topics, data)."""
+    data = memoryview(data)
+    if data[0] != ON_EVENT_TAG:
+        raise Exception("Not an OnEvent instruction: tag {}".format(data[0]))
+    address = data[1:21]
+    count = int.from_bytes(data[21:29], 'little')
+    end = 29 + count*32
+    if len(data) < end:
+        raise Exception("OnEvent data too short for {} topics".format(count))
+    topics = [data[offset:offset+32] for offset in range(29, end, 32)]
+    return (address, topics, data[end:])
+
+
+def _signature(result):
+    transaction = result.get('transaction') or {}
+    signatures = transaction.get('signatures') or [None]
+    return signatures[0]
+
+
+def _program_indexes(result, program_id):
+    if program_id is None:
+        return None
+    keys = result['transaction']['message']['accountKeys']
+    return {i for (i, key) in enumerate(keys) if key == str(program_id)}
+
+
+def iter_instruction_data(result, program_id=None):
+    """Yield (instruction_index, data) for the inner instructions of a
+    confirmed transaction that are OnReturn or OnEvent. With `program_id`
+    only instructions of that program are decoded."""
+    indexes = _program_indexes(result, program_id)
+    for inner in (result.get('meta') or {}).get('innerInstructions') or []:
+        for instruction in inner['instructions']:
+            if indexes is not None and instruction['programIdIndex'] not in indexes:
+                continue
+            data = memoryview(b58decode(instruction['data']))
+            if len(data) and data[0] in (ON_RETURN_TAG, ON_EVENT_TAG):
+                yield (inner['index'], data)
+
+
+def block_results(block, slot):
+    """The transactions of a getConfirmedBlock result as
+    getConfirmedTransaction results, with their position in the block
+    under 'transactionIndex'."""
+    for (position, result) in enumerate(block['transactions']):
+        yield dict(result, slot=slot, transactionIndex=position)
+
+
+def iter_receipts(results, program_id=None):
+    """Decode a stream of confirmed transactions (getConfirmedTransaction
+    results) into EvmReceipts, one per OnReturn. Transactions are read
+    one at a time, so `results` may be a generator over many of them."""
+    for result in results:
+        if result is None:
+            continue
+        signature = _signature(result)
+        slot = result.get('slot')
+        position = result.get('transactionIndex')
+        logs = []
+        for (index, data) in iter_instruction_data(result, program_id):
+            if data[0] == ON_EVENT_TAG:
+                (address, topics, log_data) = decode_on_event(data)
+                logs.append(EvmLog(address, topics, log_data, signature, slot, index, len(logs), position))
+            else:
+                (exit_status, return_data) = decode_on_return(data)
+                yield EvmReceipt(signature, slot, index, exit_status, return_data, logs)
+                logs = []
+
+
+def iter_logs(results, program_id=None):
+    """Yield EvmLogs of successful calls only, like an Ethereum node does."""
+    for receipt in iter_receipts(results, program_id):
+        if receipt.status:
+            yield from receipt.logs
+
+
+def find_receipt(result, program_id=None) -> Optional[EvmReceipt]:
+    """Receipt of the first OnReturn in one confirmed transaction."""
+    return next(iter_receipts([result], program_id), None)
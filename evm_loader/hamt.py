@@ -0,0 +1,335 @@
+import base64
+import struct
+from bisect import bisect_left, insort
+
+# Layout of program/src/hamt.rs:
+#   [0..4)      last_used (also the head of the free list of item type 0)
+#   [4..128)    heads of the free lists of arrays with 1..31 items
+#   [128..256)  32 root pointers, one per low 5 bits of the key
+# A pointer is 0 (empty), pos|1 (item: 32-byte key and 32-byte value, both
+# little endian) or pos (array: u32 tag bitmap and one pointer per set bit).
+# Every level consumes 5 bits of the key; an item stores what is left of it.
+HEADER_LEN = 4*32*2
+ROOT_OFFSET = 4*32
+TAG_BITS = 5
+TAG_MASK = (1 << TAG_BITS) - 1
+
+CONTRACT_TAG = 2
+CONTRACT_HEADER_LEN = 1 + 32 + 4
+
+_u32 = struct.Struct('<I')
+
+
+class HamtError(Exception):
+    pass
+
+
+def _popcount(value):
+    return bin(value).count('1')
+
+
+class Hamt:
+    """Read-only view of contract storage kept in the `Hamt` format.
+
+    `data` is wrapped in a memoryview and never copied; lookups and
+    iteration read only the items they reach."""
+
+    def __init__(self, data):
+        self.data = memoryview(data)
+        if len(self.data) < HEADER_LEN:
+            raise HamtError("Storage data too small: {} bytes".format(len(self.data)))
+        self.last_used = _u32.unpack_from(self.data, 0)[0]
+        if self.last_used < HEADER_LEN or self.last_used > len(self.data):
+            raise HamtError("Invalid storage header: last_used {}".format(self.last_used))
+
+    @staticmethod
+    def from_code_account(data):
+        """Storage of a contract code account: it follows the Contract
+        header (tag, owner, code_size) and the code."""
+        data = memoryview(data)
+        if len(data) < CONTRACT_HEADER_LEN or data[0] != CONTRACT_TAG:
+            raise HamtError("Not a contract code account")
+        code_size = _u32.unpack_from(data, 1 + 32)[0]
+        return Hamt(data[CONTRACT_HEADER_LEN + code_size:])
+
+    def _u32(self, pos):
+        if pos + 4 > self.last_used:
+            raise HamtError("Pointer {} outside of used storage".format(pos))
+        return _u32.unpack_from(self.data, pos)[0]
+
+    def _u256(self, pos):
+        if pos + 32 > self.last_used:
+            raise HamtError("Item {} outside of used storage".format(pos))
+        return int.from_bytes(self.data[pos:pos+32], 'little')
+
+    def _slot(self, array_pos, tags, tag):
+        """Position of the pointer for `tag` in an array, None if absent."""
+        if not tags & (1 << tag):
+            return None
+        return array_pos + 4 + 4 * _popcount(tags & ((1 << tag) - 1))
+
+    def find(self, key):
+        """Value stored at `key`, None if the key is not set."""
+        ptr_pos = ROOT_OFFSET + 4 * (key & TAG_MASK)
+        key >>= TAG_BITS
+        while True:
+            d = self._u32(ptr_pos)
+            if d == 0:
+                return None
+            if d & 1:
+                pos = d & ~1
+                return self._u256(pos + 32) if self._u256(pos) == key else None
+            ptr_pos = self._slot(d, self._u32(d), key & TAG_MASK)
+            if ptr_pos is None:
+                return None
+            key >>= TAG_BITS
+
+    def get(self, key, default=0):
+        """eth_getStorageAt semantics: unset slots read as zero."""
+        value = self.find(key)
+        return default if value is None else value
+
+    def find_many(self, keys):
+        """Look up many keys at once. Keys sharing a path prefix share the
+        walk down to it, so every array is read once per call."""
+        result = {}
+        groups = {}
+        for key in set(keys):
+            groups.setdefault(key & TAG_MASK, []).append((key, key >> TAG_BITS))
+        stack = [(ROOT_OFFSET + 4 * tag, group) for (tag, group) in groups.items()]
+        while stack:
+            (ptr_pos, group) = stack.pop()
+            d = self._u32(ptr_pos)
+            if d == 0:
+                continue
+            if d & 1:
+                pos = d & ~1
+                stored = self._u256(pos)
+                for (key, rest) in group:
+                    if rest == stored:
+                        result[key] = self._u256(pos + 32)
+                continue
+            tags = self._u32(d)
+            children = {}
+            for (key, rest) in group:
+                children.setdefault(rest & TAG_MASK, []).append((key, rest >> TAG_BITS))
+            for (tag, child) in children.items():
+                slot = self._slot(d, tags, tag)
+                if slot is not None:
+                    stack.append((slot, child))
+        return result
+
+    def items(self):
+        """Lazily yield every (key, value) pair."""
+        stack = [(ROOT_OFFSET + 4 * tag, tag, TAG_BITS) for tag in reversed(range(32))]
+        while stack:
+            (ptr_pos, prefix, shift) = stack.pop()
+            d = self._u32(ptr_pos)
+            if d == 0:
+                continue
+            if d & 1:
+                pos = d & ~1
+                yield ((self._u256(pos) << shift) | prefix, self._u256(pos + 32))
+                continue
+            tags = self._u32(d)
+            slot = d + 4
+            children = []
+            for tag in range(32):
+                if tags & (1 << tag):
+                    children.append((slot, prefix | (tag << shift), shift + TAG_BITS))
+                    slot += 4
+            stack.extend(reversed(children))
+
+    def __iter__(self):
+        return self.items()
+
+    def __contains__(self, key):
+        return self.find(key) is not None
+
+
+MAX_NODE_SIZE = 4 + 32*4
+ITEM_SIZE = 64
+DIFF_BLOCK = 16*1024
+DIFF_CHUNK = 256
+
+
+def _pointer(hamt, array_pos, tags, tag):
+    slot = hamt._slot(array_pos, tags, tag)
+    return 0 if slot is None else hamt._u32(slot)
+
+
+def _root_pointers(hamt):
+    return [hamt._u32(ROOT_OFFSET + 4 * tag) for tag in range(32)]
+
+
+def _dirty_ranges(old, new):
+    """Byte ranges where two storage images differ, found by comparing
+    blocks and then chunks of the dirty blocks at memcmp speed."""
+    common = min(old.last_used, new.last_used)
+    ranges = []
+    for block in range(0, common, DIFF_BLOCK):
+        end = min(block + DIFF_BLOCK, common)
+        if old.data[block:end].tobytes() == new.data[block:end].tobytes():
+            continue
+        for chunk in range(block, end, DIFF_CHUNK):
+            chunk_end = min(chunk + DIFF_CHUNK, end)
+            if old.data[chunk:chunk_end].tobytes() != new.data[chunk:chunk_end].tobytes():
+                ranges.append((chunk, chunk_end))
+    if common < max(old.last_used, new.last_used):
+        ranges.append((common, max(old.last_used, new.last_used)))
+    return ranges
+
+
+def _collect_nodes(hamt, d, parent, nodes):
+    """Add (size, parent) of every node of the subtree at `d` to `nodes`."""
+    stack = [(d, parent)]
+    while stack:
+        (d, parent) = stack.pop()
+        if d == 0:
+            continue
+        if d & 1:
+            nodes[d & ~1] = (ITEM_SIZE, parent)
+            continue
+        tags = hamt._u32(d)
+        count = _popcount(tags)
+        nodes[d] = (4 + 4*count, parent)
+        stack.extend((hamt._u32(d + 4 + 4*i), d) for i in range(count))
+
+
+class HamtIndex:
+    """Position, size and parent array of every node reachable in one
+    storage image.
+
+    Building the index walks the whole tree once. `diff` then only visits
+    the nodes in changed byte ranges, their ancestors and the new nodes,
+    and updates the index to describe the newer image, so a chain of
+    snapshots (e.g. block by block) is diffed at the cost of its changes."""
+
+    def __init__(self, hamt):
+        self.hamt = hamt
+        self.nodes = {}     # pos -> (size, parent array pos or None for root)
+        for d in _root_pointers(hamt):
+            _collect_nodes(hamt, d, None, self.nodes)
+        self.starts = sorted(self.nodes)
+
+    def overlapping(self, begin, end):
+        """Positions of the nodes that have bytes in [begin, end)."""
+        i = bisect_left(self.starts, begin - MAX_NODE_SIZE)
+        while i < len(self.starts) and self.starts[i] < end:
+            pos = self.starts[i]
+            if pos + self.nodes[pos][0] > begin:
+                yield pos
+            i += 1
+
+    def dirty_subtrees(self, ranges):
+        """Nodes that are in a changed range or have a descendant in one."""
+        dirty = set()
+        for (begin, end) in ranges:
+            for pos in self.overlapping(begin, end):
+                while pos is not None and pos not in dirty:
+                    dirty.add(pos)
+                    pos = self.nodes[pos][1]
+        return dirty
+
+    def _apply(self, new, removed, added, reparented):
+        for pos in removed:
+            if pos in self.nodes:
+                del self.nodes[pos]
+                del self.starts[bisect_left(self.starts, pos)]
+        for (pos, node) in added.items():
+            if pos not in self.nodes:
+                insort(self.starts, pos)
+            self.nodes[pos] = node
+        for (pos, parent) in reparented.items():
+            self.nodes[pos] = (self.nodes[pos][0], parent)
+        self.hamt = new
+
+
+class _DiffState:
+    def __init__(self, old, new, dirty):
+        self.old = old
+        self.new = new
+        self.dirty = dirty
+        self.removed = set()
+        self.added = {}
+        self.reparented = {}
+
+
+def _subtree_items(hamt, d, prefix, shift):
+    stack = [(d, prefix, shift)]
+    while stack:
+        (d, prefix, shift) = stack.pop()
+        if d == 0:
+            continue
+        if d & 1:
+            pos = d & ~1
+            yield ((hamt._u256(pos) << shift) | prefix, hamt._u256(pos + 32))
+            continue
+        tags = hamt._u32(d)
+        slot = d + 4
+        for tag in range(32):
+            if tags & (1 << tag):
+                stack.append((hamt._u32(slot), prefix | (tag << shift), shift + TAG_BITS))
+                slot += 4
+
+
+def _diff_pointers(state, a, b, parent, prefix, shift):
+    old, new = state.old, state.new
+    if a == b and (a == 0 or (a & ~1) not in state.dirty):
+        if a != 0:
+            state.reparented[a & ~1] = parent
+        return
+
+    if a and b and not a & 1 and not b & 1:
+        state.removed.add(a)
+        tags_a, tags_b = old._u32(a), new._u32(b)
+        state.added[b] = (4 + 4*_popcount(tags_b), parent)
+        for tag in range(32):
+            bit = 1 << tag
+            if (tags_a | tags_b) & bit:
+                yield from _diff_pointers(state,
+                        _pointer(old, a, tags_a, tag), _pointer(new, b, tags_b, tag),
+                        b, prefix | (tag << shift), shift + TAG_BITS)
+        return
+
+    # An item was split into an array, a slot was filled or emptied, or two
+    # different items share the slot: compare the (small) subtrees by key
+    before = dict(_subtree_items(old, a, prefix, shift))
+    after = dict(_subtree_items(new, b, prefix, shift))
+    removed = {}
+    _collect_nodes(old, a, None, removed)
+    state.removed.update(removed)
+    _collect_nodes(new, b, parent, state.added)
+    for key in sorted(before.keys() | after.keys()):
+        (va, vb) = (before.get(key), after.get(key))
+        if va != vb:
+            yield (key, va, vb)
+
+
+def diff(old, new, index=None):
+    """Yield (key, old_value, new_value) for every slot that differs between
+    two storage images; old_value is None for added slots and new_value
+    is None for removed ones.
+
+    Subtrees whose nodes all lie in byte ranges that are equal in both
+    images are skipped without being read. `index` is a HamtIndex of
+    `old`; when the generator is exhausted it describes `new`, so it can
+    be passed to the diff with the next snapshot."""
+    if index is None:
+        index = HamtIndex(old)
+    elif index.hamt is not old:
+        raise HamtError("Index doesn't describe the old storage image")
+
+    state = _DiffState(old, new, index.dirty_subtrees(_dirty_ranges(old, new)))
+    roots_a, roots_b = _root_pointers(old), _root_pointers(new)
+    for tag in range(32):
+        yield from _diff_pointers(state, roots_a[tag], roots_b[tag], None, tag, TAG_BITS)
+    index._apply(new, state.removed, state.added, state.reparented)
+
+
+def getStorageAt(client, code_account, key):
+    """eth_getStorageAt from the raw data of a contract code account."""
+    info = client.get_account_info(code_account)['result']['value']
+    if info is None:
+        raise Exception("Can't get information about {}".format(code_account))
+    return Hamt.from_code_account(base64.b64decode(info['data'][0])).get(key)
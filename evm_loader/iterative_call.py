@@ -0,0 +1,432 @@
+from solana.transaction import AccountMeta, TransactionInstruction, Transaction
+from solana.rpc.types import TxOpts
+from solana.publickey import PublicKey
+import re
+import time
+from eth_tx_utils import make_keccak_instruction_data, unpack
+from solana_utils import http_client
+from evm_receipts import find_receipt
+
+keccakprog = "KeccakSecp256k11111111111111111111111111111"
+sysinstruct = "Sysvar1nstructions1111111111111111111111111"
+sysvarclock = "SysvarC1ock11111111111111111111111111111111"
+
+DEFAULT_COMPUTE_BUDGET = 200000
+
+LOG_INVOKE = re.compile(r"^Program (\w+) invoke \[(\d+)\]$")
+LOG_CONSUMED = re.compile(r"^Program (\w+) consumed (\d+) of (\d+) compute units$")
+LOG_EXIT = re.compile(r"^Program (\w+) (success|failed.*)$")
+
+# Errors are compared without spaces and underscores, so both RPC messages
+# ("invalid account data for instruction") and status errors
+# ({'InstructionError': [0, 'InvalidAccountData']}) match. Solana 1.6
+# reports an exhausted compute budget as ProgramFailedToComplete ("Program
+# failed to complete"); only the simulation logs name the cause.
+BUDGET_EXCEEDED_ERRORS = (
+    "programfailedtocomplete",
+    "exceededmaximumnumberofinstructions",
+    "computationalbudgetexceeded",
+)
+BUDGET_EXCEEDED_LOGS = (
+    "exceeded maximum number of instructions",
+    "computational budget exceeded",
+)
+STORAGE_RELEASED_ERRORS = (
+    "invalidaccountdata",
+)
+
+
+def call_accounts(program_id, contract, code, caller, extra=()):
+    """Account metas of an iterative call that follow the storage account."""
+    keys = [
+        AccountMeta(pubkey=PublicKey(contract), is_signer=False, is_writable=True),
+        AccountMeta(pubkey=PublicKey(code), is_signer=False, is_writable=True),
+        AccountMeta(pubkey=PublicKey(caller), is_signer=False, is_writable=True),
+        AccountMeta(pubkey=PublicKey(sysinstruct), is_signer=False, is_writable=False),
+        AccountMeta(pubkey=PublicKey(program_id), is_signer=False, is_writable=False),
+        AccountMeta(pubkey=PublicKey(sysvarclock), is_signer=False, is_writable=False),
+    ]
+    keys.extend(extra)
+    return keys
+
+
+def partial_call_instruction(program_id, storage, accounts, step_count, from_addr, sign, msg):
+    return TransactionInstruction(program_id=program_id,
+            data=bytes.fromhex("09") + step_count.to_bytes(8, byteorder='little') + from_addr + sign + msg,
+            keys=[AccountMeta(pubkey=storage, is_signer=False, is_writable=True)] + list(accounts))
+
+
+def continue_instruction(program_id, storage, accounts, step_count):
+    return TransactionInstruction(program_id=program_id,
+            data=bytes.fromhex("0A") + step_count.to_bytes(8, byteorder='little'),
+            keys=[AccountMeta(pubkey=storage, is_signer=False, is_writable=True)] + list(accounts))
+
+
+def cancel_instruction(program_id, storage, accounts):
+    return TransactionInstruction(program_id=program_id,
+            data=bytes.fromhex("0C"),
+            keys=[AccountMeta(pubkey=storage, is_signer=False, is_writable=True)] + list(accounts))
+
+
+def keccak_instruction(msg_len, check_instruction_index=1, data_start=9):
+    return TransactionInstruction(program_id=keccakprog,
+            data=make_keccak_instruction_data(check_instruction_index, msg_len, data_start),
+            keys=[AccountMeta(pubkey=PublicKey(keccakprog), is_signer=False, is_writable=False)])
+
+
+def compute_units_consumed(result, program_id):
+    """Return (consumed, budget) of the top-level `program_id` instruction
+    of a confirmed transaction, or None when the logs don't report it."""
+    logs = (result.get('meta') or {}).get('logMessages') or []
+    program_id = str(program_id)
+    stack = []
+    found = None
+    for line in logs:
+        m = LOG_INVOKE.match(line)
+        if m:
+            stack.append(m.group(1))
+            continue
+        m = LOG_CONSUMED.match(line)
+        if m:
+            if len(stack) == 1 and m.group(1) == program_id:
+                found = (int(m.group(2)), int(m.group(3)))
+            continue
+        m = LOG_EXIT.match(line)
+        if m and stack:
+            stack.pop()
+    return found
+
+
+def _error_matches(err, patterns):
+    message = str(err).lower().replace(' ', '').replace('_', '')
+    return any(e in message for e in patterns)
+
+
+def _simulation_logs(err):
+    """Logs of the preflight simulation carried by a SendTransactionError."""
+    result = getattr(err, 'result', None)
+    data = result.get('data') if isinstance(result, dict) else None
+    return data.get('logs') if isinstance(data, dict) else None
+
+
+def is_budget_exceeded(err):
+    """The transaction ran out of compute units. A failed preflight is
+    decided by its logs, since ProgramFailedToComplete also covers other
+    VM errors; a status error only has the error kind to go by."""
+    logs = _simulation_logs(err)
+    if logs:
+        return any(pattern in line.lower() for line in logs for pattern in BUDGET_EXCEEDED_LOGS)
+    return _error_matches(err, BUDGET_EXCEEDED_ERRORS)
+
+
+def is_storage_released(err):
+    """Continue failed because the storage account no longer holds a call."""
+    return _error_matches(err, STORAGE_RELEASED_ERRORS)
+
+
+def history_key(contract, msg):
+    """Key the step-count history by contract and function selector."""
+    (fields, _) = unpack(memoryview(msg))
+    call_data = fields[5] or b''
+    return (str(contract), bytes(call_data[:4]))
+
+
+class StepCountTuner:
+    """Picks the step count of the next Continue from the compute units
+    consumed by the previous ones.
+
+    The cost of one EVM step is estimated as consumed/steps of the last
+    transaction and the next step count is chosen to use `target` of the
+    budget. Estimates are remembered per (contract, selector) so a later call
+    of the same function starts near the best value."""
+
+    def __init__(self, compute_budget=DEFAULT_COMPUTE_BUDGET, target=0.8,
+                 default_steps=50, min_steps=10, max_steps=10000, max_growth=4, smoothing=0.5):
+        self.compute_budget = compute_budget
+        self.target = target
+        self.default_steps = default_steps
+        self.min_steps = min_steps
+        self.max_steps = max_steps
+        self.max_growth = max_growth
+        self.smoothing = smoothing
+        self.history = {}
+
+    def _clamp(self, steps):
+        return max(self.min_steps, min(self.max_steps, int(steps)))
+
+    def _steps_for(self, units_per_step, budget):
+        return self._clamp(budget * self.target / units_per_step)
+
+    def initial_steps(self, key):
+        units_per_step = self.history.get(key)
+        if units_per_step is None:
+            return self.default_steps
+        return self._steps_for(units_per_step, self.compute_budget)
+
+    def next_steps(self, key, steps, consumed, budget=None):
+        budget = budget or self.compute_budget
+        if consumed <= 0 or steps <= 0:
+            return self._clamp(steps * self.max_growth)
+
+        units_per_step = consumed / steps
+        previous = self.history.get(key)
+        if previous is not None:
+            units_per_step = self.smoothing * units_per_step + (1 - self.smoothing) * previous
+        self.history[key] = units_per_step
+
+        return min(self._steps_for(units_per_step, budget), self._clamp(steps * self.max_growth))
+
+    def budget_exceeded(self, key, steps):
+        """The transaction ran out of compute units: remember a pessimistic
+        estimate and halve the step count."""
+        units_per_step = self.compute_budget / steps
+        previous = self.history.get(key)
+        self.history[key] = max(units_per_step, previous or 0)
+        return self._clamp(steps // 2)
+
+
+class StepCounts:
+    """Step counts of the Continues of one call sent one at a time, without
+    the I/O: IterativeCaller.run and AsyncEvmLoader.run send a Continue of
+    `steps` steps and report how it went."""
+
+    def __init__(self, tuner, key, program_id):
+        self.tuner = tuner
+        self.key = key
+        self.program_id = program_id
+        self.steps = tuner.initial_steps(key)
+
+    def failed(self, err):
+        """The Continue failed with `err`; True if it ran out of compute
+        units and is to be sent again with fewer steps."""
+        if not is_budget_exceeded(err) or self.steps <= self.tuner.min_steps:
+            return False
+        self.steps = self.tuner.budget_exceeded(self.key, self.steps)
+        return True
+
+    def confirmed(self, result):
+        """The Continue was confirmed as `result`; True if the call returned."""
+        if find_receipt(result) is not None:
+            return True
+        consumed = compute_units_consumed(result, self.program_id)
+        if consumed is not None:
+            self.steps = self.tuner.next_steps(self.key, self.steps, *consumed)
+        return False
+
+
+class ContinuePipeline:
+    """Continues of one call kept `window` at a time in flight, without the
+    I/O (see IterativeCaller.run_pipelined): the caller sends a Continue
+    for every `next_step_count`, passes the signatures of `in_flight` with
+    their statuses to `update`, and the transactions of `unfetched` to
+    `fetched`, until `result` is set or `stalled` says the storage was
+    released by a transaction no longer tracked."""
+
+    def __init__(self, tuner, key, program_id, window, pending_timeout):
+        self.tuner = tuner
+        self.key = key
+        self.program_id = program_id
+        self.window = window
+        self.pending_timeout = pending_timeout
+        self.steps = tuner.initial_steps(key)
+        self.in_flight = {}     # signature -> (step_count, sent_at)
+        self.unfetched = {}     # signature -> step_count: succeeded, transaction not yet available
+        self.lost = []
+        self.seen = set()
+        self.result = None
+        self.released = False
+        self.offset = 0
+        self.duplicates = 0
+
+    def next_step_count(self):
+        """Step count of the next Continue to send, None when the window is
+        full or the call is over. The step counts of a window differ, so
+        that their transactions differ too."""
+        if (self.released or len(self.in_flight) + len(self.unfetched) >= self.window
+                or self.duplicates >= self.window):
+            return None
+        step_count = self.steps + self.offset % self.window
+        self.offset += 1
+        return step_count
+
+    def sent(self, signature, step_count, now):
+        """A signature seen before (the blockhash didn't change since an
+        earlier window) isn't tracked twice; the next step count is tried."""
+        if signature in self.seen:
+            self.duplicates += 1
+            return
+        self.seen.add(signature)
+        self.in_flight[signature] = (step_count, now)
+
+    def update(self, signatures, statuses, now):
+        """Take the getSignatureStatuses `statuses` of `signatures`."""
+        self.duplicates = 0
+        for (signature, status) in zip(signatures, statuses):
+            (step_count, sent_at) = self.in_flight[signature]
+            if status is None:
+                if now - sent_at > self.pending_timeout:
+                    # Dropped or still waiting for a leader: forget it, but
+                    # look it up again if the call ends without OnReturn
+                    del self.in_flight[signature]
+                    self.lost.append(signature)
+                continue
+            del self.in_flight[signature]
+            if status['err'] is None:
+                self.unfetched[signature] = step_count
+            elif is_storage_released(status['err']):
+                self.released = True
+            elif is_budget_exceeded(status['err']):
+                if step_count <= self.tuner.min_steps:
+                    raise Exception("Continue {} failed: {}".format(signature, status['err']))
+                self.steps = min(self.steps, self.tuner.budget_exceeded(self.key, step_count))
+            else:
+                raise Exception("Continue {} failed: {}".format(signature, status['err']))
+
+    def fetched(self, signature, trx_result):
+        """Take the confirmed transaction of an `unfetched` signature, None
+        if not available yet; True once the call has returned."""
+        if trx_result is None:
+            return False
+        step_count = self.unfetched.pop(signature)
+        if find_receipt(trx_result) is not None:
+            self.result = trx_result
+            self.released = True
+            return True
+        consumed = compute_units_consumed(trx_result, self.program_id)
+        if consumed is not None:
+            self.steps = self.tuner.next_steps(self.key, step_count, *consumed)
+        return False
+
+    def stalled(self):
+        """The storage was released without an OnReturn among the tracked
+        transactions: it may be in one of `lost`."""
+        return self.result is None and self.released and not self.in_flight and not self.unfetched
+
+    def undrained(self):
+        """Signatures that may still land after the call returned."""
+        return list(self.in_flight) + self.lost
+
+
+class IterativeCaller:
+    """Drives PartialCallFromRawEthereumTX/Continue until OnReturn,
+    adjusting the step count of every Continue with a StepCountTuner."""
+
+    def __init__(self, signer, program_id, client=http_client, tuner=None, begin_steps=10, opts=None,
+                 storage_pool=None, pipeline_window=1, poll_interval=0.4, pending_timeout=60):
+        self.signer = signer
+        self.program_id = program_id
+        self.client = client
+        self.tuner = tuner or StepCountTuner()
+        self.storage_pool = storage_pool
+        self.begin_steps = begin_steps
+        self.opts = opts or TxOpts(skip_confirmation=False, preflight_commitment="root")
+        self.pipeline_window = pipeline_window
+        self.poll_interval = poll_interval
+        self.pending_timeout = pending_timeout
+
+    def send(self, trx):
+        return self.client.send_transaction(trx, self.signer, opts=self.opts)["result"]
+
+    def begin(self, storage, accounts, from_addr, sign, msg, step_count=None):
+        trx = Transaction()
+        trx.add(keccak_instruction(len(msg)))
+        trx.add(partial_call_instruction(self.program_id, storage, accounts,
+                step_count or self.begin_steps, from_addr, sign, msg))
+        return self.send(trx)
+
+    def step(self, storage, accounts, step_count):
+        trx = Transaction()
+        trx.add(continue_instruction(self.program_id, storage, accounts, step_count))
+        return self.send(trx)
+
+    def cancel(self, storage, accounts):
+        trx = Transaction()
+        trx.add(cancel_instruction(self.program_id, storage, accounts))
+        return self.send(trx)
+
+    def run(self, storage, accounts, key=None):
+        """Send Continue transactions until the call returns."""
+        if self.pipeline_window > 1:
+            return self.run_pipelined(storage, accounts, key)
+
+        counts = StepCounts(self.tuner, key, self.program_id)
+        while True:
+            try:
+                result = self.step(storage, accounts, counts.steps)
+            except Exception as err:
+                if not counts.failed(err):
+                    raise
+                continue
+            if counts.confirmed(result):
+                return result
+
+    def run_pipelined(self, storage, accounts, key=None):
+        """Keep `pipeline_window` Continue transactions in flight without
+        waiting for each one to be confirmed.
+
+        All Continues lock the same storage and contract accounts, so the
+        cluster executes them one after another; each one advances the call
+        from whatever state the previous one saved, so their order doesn't
+        matter. Two Continues with the same step count signed with the same
+        blockhash have the same signature, so the step counts of a window
+        differ, and a send whose signature was seen before (the blockhash
+        didn't change since an earlier window) is retried with the next
+        step count instead of being tracked twice. Once the call has
+        returned, the storage account is Empty and late Continues fail
+        harmlessly with InvalidAccountData. They are drained before
+        returning, including the ones that timed out, so a pooled storage
+        account is not released while they can still land."""
+        pipeline = ContinuePipeline(self.tuner, key, self.program_id, self.pipeline_window, self.pending_timeout)
+        opts = TxOpts(skip_confirmation=True, skip_preflight=True)
+
+        while pipeline.result is None:
+            for step_count in iter(pipeline.next_step_count, None):
+                trx = Transaction()
+                trx.add(continue_instruction(self.program_id, storage, accounts, step_count))
+                signature = self.client.send_transaction(trx, self.signer, opts=opts)["result"]
+                pipeline.sent(signature, step_count, time.monotonic())
+
+            time.sleep(self.poll_interval)
+
+            signatures = list(pipeline.in_flight)
+            statuses = self.client.get_signature_statuses(signatures)['result']['value'] if signatures else []
+            pipeline.update(signatures, statuses, time.monotonic())
+
+            for signature in list(pipeline.unfetched):
+                if pipeline.fetched(signature, self.client.get_confirmed_transaction(signature)['result']):
+                    break
+
+            if pipeline.stalled():
+                # The storage was released by a transaction we stopped tracking
+                for signature in pipeline.lost:
+                    trx_result = self.client.get_confirmed_transaction(signature)['result']
+                    if trx_result is not None and find_receipt(trx_result) is not None:
+                        return trx_result
+                raise Exception("Storage {} was released without OnReturn".format(storage))
+
+        self._drain(pipeline.undrained())
+        return pipeline.result
+
+    def _drain(self, signatures):
+        """Wait up to `pending_timeout` until `signatures` have a status."""
+        pending = set(signatures)
+        deadline = time.monotonic() + self.pending_timeout
+        while pending and time.monotonic() < deadline:
+            time.sleep(self.poll_interval)
+            signatures = list(pending)
+            statuses = self.client.get_signature_statuses(signatures)['result']['value']
+            for (signature, status) in zip(signatures, statuses):
+                if status is not None:
+                    pending.discard(signature)
+
+    def call(self, storage, accounts, from_addr, sign, msg, key=None):
+        """Execute the call in `storage`, or in an account leased from
+        `storage_pool` when `storage` is None."""
+        if key is None:
+            key = history_key(accounts[0].pubkey, msg)
+        if storage is None:
+            with self.storage_pool.lease() as storage:
+                self.begin(storage, accounts, from_addr, sign, msg)
+                return self.run(storage, accounts, key)
+        self.begin(storage, accounts, from_addr, sign, msg)
+        return self.run(storage, accounts, key)
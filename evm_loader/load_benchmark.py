@@ -0,0 +1,265 @@
+"""Throughput and latency of evm_loader calls under concurrent load.
+
+    SOLANA_URL=http://localhost:8899 EVM_LOADER=<program id> \\
+        python3 load_benchmark.py --workers 16 --duration 60 --mix call=8,partial=1,deploy=1
+
+Every worker has its own fee payer and Ethereum caller, so the only
+accounts the workers share are the contract ones. Operations:
+  call     CallFromRawEthereumTX of helloWorld.callHelloWorld()
+  partial  the same call as PartialCallFromRawEthereumTX + Continue
+           (IterativeCaller, storage accounts from a StorageAccountPool)
+  deploy   `neon-cli deploy` of the contract (serialized: neon-cli signs
+           with the wallet of the solana config)
+The latency of an operation is the time from sending its first
+transaction to the confirmation of its last one. The JSON report has
+TPS, p50/p95/p99 latency and failure causes, overall and per operation;
+it is the last line of the output.
+"""
+import argparse
+import json
+import math
+import os
+import random
+import threading
+import time
+from solana.account import Account
+from solana.transaction import Transaction, TransactionInstruction
+from solana.rpc.types import TxOpts
+from sha3 import keccak_256
+from eth_keys import keys as eth_keys
+from eth_tx_utils import make_instruction_data_from_tx
+from solana_utils import (http_client, EvmLoader, WalletAccount, wallet_path, getBalance,
+                          getTransactionCount, solana2ether, confirm_transaction)
+from iterative_call import (IterativeCaller, call_accounts, keccak_instruction,
+                            is_budget_exceeded, is_storage_released)
+from storage_pool import StorageAccountPool, StoragePoolExhausted
+from blockhash_cache import BlockhashCache
+
+CONTRACTS_DIR = os.environ.get("CONTRACTS_DIR", "evm_loader/")
+CHAIN_ID = 111
+CALL_HELLO_WORLD = keccak_256(b"callHelloWorld()").digest()[:4]
+WORKLOADS = ('call', 'partial', 'deploy')
+
+FAILURE_CAUSES = (
+    ("blockhash", "blockhash_not_found"),
+    ("accountinuse", "account_in_use"),
+    ("insufficient", "insufficient_funds"),
+    ("timeout", "timeout"),
+    ("timedout", "timeout"),
+    ("couldnotconfirm", "timeout"),
+    ("invalidnonce", "invalid_nonce"),
+)
+
+
+def failure_cause(err):
+    """Short name of the reason an operation failed."""
+    if isinstance(err, StoragePoolExhausted):
+        return "storage_pool_exhausted"
+    if is_budget_exceeded(err):
+        return "budget_exceeded"
+    if is_storage_released(err):
+        return "invalid_account_data"
+    text = str(err).lower().replace(" ", "").replace("_", "")
+    for (pattern, cause) in FAILURE_CAUSES:
+        if pattern in text:
+            return cause
+    return type(err).__name__
+
+
+def percentile(values, q):
+    """Nearest-rank percentile of sorted `values`."""
+    if not values:
+        return None
+    rank = max(1, math.ceil(q * len(values) / 100))
+    return values[rank - 1]
+
+
+def latency_summary(latencies):
+    latencies = sorted(latencies)
+    if not latencies:
+        return None
+    return {
+        'p50': round(percentile(latencies, 50), 4),
+        'p95': round(percentile(latencies, 95), 4),
+        'p99': round(percentile(latencies, 99), 4),
+        'mean': round(sum(latencies) / len(latencies), 4),
+        'max': round(latencies[-1], 4),
+    }
+
+
+def summarize(records, elapsed, workers):
+    """JSON report of (workload, latency, cause) records; cause is None
+    for operations that succeeded."""
+    def stats(selected):
+        succeeded = [latency for (_, latency, cause) in selected if cause is None]
+        return {
+            'operations': len(selected),
+            'succeeded': len(succeeded),
+            'failed': len(selected) - len(succeeded),
+            'tps': round(len(succeeded) / elapsed, 2) if elapsed > 0 else 0.0,
+            'latency': latency_summary(succeeded),
+        }
+
+    failures = {}
+    for (_, _, cause) in records:
+        if cause is not None:
+            failures[cause] = failures.get(cause, 0) + 1
+
+    report = {'workers': workers, 'elapsed': round(elapsed, 2)}
+    report.update(stats(records))
+    report['workloads'] = {name: stats([r for r in records if r[0] == name])
+                           for name in WORKLOADS if any(r[0] == name for r in records)}
+    report['failures'] = failures
+    return report
+
+
+def parse_mix(text):
+    """"call=8,partial=1" -> {'call': 8.0, 'partial': 1.0}"""
+    mix = {}
+    for item in text.split(','):
+        (name, _, weight) = item.partition('=')
+        if name not in WORKLOADS:
+            raise ValueError("Unknown workload {}".format(name))
+        mix[name] = float(weight or 1)
+    return mix
+
+
+class Worker:
+    """Fee payer and Ethereum caller of one load thread. The nonce is
+    tracked locally and read again after a failure."""
+
+    def __init__(self, benchmark, lamports=10**10):
+        self.benchmark = benchmark
+        self.acc = Account()
+        client = benchmark.client
+        confirm_transaction(client, client.request_airdrop(self.acc.public_key(), lamports)['result'])
+
+        self.ether = eth_keys.PrivateKey(self.acc.secret_key()).public_key.to_canonical_address()
+        (self.caller, _) = benchmark.loader.ether2program(self.ether)
+        if getBalance(self.caller) == 0:
+            benchmark.loader.createEtherAccount(self.ether)
+        self.nonce = getTransactionCount(client, self.caller)
+        self.iterative = IterativeCaller(self.acc, benchmark.loader.loader_id, client=client,
+                                         opts=benchmark.opts, storage_pool=benchmark.storage_pool)
+
+    def signed_call(self):
+        tx = {'to': self.benchmark.contract_eth, 'value': 0, 'gas': 0, 'gasPrice': 0,
+              'nonce': self.nonce, 'data': CALL_HELLO_WORLD, 'chainId': CHAIN_ID}
+        return make_instruction_data_from_tx(tx, self.acc.secret_key())
+
+    def accounts(self):
+        return call_accounts(self.benchmark.loader.loader_id, self.benchmark.contract,
+                             self.benchmark.code, self.caller)
+
+    def call(self):
+        (from_addr, sign, msg) = self.signed_call()
+        trx = Transaction()
+        trx.add(keccak_instruction(len(msg), data_start=1))
+        trx.add(TransactionInstruction(program_id=self.benchmark.loader.loader_id,
+                                       data=bytes.fromhex("05") + from_addr + sign + msg,
+                                       keys=self.accounts()))
+        self.benchmark.blockhash_cache.send_transaction(trx, self.acc, opts=self.benchmark.opts)
+        self.nonce += 1
+
+    def partial(self):
+        (from_addr, sign, msg) = self.signed_call()
+        self.iterative.call(None, self.accounts(), from_addr, sign, msg)
+        self.nonce += 1
+
+    def deploy(self):
+        with self.benchmark.deploy_lock:
+            self.benchmark.loader.deploy(self.benchmark.contract_path)
+
+    def run(self, workload):
+        try:
+            getattr(self, workload)()
+        except Exception:
+            self.nonce = getTransactionCount(self.benchmark.client, self.caller)
+            raise
+
+
+class LoadBenchmark:
+    def __init__(self, loader, contract_path, workers=8, mix=None, client=http_client,
+                 commitment="confirmed", storage_accounts=None):
+        self.loader = loader
+        self.contract_path = contract_path
+        self.workers = workers
+        self.mix = mix or {'call': 1.0}
+        self.client = client
+        self.opts = TxOpts(skip_confirmation=False, preflight_commitment=commitment)
+        self.blockhash_cache = BlockhashCache(client)
+        self.deploy_lock = threading.Lock()
+        self.storage_pool = None
+        if 'partial' in self.mix:
+            self.storage_pool = StorageAccountPool(loader.acc.get_acc(), loader.loader_id, client=client,
+                                                   min_size=storage_accounts or workers,
+                                                   max_size=storage_accounts or workers)
+
+        (self.contract, self.contract_eth, self.code) = loader.deployChecked(
+                contract_path, solana2ether(loader.acc.get_acc().public_key()))
+        self.records = []
+        self.lock = threading.Lock()
+
+    def setup(self):
+        if self.storage_pool is not None:
+            self.storage_pool.warm_up()
+        return [Worker(self) for _ in range(self.workers)]
+
+    def _loop(self, worker, rnd, deadline, remaining):
+        names = list(self.mix)
+        weights = [self.mix[name] for name in names]
+        while time.monotonic() < deadline:
+            with self.lock:
+                if remaining is not None:
+                    if remaining[0] <= 0:
+                        return
+                    remaining[0] -= 1
+            workload = rnd.choices(names, weights)[0]
+            start = time.monotonic()
+            cause = None
+            try:
+                worker.run(workload)
+            except Exception as err:
+                cause = failure_cause(err)
+            with self.lock:
+                self.records.append((workload, time.monotonic() - start, cause))
+
+    def run(self, duration=60, count=None, seed=None):
+        """Run the workers for `duration` seconds or `count` operations,
+        whichever ends first, and return the report."""
+        workers = self.setup()
+        self.records = []
+        remaining = None if count is None else [count]
+        deadline = time.monotonic() + (duration if duration is not None else float('inf'))
+        threads = [threading.Thread(target=self._loop, args=(worker, random.Random(None if seed is None else seed + i),
+                                                             deadline, remaining))
+                   for (i, worker) in enumerate(workers)]
+        start = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return summarize(self.records, time.monotonic() - start, self.workers)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent load benchmark for evm_loader")
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=60, help="seconds")
+    parser.add_argument('--count', type=int, default=None, help="stop after this many operations")
+    parser.add_argument('--mix', type=parse_mix, default={'call': 1.0},
+                        help="workload weights, e.g. call=8,partial=1,deploy=1")
+    parser.add_argument('--contract', default=CONTRACTS_DIR + "helloWorld.binary")
+    parser.add_argument('--commitment', default="confirmed")
+    parser.add_argument('--storage-accounts', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    loader = EvmLoader(WalletAccount(wallet_path()))
+    benchmark = LoadBenchmark(loader, args.contract, workers=args.workers, mix=args.mix,
+                              commitment=args.commitment, storage_accounts=args.storage_accounts)
+    print(json.dumps(benchmark.run(args.duration, args.count, args.seed)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,203 @@
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from solana_utils import http_client, EVM_LOADER, getMultipleAccounts
+from iterative_call import sysinstruct, sysvarclock
+from account_data import Account, blocked_by
+
+NOT_LOCKED = (sysinstruct, sysvarclock)
+
+
+def accounts_from_emulation(result):
+    """Solana accounts of the Ethereum accounts an emulation used (the
+    "accounts" list printed by `get_used_accounts`). Only these carry the
+    `blocked` field; code accounts are never blocked."""
+    return [account['account'] for account in result['accounts']]
+
+
+def accounts_from_metas(metas, program_id=EVM_LOADER):
+    """Writable accounts of an instruction, without the loader and sysvars."""
+    return [str(meta.pubkey) for meta in metas
+            if meta.is_writable and str(meta.pubkey) not in NOT_LOCKED + (str(program_id),)]
+
+
+class _Call:
+    __slots__ = ('id', 'accounts', 'fn', 'storage', 'future', 'blockers', 'dependents', 'running', 'deferred')
+
+    def __init__(self, call_id, accounts, fn, storage):
+        self.id = call_id
+        self.accounts = accounts
+        self.fn = fn
+        self.storage = storage
+        self.future = Future()
+        self.blockers = set()      # earlier calls sharing an account
+        self.dependents = set()    # later calls sharing an account
+        self.running = False
+        self.deferred = False      # waited for an external lock
+
+
+class LockScheduler:
+    """Runs calls that touch disjoint sets of Ethereum accounts in parallel.
+
+    PartialCallFromRawEthereumTX blocks every account of the call until the
+    final Continue or Cancel (`StorageAccount::block_accounts`); a second
+    call over one of them takes the lock over and breaks the first one.
+    The scheduler keeps a conflict graph of the submitted calls: a call
+    depends on the latest earlier call sharing each of its accounts, and is
+    dispatched once all of those have finished, so conflicting calls run in
+    order of submission.
+
+    Locks the scheduler didn't create (other relays, calls of a previous run
+    left without Cancel) are learned by `reconcile` from the `blocked_by`
+    field on chain; calls over such accounts wait until a later `reconcile`
+    sees them free. `reconcile` is run for the accounts of every call that
+    fails, and in the background while calls wait for external locks:
+    first after `reconcile_interval` seconds, then with the interval
+    doubled up to `max_reconcile_interval` while they keep waiting."""
+
+    def __init__(self, program_id=EVM_LOADER, client=http_client, max_parallel=8,
+                 reconcile_interval=1.0, max_reconcile_interval=30.0):
+        self.program_id = program_id
+        self.client = client
+        self.executor = ThreadPoolExecutor(max_parallel)
+        self.lock = threading.Lock()
+        self.calls = {}        # id -> _Call, submitted and not finished
+        self.last = {}         # account -> id of the latest call using it
+        self.external = {}     # account -> storage holding a lock we didn't take
+        self.next_id = 0
+        self.stats = {'submitted': 0, 'dispatched': 0, 'queued': 0, 'deferred': 0, 'reconciles': 0}
+        self.reconcile_interval = reconcile_interval
+        self.max_reconcile_interval = max_reconcile_interval
+        self.reconcile_delay = reconcile_interval
+        self.timer = None
+        self.closed = False
+
+    def submit(self, accounts, fn, storage=None):
+        """Schedule `fn()` over the Solana `accounts` it locks; `storage` is
+        the storage account it uses, if known. Returns a Future of the
+        result of `fn`."""
+        with self.lock:
+            call = _Call(self.next_id, list(dict.fromkeys(str(account) for account in accounts)), fn,
+                         None if storage is None else str(storage))
+            self.next_id += 1
+            self.calls[call.id] = call
+            for account in call.accounts:
+                previous = self.last.get(account)
+                if previous is not None:
+                    call.blockers.add(previous)
+                    self.calls[previous].dependents.add(call.id)
+                self.last[account] = call.id
+            self.stats['submitted'] += 1
+            if call.blockers:
+                self.stats['queued'] += 1
+            self._dispatch(call)
+        return call.future
+
+    def _dispatch(self, call):
+        if call.running or call.blockers:
+            return
+        if any(account in self.external for account in call.accounts):
+            if not call.deferred:
+                call.deferred = True
+                self.stats['deferred'] += 1
+            self._schedule_reconcile()
+            return
+        call.running = True
+        self.stats['dispatched'] += 1
+        self.executor.submit(self._run, call)
+
+    def _schedule_reconcile(self):
+        if self.timer is None and not self.closed:
+            self.timer = threading.Timer(self.reconcile_delay, self._reconcile_deferred)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def _reconcile_deferred(self):
+        try:
+            self.reconcile()
+        except Exception:
+            pass
+        with self.lock:
+            self.timer = None
+            if any(call.deferred and not call.running for call in self.calls.values()):
+                self.reconcile_delay = min(self.reconcile_delay * 2, self.max_reconcile_interval)
+                self._schedule_reconcile()
+            else:
+                self.reconcile_delay = self.reconcile_interval
+
+    def _run(self, call):
+        try:
+            result = call.fn()
+        except Exception as err:
+            try:
+                self.reconcile(call.accounts)
+            except Exception:
+                pass
+            self._finish(call)
+            call.future.set_exception(err)
+        else:
+            self._finish(call)
+            call.future.set_result(result)
+
+    def _finish(self, call):
+        with self.lock:
+            del self.calls[call.id]
+            for account in call.accounts:
+                if self.last.get(account) == call.id:
+                    del self.last[account]
+            for dependent in call.dependents:
+                waiting = self.calls[dependent]
+                waiting.blockers.discard(call.id)
+                self._dispatch(waiting)
+
+    def holders(self):
+        """{account: storage or None} for the accounts of running calls."""
+        with self.lock:
+            return {account: call.storage for call in self.calls.values() if call.running
+                    for account in call.accounts}
+
+    def waiting(self):
+        with self.lock:
+            return len([call for call in self.calls.values() if not call.running])
+
+    def reconcile(self, accounts=None):
+        """Read `blocked_by` of `accounts` (by default those of the waiting
+        calls and the known external locks) and return the external locks:
+        {account: storage}. An account is held externally when it is blocked
+        on chain but not by a running call of this scheduler."""
+        with self.lock:
+            if accounts is None:
+                accounts = {account for call in self.calls.values() if not call.running
+                            for account in call.accounts}
+                accounts.update(self.external)
+            accounts = [str(account) for account in accounts]
+        if not accounts:
+            return {}
+
+        (_, infos) = getMultipleAccounts(self.client, accounts, data_slice=Account.size())
+        with self.lock:
+            self.stats['reconciles'] += 1
+            running = {account: call.storage for call in self.calls.values() if call.running
+                       for account in call.accounts}
+            for (account, info) in zip(accounts, infos):
+                storage = blocked_by(info, self.program_id)
+                if storage is None or (account in running and running[account] in (None, storage)):
+                    self.external.pop(account, None)
+                else:
+                    self.external[account] = storage
+            for call in list(self.calls.values()):
+                self._dispatch(call)
+            return dict(self.external)
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            if self.timer is not None:
+                self.timer.cancel()
+        self.executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
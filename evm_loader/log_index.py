@@ -0,0 +1,260 @@
+import math
+import sqlite3
+from hashlib import blake2b
+from evm_receipts import EvmLog
+
+MAX_TOPICS = 4  # LOG0..LOG4
+MAX_BLOOM_HASHES = 16  # blake2b digests are at most 64 bytes
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS logs (
+    slot INTEGER NOT NULL,
+    transaction_index INTEGER,
+    signature TEXT NOT NULL,
+    instruction_index INTEGER NOT NULL,
+    log_index INTEGER NOT NULL,
+    address BLOB NOT NULL,
+    topic0 BLOB, topic1 BLOB, topic2 BLOB, topic3 BLOB,
+    data BLOB NOT NULL,
+    PRIMARY KEY (signature, instruction_index, log_index)
+);
+CREATE INDEX IF NOT EXISTS logs_slot ON logs (slot);
+CREATE INDEX IF NOT EXISTS logs_address ON logs (address, slot);
+CREATE INDEX IF NOT EXISTS logs_topic0 ON logs (topic0, slot);
+CREATE INDEX IF NOT EXISTS logs_topic1 ON logs (topic1, slot);
+CREATE INDEX IF NOT EXISTS logs_topic2 ON logs (topic2, slot);
+CREATE INDEX IF NOT EXISTS logs_topic3 ON logs (topic3, slot);
+CREATE TABLE IF NOT EXISTS blooms (
+    segment INTEGER NOT NULL,
+    part INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    bits BLOB NOT NULL,
+    PRIMARY KEY (segment, part)
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+
+class Bloom:
+    """Bloom filter of the addresses and (position, topic) pairs logged
+    in one segment of slots. `count` is the number of items added that
+    weren't in the filter yet, so adding a log again doesn't fill it."""
+
+    def __init__(self, bits=None, size=1 << 16, hashes=3, count=0):
+        self.size = size
+        self.hashes = hashes
+        self.count = count
+        self.bits = bytearray(bits) if bits is not None else bytearray(size // 8)
+
+    @staticmethod
+    def sized(capacity, fp_rate):
+        """Size and number of hashes of a filter that matches an item it
+        doesn't hold with probability `fp_rate` once it holds `capacity`."""
+        size = math.ceil(-capacity * math.log(fp_rate) / math.log(2) ** 2 / 8) * 8
+        hashes = min(MAX_BLOOM_HASHES, max(1, round(size / capacity * math.log(2))))
+        return (size, hashes)
+
+    def _positions(self, item):
+        digest = blake2b(item, digest_size=4*self.hashes).digest()
+        for i in range(self.hashes):
+            yield int.from_bytes(digest[4*i:4*i+4], 'little') % self.size
+
+    def add(self, item):
+        added = False
+        for pos in self._positions(item):
+            added = added or not self.bits[pos >> 3] & (1 << (pos & 7))
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += added
+
+    def __contains__(self, item):
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(item))
+
+
+def _address_item(address):
+    return b'a' + bytes(address)
+
+
+def _topic_item(position, topic):
+    return bytes([position]) + bytes(topic)
+
+
+def _as_list(value):
+    if value is None:
+        return None
+    if isinstance(value, (list, tuple, set)):
+        return [bytes(v) for v in value]
+    return [bytes(value)]
+
+
+class LogIndex:
+    """File-backed index of evm_loader OnEvent logs for eth_getLogs-style
+    queries.
+
+    Logs are kept in SQLite with an index on the address and on every topic
+    position. Slots are grouped into segments of `segment_slots`, and each
+    segment has bloom filters of its addresses and positional topics, so a
+    query only touches the slot ranges whose filters match.
+
+    A filter holds up to `bloom_capacity` items and then a new one is
+    started for the segment, so busy segments don't saturate their filter.
+    Every new filter of a segment halves the false-positive rate of the
+    previous one, starting at `bloom_fp_rate`, which keeps the rate of the
+    whole segment under twice that."""
+
+    def __init__(self, path, segment_slots=10000, bloom_capacity=4096, bloom_fp_rate=0.01):
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(SCHEMA)
+        columns = {row[1] for row in self.db.execute("PRAGMA table_info(blooms)")}
+        if 'part' not in columns:
+            raise Exception("{} was written by an older LogIndex, index its slots again".format(path))
+        self.segment_slots = self._setting('segment_slots', segment_slots)
+        self.bloom_capacity = self._setting('bloom_capacity', bloom_capacity)
+        self.bloom_fp_rate = self._setting('bloom_fp_rate', bloom_fp_rate)
+        self.blooms = {}
+
+    def _setting(self, key, default):
+        """Settings are fixed when the file is created: blooms written
+        with other parameters couldn't be read back."""
+        row = self.db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        if row is not None:
+            return row[0]
+        with self.db:
+            self.db.execute("INSERT INTO meta (key, value) VALUES (?, ?)", (key, default))
+        return default
+
+    def close(self):
+        self.db.close()
+
+    def last_slot(self):
+        row = self.db.execute("SELECT value FROM meta WHERE key = 'last_slot'").fetchone()
+        return row[0] if row is not None else None
+
+    def _new_bloom(self, part):
+        (size, hashes) = Bloom.sized(self.bloom_capacity, self.bloom_fp_rate / 2 ** part)
+        return Bloom(None, size, hashes)
+
+    def _segment_blooms(self, segment):
+        """Filters of `segment` in the order they were started."""
+        blooms = self.blooms.get(segment)
+        if blooms is None:
+            blooms = []
+            for (part, count, bits) in self.db.execute(
+                    "SELECT part, count, bits FROM blooms WHERE segment = ? ORDER BY part", (segment,)):
+                (size, hashes) = Bloom.sized(self.bloom_capacity, self.bloom_fp_rate / 2 ** part)
+                blooms.append(Bloom(bits, size, hashes, count))
+            self.blooms[segment] = blooms
+        return blooms
+
+    def _bloom(self, segment, items):
+        """Filter of `segment` to add `items` more to: all the items of a
+        log go to the same filter, so that one filter answers a query."""
+        blooms = self._segment_blooms(segment)
+        if not blooms or blooms[-1].count + items > self.bloom_capacity:
+            blooms.append(self._new_bloom(len(blooms)))
+        return blooms[-1]
+
+    def add_logs(self, logs):
+        """Store EvmLogs (e.g. from evm_receipts.iter_logs) in one transaction.
+        Logs already in the index are ignored, so a slot range can be
+        ingested again after a restart."""
+        rows = []
+        touched = set()
+        last_slot = self.last_slot()
+        for log in logs:
+            if len(log.topics) > MAX_TOPICS:
+                raise Exception("Log of {} has {} topics".format(log.signature, len(log.topics)))
+            topics = [bytes(t) for t in log.topics] + [None] * (MAX_TOPICS - len(log.topics))
+            rows.append((log.slot, log.transaction_index, log.signature, log.instruction_index, log.log_index,
+                         bytes(log.address), *topics, bytes(log.data)))
+
+            segment = log.slot // self.segment_slots
+            bloom = self._bloom(segment, 1 + len(log.topics))
+            bloom.add(_address_item(log.address))
+            for (position, topic) in enumerate(log.topics):
+                bloom.add(_topic_item(position, topic))
+            touched.add(segment)
+            last_slot = log.slot if last_slot is None else max(last_slot, log.slot)
+
+        with self.db:
+            self.db.executemany("INSERT OR IGNORE INTO logs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            self.db.executemany("INSERT OR REPLACE INTO blooms (segment, part, count, bits) VALUES (?, ?, ?, ?)",
+                                [(segment, part, bloom.count, bytes(bloom.bits)) for segment in touched
+                                 for (part, bloom) in enumerate(self.blooms[segment])])
+            if last_slot is not None:
+                self.db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('last_slot', ?)", (last_slot,))
+        return len(rows)
+
+    @staticmethod
+    def _bloom_matches(bloom, addresses, topics):
+        if addresses is not None and not any(_address_item(a) in bloom for a in addresses):
+            return False
+        for (position, options) in enumerate(topics):
+            if options is not None and not any(_topic_item(position, t) in bloom for t in options):
+                return False
+        return True
+
+    def _segment_matches(self, segment, addresses, topics):
+        return any(self._bloom_matches(bloom, addresses, topics) for bloom in self._segment_blooms(segment))
+
+    def _slot_ranges(self, from_slot, to_slot, addresses, topics):
+        """Merge consecutive matching segments into slot ranges."""
+        ranges = []
+        first = from_slot // self.segment_slots
+        last = to_slot // self.segment_slots
+        stored = {row[0] for row in self.db.execute(
+                "SELECT DISTINCT segment FROM blooms WHERE segment BETWEEN ? AND ?", (first, last))}
+        for segment in sorted(stored):
+            if not self._segment_matches(segment, addresses, topics):
+                continue
+            begin = max(from_slot, segment * self.segment_slots)
+            end = min(to_slot, (segment + 1) * self.segment_slots - 1)
+            if ranges and ranges[-1][1] + 1 == begin:
+                ranges[-1] = (ranges[-1][0], end)
+            else:
+                ranges.append((begin, end))
+        return ranges
+
+    def get_logs(self, from_slot=0, to_slot=None, address=None, topics=()):
+        """Logs in [from_slot, to_slot] ordered like eth_getLogs: by slot,
+        then by position in the block. Logs stored without a position come
+        first in their slot, ordered by signature.
+
+        `address` is an address or a list of them. `topics` follows the
+        eth_getLogs filter: one entry per position, where None matches any
+        topic and a list matches any of its topics."""
+        if to_slot is None:
+            to_slot = self.last_slot()
+            if to_slot is None:
+                return []
+        addresses = _as_list(address)
+        topics = [_as_list(t) for t in topics]
+        if len(topics) > MAX_TOPICS:
+            return []
+
+        conditions = []
+        params = []
+        if addresses is not None:
+            conditions.append("address IN ({})".format(",".join("?" * len(addresses))))
+            params += addresses
+        for (position, options) in enumerate(topics):
+            if options is not None:
+                conditions.append("topic{} IN ({})".format(position, ",".join("?" * len(options))))
+                params += options
+
+        logs = []
+        for (begin, end) in self._slot_ranges(from_slot, to_slot, addresses, topics):
+            sql = ("SELECT slot, transaction_index, signature, instruction_index, log_index, address, "
+                   "topic0, topic1, topic2, topic3, data "
+                   "FROM logs WHERE " + " AND ".join(["slot BETWEEN ? AND ?"] + conditions) +
+                   " ORDER BY slot, transaction_index, signature, instruction_index, log_index")
+            for row in self.db.execute(sql, [begin, end] + params):
+                (slot, transaction_index, signature, instruction_index, log_index, log_address) = row[:6]
+                log_topics = [t for t in row[6:10] if t is not None]
+                logs.append(EvmLog(log_address, log_topics, row[10], signature, slot, instruction_index, log_index,
+                                   transaction_index))
+        return logs
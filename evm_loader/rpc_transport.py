@@ -0,0 +1,196 @@
+import bisect
+import itertools
+import json
+import logging
+import random
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from solana.rpc.api import Client
+
+# Upper bounds of the latency histogram buckets, seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+RETRY_HTTP_STATUSES = (429, 500, 502, 503, 504)
+# JSON-RPC errors of a node that is behind or hasn't got the block yet
+RETRY_RPC_CODES = (-32004, -32005, -32007)
+
+
+class RpcError(Exception):
+    pass
+
+
+class MethodStats:
+    __slots__ = ('requests', 'errors', 'retries', 'total_time', 'buckets')
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = {}
+        self.retries = 0
+        self.total_time = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def observe(self, elapsed):
+        self.requests += 1
+        self.total_time += elapsed
+        self.buckets[bisect.bisect_left(LATENCY_BUCKETS, elapsed)] += 1
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the `q` quantile."""
+        if not self.requests:
+            return None
+        rank = q * self.requests
+        seen = 0
+        for (bound, count) in zip(LATENCY_BUCKETS + (float('inf'),), self.buckets):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+    def as_dict(self):
+        return {
+            'requests': self.requests,
+            'errors': dict(self.errors),
+            'retries': self.retries,
+            'mean': self.total_time / self.requests if self.requests else None,
+            'p50': self.quantile(0.5),
+            'p99': self.quantile(0.99),
+            'buckets': dict(zip([str(bound) for bound in LATENCY_BUCKETS] + ['inf'], self.buckets)),
+        }
+
+
+def _rpc_error_code(response):
+    error = response.get('error') if isinstance(response, dict) else None
+    return error.get('code') if isinstance(error, dict) else None
+
+
+class RpcTransport:
+    """HTTP transport for solana.rpc.api.Client (the `_provider` interface:
+    `make_request(method, *params)`) over one keep-alive session.
+
+    At most `pool_size` connections are open; more concurrent requests wait
+    for a free connection. `batch` sends several requests in one JSON-RPC
+    batch. Connection errors, timeouts, the HTTP statuses in
+    RETRY_HTTP_STATUSES and the JSON-RPC errors in RETRY_RPC_CODES are
+    retried up to `retries` times with exponential backoff and jitter.
+    Latency histograms and error counts are kept per method; `stats`
+    returns them."""
+
+    def __init__(self, endpoint_uri, pool_size=32, timeout=30, retries=3, backoff=0.1, max_backoff=2.0,
+                 session=None, sleep=time.sleep):
+        self.endpoint_uri = endpoint_uri
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.sleep = sleep
+        self.logger = logging.getLogger("rpc_transport")
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+        self.session = session
+        self.request_ids = itertools.count(1)
+        self.lock = threading.Lock()
+        self.methods = {}
+
+    def _stats(self, method):
+        stats = self.methods.get(method)
+        if stats is None:
+            stats = self.methods[method] = MethodStats()
+        return stats
+
+    def _count_error(self, method, kind):
+        with self.lock:
+            errors = self._stats(method).errors
+            errors[kind] = errors.get(kind, 0) + 1
+
+    def _delay(self, attempt):
+        delay = min(self.max_backoff, self.backoff * 2**attempt)
+        return delay * (0.5 + random.random() / 2)
+
+    def _post(self, name, data):
+        start = time.monotonic()
+        response = self.session.post(self.endpoint_uri, data=data, timeout=self.timeout,
+                                     headers={"Content-Type": "application/json"})
+        if response.status_code in RETRY_HTTP_STATUSES:
+            raise RpcError("HTTP {}".format(response.status_code))
+        response.raise_for_status()
+        result = response.json()
+        with self.lock:
+            self._stats(name).observe(time.monotonic() - start)
+        return result
+
+    def _send(self, name, payload):
+        """POST `payload` and return the decoded answer. Transport errors
+        and, for single requests, the JSON-RPC errors in RETRY_RPC_CODES
+        share one budget of `retries`; `name` is where the metrics go."""
+        data = json.dumps(payload)
+        attempt = 0
+        while True:
+            try:
+                result = self._post(name, data)
+            except (requests.ConnectionError, requests.Timeout, RpcError) as err:
+                self._count_error(name, str(err) if isinstance(err, RpcError) else type(err).__name__)
+                if attempt >= self.retries:
+                    raise
+            else:
+                code = _rpc_error_code(result)
+                if code is None:
+                    return result
+                self._count_error(name, "rpc {}".format(code))
+                if code not in RETRY_RPC_CODES or attempt >= self.retries:
+                    return result
+            self.sleep(self._delay(attempt))
+            attempt += 1
+            with self.lock:
+                self._stats(name).retries += 1
+
+    def make_request(self, method, *params):
+        request = {"jsonrpc": "2.0", "id": next(self.request_ids), "method": method, "params": params}
+        return self._send(method, request)
+
+    def batch(self, calls):
+        """Answers of [(method, params), ...] sent as one JSON-RPC batch,
+        in the order of `calls`."""
+        if not calls:
+            return []
+        batch_requests = [{"jsonrpc": "2.0", "id": next(self.request_ids), "method": method,
+                           "params": list(params)} for (method, params) in calls]
+        name = "batch:" + "+".join(sorted(set(method for (method, _) in calls)))
+        responses = self._send(name, batch_requests)
+        if not isinstance(responses, list):
+            raise RpcError("Batch request failed: {}".format(responses))
+        by_id = {response.get('id'): response for response in responses}
+        result = []
+        for request in batch_requests:
+            response = by_id.get(request['id'])
+            if response is None:
+                raise RpcError("No answer to {} in the batch".format(request['method']))
+            code = _rpc_error_code(response)
+            if code is not None:
+                self._count_error(request['method'], "rpc {}".format(code))
+            result.append(response)
+        return result
+
+    def is_connected(self):
+        try:
+            response = self.session.get("{}/health".format(self.endpoint_uri), timeout=self.timeout)
+            response.raise_for_status()
+        except (IOError, requests.HTTPError) as err:
+            self.logger.error("Health check failed with error: %s", str(err))
+            return False
+        return True
+
+    def stats(self):
+        with self.lock:
+            return {method: stats.as_dict() for (method, stats) in self.methods.items()}
+
+
+def make_client(transport):
+    """solana.rpc.api.Client sending through `transport`."""
+    client = Client(transport.endpoint_uri)
+    client._provider = transport
+    return client
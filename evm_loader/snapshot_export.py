@@ -0,0 +1,201 @@
+import base64
+import codecs
+import json
+import os
+import re
+import struct
+import sys
+from collections import namedtuple
+from typing import NamedTuple, Callable
+import requests
+from base58 import b58decode
+from solana_utils import solana_url, EVM_LOADER
+from account_data import Account, Contract, Storage, ACCOUNT_TAG, CONTRACT_TAG, STORAGE_TAG, tag_filter
+
+# Data sizes of the account layouts of metamask-wrapper/wrapper.py
+# (ACCOUNT_INFO_LAYOUT, TOKEN_INFO_LAYOUT, BALANCE_INFO_LAYOUT)
+WRAPPER_ACCOUNT_INFO_SIZE = 20+4
+WRAPPER_TOKEN_INFO_SIZE = 32+20
+WRAPPER_BALANCE_INFO_SIZE = 32+20+20
+
+# Every record starts with the account key and its lamports
+RECORD_HEADER = '<32sQ'
+RECORD_HEADER_FIELDS = ('pubkey', 'lamports')
+
+READ_RECORDS = 4096
+_array_start = re.compile(r'"result"\s*:\s*\[')
+
+
+class RecordKind(NamedTuple):
+    name: str
+    program: str                # 'wrapper' or 'loader'
+    fields: tuple
+    record: struct.Struct
+    filters: list
+    data_size: int              # bytes of data decoded (and fetched)
+    decode: Callable            # data -> values of `fields`
+
+    @property
+    def row(self):
+        return namedtuple(self.name, RECORD_HEADER_FIELDS + self.fields)
+
+
+def _kind(name, program, fields, fmt, filters, data_size, decode):
+    return RecordKind(name, program, fields, struct.Struct(RECORD_HEADER + fmt), filters, data_size, decode)
+
+
+def _loader_account(data):
+    view = Account(data)
+    return (view.ether, view.nonce, view.trx_count, view.signer, view.code_account,
+            view.is_blocked, view.blocked_by)
+
+
+def _loader_contract(data):
+    view = Contract(data)
+    return (view.owner, view.code_size)
+
+
+def _loader_storage(data):
+    view = Storage(data)
+    return (view.caller, view.nonce, view.accounts_len, view.executor_data_size, view.evm_data_size)
+
+
+KINDS = (
+    _kind('wrapper_account_info', 'wrapper', ('eth_acc', 'trx_count'), '20sI',
+          [{'dataSize': WRAPPER_ACCOUNT_INFO_SIZE}], WRAPPER_ACCOUNT_INFO_SIZE,
+          lambda data: (data[:20], int.from_bytes(data[20:24], 'little'))),
+    _kind('wrapper_token_info', 'wrapper', ('token', 'eth_token'), '32s20s',
+          [{'dataSize': WRAPPER_TOKEN_INFO_SIZE}], WRAPPER_TOKEN_INFO_SIZE,
+          lambda data: (data[:32], data[32:52])),
+    _kind('wrapper_balance_info', 'wrapper', ('account', 'eth_token', 'eth_acc'), '32s20s20s',
+          [{'dataSize': WRAPPER_BALANCE_INFO_SIZE}], WRAPPER_BALANCE_INFO_SIZE,
+          lambda data: (data[:32], data[32:52], data[52:72])),
+    _kind('loader_account', 'loader',
+          ('ether', 'nonce', 'trx_count', 'signer', 'code_account', 'is_blocked', 'blocked_by'), '20sBQ32s32sB32s',
+          [tag_filter(ACCOUNT_TAG)], Account.size(), _loader_account),
+    _kind('loader_contract', 'loader', ('owner', 'code_size'), '32sI',
+          [tag_filter(CONTRACT_TAG)], Contract.size(), _loader_contract),
+    _kind('loader_storage', 'loader',
+          ('caller', 'nonce', 'accounts_len', 'executor_data_size', 'evm_data_size'), '20sQQQQ',
+          [tag_filter(STORAGE_TAG)], Storage.size(), _loader_storage),
+)
+
+
+def iter_json_array(chunks, max_buffer=1 << 16):
+    """Items of the "result" array of a JSON-RPC response arriving as text
+    `chunks`, decoded one at a time. The items must be objects or arrays,
+    so that a truncated item never decodes; only the item being decoded
+    and at most `max_buffer` characters of decoded ones stay in memory."""
+    decoder = json.JSONDecoder()
+    chunks = iter(chunks)
+    buffer = ''
+    while True:
+        match = _array_start.search(buffer)
+        if match is not None:
+            pos = match.end()
+            break
+        chunk = next(chunks, None)
+        if chunk is None:
+            response = json.loads(buffer)
+            raise Exception("getProgramAccounts failed: {}".format(response.get('error')))
+        buffer += chunk
+
+    while True:
+        while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+            pos += 1
+        if pos < len(buffer) and buffer[pos] == ']':
+            return
+        try:
+            (item, end) = decoder.raw_decode(buffer, pos) if pos < len(buffer) else (None, None)
+        except json.JSONDecodeError:
+            end = None
+        if end is None:
+            chunk = next(chunks, None)
+            if chunk is None:
+                raise Exception("Truncated response at offset {}".format(pos))
+            buffer = buffer[pos:] + chunk
+            pos = 0
+            continue
+        yield item
+        pos = end
+        if pos > max_buffer:
+            buffer = buffer[pos:]
+            pos = 0
+
+
+def read_records(path, kind):
+    """Rows of a file written by SnapshotExporter for `kind`."""
+    row = kind.row
+    with open(path, 'rb') as f:
+        while True:
+            data = f.read(kind.record.size * READ_RECORDS)
+            if not data:
+                return
+            for values in kind.record.iter_unpack(data):
+                yield row(*values)
+
+
+class SnapshotExporter:
+    """Writes every account of the metamask wrapper and the loader to
+    fixed-size binary records, a file per kind in KINDS.
+
+    Each kind is one getProgramAccounts with the filter of its layout (the
+    data size for the wrapper, the AccountData tag for the loader) and a
+    data slice, so loader contract code and storage state aren't fetched.
+    The response is read as a stream and written record by record, so
+    memory use doesn't grow with the number of accounts."""
+
+    def __init__(self, wrapper_program=None, loader_program=EVM_LOADER, endpoint_uri=solana_url,
+                 session=None, chunk_size=1 << 16, timeout=600):
+        self.programs = {'wrapper': wrapper_program, 'loader': loader_program}
+        self.endpoint_uri = endpoint_uri
+        self.session = session or requests.Session()
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+
+    def accounts(self, kind):
+        """getProgramAccounts entries of `kind` as they arrive."""
+        opts = {'encoding': 'base64', 'filters': kind.filters,
+                'dataSlice': {'offset': 0, 'length': kind.data_size}}
+        payload = {'jsonrpc': '2.0', 'id': 1, 'method': 'getProgramAccounts',
+                   'params': [str(self.programs[kind.program]), opts]}
+        response = self.session.post(self.endpoint_uri, data=json.dumps(payload), timeout=self.timeout,
+                                     headers={"Content-Type": "application/json"}, stream=True)
+        try:
+            response.raise_for_status()
+            decoder = codecs.getincrementaldecoder('utf-8')()
+            yield from iter_json_array(decoder.decode(chunk) for chunk in response.iter_content(self.chunk_size))
+        finally:
+            response.close()
+
+    def export_kind(self, kind, path):
+        """Write the accounts of `kind` to `path`; returns (written, skipped),
+        skipped being accounts too short for the layout."""
+        written = skipped = 0
+        with open(path, 'wb') as f:
+            for entry in self.accounts(kind):
+                data = base64.b64decode(entry['account']['data'][0])
+                if len(data) < kind.data_size:
+                    skipped += 1
+                    continue
+                f.write(kind.record.pack(b58decode(entry['pubkey']), entry['account']['lamports'],
+                                         *kind.decode(data)))
+                written += 1
+        return (written, skipped)
+
+    def export(self, directory):
+        """Export every kind whose program is known into `directory`;
+        returns {kind name: (written, skipped)}."""
+        os.makedirs(directory, exist_ok=True)
+        counts = {}
+        for kind in KINDS:
+            if self.programs[kind.program] is None:
+                continue
+            counts[kind.name] = self.export_kind(kind, os.path.join(directory, kind.name + '.bin'))
+        return counts
+
+
+if __name__ == '__main__':
+    # snapshot_export.py directory [wrapper_program]: the loader is EVM_LOADER
+    exporter = SnapshotExporter(wrapper_program=sys.argv[2] if len(sys.argv) > 2 else None)
+    print(json.dumps(exporter.export(sys.argv[1])))
@@ -1,6 +1,6 @@
 from solana.transaction import AccountMeta, TransactionInstruction, Transaction
 from solana.rpc.api import Client
-from solana.rpc.types import TxOpts
+from solana.rpc.types import TxOpts, RPCMethod
 from solana.account import Account
 from solana.publickey import PublicKey
 import time
@@ -16,6 +16,9 @@ from base58 import b58encode
 from solana._layouts.system_instructions import SYSTEM_INSTRUCTIONS_LAYOUT, InstructionType as SystemInstructionType
 from construct import Bytes, Int8ul, Int64ul, Struct as cStruct
 from hashlib import sha256
+import account_data
+from blockhash_cache import BlockhashCache
+from rpc_transport import RpcTransport, make_client
 
 CREATE_ACCOUNT_LAYOUT = cStruct(
     "lamports" / Int64ul,
@@ -30,7 +33,9 @@ solana_url = os.environ.get("SOLANA_URL", "http://localhost:8899")
 EVM_LOADER = os.environ.get("EVM_LOADER")
 
 EVM_LOADER_SO = os.environ.get("EVM_LOADER_SO", 'target/bpfel-unknown-unknown/release/evm_loader.so')
-http_client = Client(solana_url)
+transport = RpcTransport(solana_url)
+http_client = make_client(transport)
+blockhash_cache = BlockhashCache(http_client)
 path_to_solana = 'solana'
 
 def confirm_transaction(client, tx_sig):
@@ -203,7 +208,7 @@ class EvmLoader:
                 AccountMeta(pubkey=PublicKey(sol), is_signer=False, is_writable=True),
                 AccountMeta(pubkey=system, is_signer=False, is_writable=False),
             ]))
-        result = http_client.send_transaction(trx, self.acc.get_acc(),
+        result = blockhash_cache.send_transaction(trx, self.acc.get_acc(),
                 opts=TxOpts(skip_confirmation=False, preflight_commitment="root"))
         print('result:', result)
         return sol
@@ -293,26 +298,6 @@ def solana2ether(public_key):
     return bytes(Web3.keccak(bytes(PublicKey(public_key)))[-20:])
 
 
-ACCOUNT_INFO_LAYOUT = cStruct(
-    "type" / Int8ul,
-    "eth_acc" / Bytes(20),
-    "nonce" / Int8ul,
-    "trx_count" / Bytes(8),
-    "signer_acc" / Bytes(32),
-    "code_acc" / Bytes(32),
-    "is_blocked" / Int8ul,
-    "blocked_by" / Bytes(32),
-)
-
-class AccountInfo(NamedTuple):
-    eth_acc: eth_keys.PublicKey
-    trx_count: int
-
-    @staticmethod
-    def frombytes(data):
-        cont = ACCOUNT_INFO_LAYOUT.parse(data)
-        return AccountInfo(cont.eth_acc, cont.trx_count)
-
 def getAccountData(client, account, expected_length):
     info = client.get_account_info(account)['result']['value']
     if info is None:
@@ -325,10 +310,38 @@ def getAccountData(client, account, expected_length):
     return data
 
 
+MAX_MULTIPLE_ACCOUNTS = 100
+
+
+def getMultipleAccounts(client, accounts, data_slice=None):
+    """getMultipleAccounts for any number of accounts, 100 per request,
+    sent as one JSON-RPC batch when the transport of the client supports it
+    (RpcTransport). Returns (slot, infos) with one base64 account info or
+    None per account; slot is the lowest context slot of the requests."""
+    opts = {'encoding': 'base64'}
+    if data_slice is not None:
+        (offset, length) = data_slice if isinstance(data_slice, tuple) else (0, data_slice)
+        opts['dataSlice'] = {'offset': offset, 'length': length}
+    slot = None
+    infos = []
+    accounts = [str(account) for account in accounts]
+    chunks = [accounts[begin:begin+MAX_MULTIPLE_ACCOUNTS] for begin in range(0, len(accounts), MAX_MULTIPLE_ACCOUNTS)]
+    if len(chunks) > 1 and hasattr(client._provider, 'batch'):
+        responses = client._provider.batch([(RPCMethod("getMultipleAccounts"), (chunk, opts)) for chunk in chunks])
+    else:
+        responses = (client._provider.make_request(RPCMethod("getMultipleAccounts"), chunk, opts) for chunk in chunks)
+    for response in responses:
+        if 'error' in response:
+            raise Exception("getMultipleAccounts failed: {}".format(response['error']))
+        result = response['result']
+        slot = result['context']['slot'] if slot is None else min(slot, result['context']['slot'])
+        infos.extend(result['value'])
+    return (slot, infos)
+
+
 def getTransactionCount(client, sol_account):
-    info = getAccountData(client, sol_account, ACCOUNT_INFO_LAYOUT.sizeof())
-    acc_info = AccountInfo.frombytes(info)
-    res = int.from_bytes(acc_info.trx_count, 'little')
+    info = getAccountData(client, sol_account, account_data.Account.size())
+    res = account_data.unpack(info).trx_count
     print('getTransactionCount {}: {}'.format(sol_account, res))
     return res
 
@@ -0,0 +1,133 @@
+import json
+import sys
+import time
+from typing import NamedTuple, List
+from base58 import b58encode
+from solana_utils import http_client, EVM_LOADER, getMultipleAccounts
+import account_data
+from account_data import Account, Storage, STORAGE_TAG, blocked_by
+
+# Enough of the data for the Storage header and the keys of the accounts
+# of a call; the bincode EVM and executor state that follows isn't fetched.
+DEFAULT_MAX_ACCOUNTS = 64
+
+
+class StorageInfo(NamedTuple):
+    storage: str
+    caller: bytes
+    nonce: int
+    accounts: List[str]
+    accounts_len: int
+    evm_data_size: int
+    executor_data_size: int
+    first_seen_slot: int
+    first_seen_time: float
+
+    @property
+    def data_size(self):
+        """Bytes used by the call, as laid out by StorageAccount::serialize."""
+        return Storage.size() + 32*self.accounts_len + self.evm_data_size + self.executor_data_size
+
+    def as_dict(self, slot, now):
+        return {
+            'storage': self.storage,
+            'caller': self.caller.hex(),
+            'nonce': self.nonce,
+            'accounts': self.accounts,
+            'accounts_len': self.accounts_len,
+            'evm_data_size': self.evm_data_size,
+            'executor_data_size': self.executor_data_size,
+            'data_size': self.data_size,
+            'age_slots': slot - self.first_seen_slot,
+            'age_seconds': round(now - self.first_seen_time, 1),
+        }
+
+
+def storage_accounts(view):
+    """Keys in the accounts region that made it into the (possibly sliced)
+    data; StorageAccount::accounts reads the same region."""
+    begin = Storage.size()
+    available = (len(view.data) - begin) // 32
+    count = min(view.accounts_len, available)
+    return [b58encode(bytes(view.data[begin+32*i:begin+32*(i+1)])).decode() for i in range(count)]
+
+
+class StorageInspector:
+    """Off-chain view of iterative calls in progress.
+
+    Every `scan` fetches the Storage accounts of the loader with a single
+    getProgramAccounts (tag filter and a data slice, so only the headers and
+    account lists travel). A call is identified by storage, caller and
+    nonce; the inspector remembers when it first saw each call to report
+    its age, so it should be kept and scanned periodically."""
+
+    def __init__(self, program_id=EVM_LOADER, client=http_client, max_accounts=DEFAULT_MAX_ACCOUNTS):
+        self.program_id = program_id
+        self.client = client
+        self.max_accounts = max_accounts
+        self.first_seen = {}    # (storage, caller, nonce) -> (slot, time)
+        self.slot = 0
+        self.time = 0.0
+
+    def fetch(self):
+        length = Storage.size() + 32*self.max_accounts
+        return account_data.getProgramAccounts(self.client, self.program_id, STORAGE_TAG, data_slice=length)
+
+    def scan(self, views=None, slot=None):
+        """Current calls as StorageInfo, oldest first."""
+        if views is None:
+            views = self.fetch()
+        self.slot = slot if slot is not None else self.client.get_slot()['result']
+        self.time = time.time()
+
+        infos = []
+        seen = {}
+        for (storage, view) in views.items():
+            key = (storage, view.caller, view.nonce)
+            (first_slot, first_time) = self.first_seen.get(key, (self.slot, self.time))
+            seen[key] = (first_slot, first_time)
+            infos.append(StorageInfo(storage, view.caller, view.nonce, storage_accounts(view), view.accounts_len,
+                                     view.evm_data_size, view.executor_data_size, first_slot, first_time))
+        self.first_seen = seen
+        infos.sort(key=lambda info: (info.first_seen_slot, info.storage))
+        return infos
+
+    def lock_holders(self, infos, account_infos=None):
+        """{account: storage} for the accounts locked by the calls. The
+        account list of a call also has sysvars and programs; only the
+        Accounts of the loader whose `blocked_by` is the storage count.
+        `account_infos` ({account: account info}) are fetched if not given."""
+        accounts = sorted(set(account for info in infos for account in info.accounts))
+        if account_infos is None:
+            (_, fetched) = getMultipleAccounts(self.client, accounts, data_slice=Account.size())
+            account_infos = dict(zip(accounts, fetched))
+        holders = {}
+        for info in infos:
+            for account in info.accounts:
+                if blocked_by(account_infos.get(account), self.program_id) == info.storage:
+                    holders[account] = info.storage
+        return holders
+
+    def stale(self, infos, min_age_slots):
+        """Calls seen for at least `min_age_slots`: candidates for Cancel."""
+        return [info for info in infos if self.slot - info.first_seen_slot >= min_age_slots]
+
+    def report(self, infos, account_infos=None):
+        return {
+            'slot': self.slot,
+            'calls': len(infos),
+            'locked_accounts': len(self.lock_holders(infos, account_infos)),
+            'data_size': sum(info.data_size for info in infos),
+            'storages': [info.as_dict(self.slot, self.time) for info in infos],
+        }
+
+
+if __name__ == '__main__':
+    # storage_inspector.py [interval_seconds]: print a JSON report per scan
+    interval = float(sys.argv[1]) if len(sys.argv) > 1 else None
+    inspector = StorageInspector()
+    while True:
+        print(json.dumps(inspector.report(inspector.scan())))
+        if interval is None:
+            break
+        time.sleep(interval)
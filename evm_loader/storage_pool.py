@@ -0,0 +1,223 @@
+from solana.transaction import Transaction
+from solana.rpc.types import TxOpts
+from solana.publickey import PublicKey
+from contextlib import contextmanager
+import threading
+import time
+from solana_utils import http_client, accountWithSeed, createAccountWithSeed, getAccountData
+
+STORAGE_SIZE = 128*1024
+CREATE_PER_TRANSACTION = 8
+
+
+class StoragePoolExhausted(Exception):
+    pass
+
+
+class StorageAccountPool:
+    """Pool of storage accounts for iterative calls.
+
+    Accounts are created with createAccountWithSeed from `signer` and a
+    sequential seed, so the same pool can be rebuilt from the chain after a
+    restart. A storage account is free again once the call has run
+    `StorageAccount::unblock_accounts_and_destroy` (the account tag is back
+    to Empty), i.e. after the final Continue or a Cancel.
+
+    The loader has no instruction to close a storage account, so shrinking
+    parks idle accounts instead of deleting them; growing takes parked
+    accounts back before creating new ones. New accounts are created
+    without holding the lock: their seeds are reserved first and the
+    accounts are added once confirmed, so releases and acquirers that find
+    a free account don't wait for the creation."""
+
+    def __init__(self, signer, program_id, client=http_client, min_size=4, max_size=64,
+                 idle_timeout=60, seed_prefix="storage", lamports=10**9, space=STORAGE_SIZE):
+        self.signer = signer
+        self.program_id = PublicKey(program_id)
+        self.client = client
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.seed_prefix = seed_prefix
+        self.lamports = lamports
+        self.space = space
+
+        self.lock = threading.Condition()
+        self.free = []       # [(storage, released_at)], most recently used last
+        self.leased = set()
+        self.parked = []
+        self.quarantined = set()
+        self.next_index = 0
+        self.unused_indexes = []    # reserved seeds whose creation failed
+        self.creating = 0
+        self.stats = {'leases': 0, 'created': 0, 'reused': 0, 'waits': 0, 'peak_leased': 0}
+
+    def _seed(self, index):
+        return "{}{}".format(self.seed_prefix, index)
+
+    def _address(self, index):
+        # str: the pool keeps addresses in sets, PublicKey isn't hashable
+        return str(accountWithSeed(self.signer.public_key(), self._seed(index), self.program_id))
+
+    def size(self):
+        return len(self.free) + len(self.leased) + self.creating
+
+    def _reserve(self, count):
+        """Grow by up to `count` accounts: parked ones are free again at
+        once, seed indexes are reserved for the rest. Called with the lock
+        held; returns the reserved indexes, to be passed to `_add`."""
+        count = min(count, self.max_size - self.size())
+        now = time.monotonic()
+        while self.parked and count > 0:
+            self.free.append((self.parked.pop(), now))
+            count -= 1
+        indexes = self.unused_indexes[:count]
+        del self.unused_indexes[:count]
+        while len(indexes) < count:
+            indexes.append(self.next_index)
+            self.next_index += 1
+        self.creating += len(indexes)
+        return indexes
+
+    def _create(self, indexes):
+        """Create the accounts of `indexes` that don't exist yet; returns
+        (usable, quarantined, created)."""
+        usable = []
+        quarantined = []
+        created = 0
+        trx = Transaction()
+        for index in indexes:
+            storage = self._address(index)
+            if self.client.get_balance(storage)['result']['value'] != 0:
+                if not self.is_empty(storage):
+                    quarantined.append(storage)
+                    continue
+            else:
+                trx.add(createAccountWithSeed(self.signer.public_key(), self.signer.public_key(),
+                        self._seed(index), self.lamports, self.space, self.program_id))
+                created += 1
+            usable.append(storage)
+            if len(trx.instructions) == CREATE_PER_TRANSACTION:
+                self._send(trx)
+                trx = Transaction()
+        if trx.instructions:
+            self._send(trx)
+        return (usable, quarantined, created)
+
+    def _send(self, trx):
+        self.client.send_transaction(trx, self.signer, opts=TxOpts(skip_confirmation=False))
+
+    def _add(self, indexes):
+        """Create the accounts of reserved `indexes` without the lock and
+        make them free. If the creation fails the indexes are reserved
+        again by a later growth; accounts that already exist are reused."""
+        try:
+            (usable, quarantined, created) = self._create(indexes)
+        except Exception:
+            with self.lock:
+                self.creating -= len(indexes)
+                self.unused_indexes.extend(indexes)
+                self.lock.notify_all()
+            raise
+        now = time.monotonic()
+        with self.lock:
+            self.creating -= len(indexes)
+            self.free.extend((storage, now) for storage in usable)
+            self.quarantined.update(quarantined)
+            self.stats['created'] += created
+            self.stats['reused'] += len(usable) - created
+            self.lock.notify_all()
+
+    def warm_up(self, count=None):
+        """Pre-create `count` (default `min_size`) free accounts."""
+        with self.lock:
+            missing = (count or self.min_size) - self.size()
+            indexes = self._reserve(missing) if missing > 0 else []
+        if indexes:
+            self._add(indexes)
+
+    def acquire(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            storage = None
+            indexes = []
+            with self.lock:
+                self._shrink()
+                if not self.free and self.size() < self.max_size:
+                    # Grow by the current load, but at least by one account
+                    indexes = self._reserve(max(1, len(self.leased) // 2))
+                if self.free:
+                    (storage, _) = self.free.pop()
+                    self.leased.add(storage)
+                    self.stats['leases'] += 1
+                    self.stats['peak_leased'] = max(self.stats['peak_leased'], len(self.leased))
+                elif not indexes:
+                    self.stats['waits'] += 1
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        raise StoragePoolExhausted("all {} storage accounts are leased".format(self.size()))
+                    self.lock.wait(remaining)
+                    continue
+            if indexes:
+                self._add(indexes)
+            if storage is not None:
+                return storage
+
+    def is_empty(self, storage):
+        data = getAccountData(self.client, storage, self.space)
+        return data[0] == 0
+
+    def release(self, storage, check=False):
+        """Return `storage` to the pool. With `check` the account is only
+        reused if its data is Empty, otherwise it is quarantined until an
+        explicit Cancel and `restore`."""
+        clean = not check or self.is_empty(storage)
+        with self.lock:
+            self.leased.discard(storage)
+            if clean:
+                self.free.append((storage, time.monotonic()))
+            else:
+                self.quarantined.add(storage)
+            self.lock.notify()
+
+    def restore(self, storage):
+        """Take back a quarantined account after its call was cancelled."""
+        if not self.is_empty(storage):
+            raise Exception("Storage account {} is still in use".format(storage))
+        with self.lock:
+            self.quarantined.discard(storage)
+            self.free.append((storage, time.monotonic()))
+            self.lock.notify()
+
+    def _shrink(self):
+        now = time.monotonic()
+        while self.free and len(self.free) + len(self.leased) > self.min_size:
+            (storage, released_at) = self.free[0]
+            if now - released_at < self.idle_timeout:
+                break
+            self.free.pop(0)
+            self.parked.append(storage)
+
+    @contextmanager
+    def lease(self, timeout=None):
+        storage = self.acquire(timeout)
+        failed = False
+        try:
+            yield storage
+        except Exception:
+            failed = True
+            raise
+        finally:
+            self.release(storage, check=failed)
+
+    def utilization(self):
+        with self.lock:
+            size = self.size()
+            return dict(self.stats,
+                    size=size,
+                    leased=len(self.leased),
+                    free=len(self.free),
+                    parked=len(self.parked),
+                    quarantined=len(self.quarantined),
+                    creating=self.creating,
+                    utilization=len(self.leased) / size if size else 0.0)
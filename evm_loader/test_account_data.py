@@ -0,0 +1,81 @@
+import base64
+import unittest
+import account_data
+from account_data import Account, Contract, Storage, Empty, AccountDataError, unpack, decode_program_accounts
+
+ether = bytes.fromhex("c1566af4699928fdf9be097ca3dc47ece39f8f8e")
+signer = bytes(range(32))
+code_account = bytes(range(32, 64))
+storage = bytes(range(64, 96))
+
+
+class AccountDataTest(unittest.TestCase):
+    def test_account(self):
+        data = bytearray(Account.size())
+        Account.pack(data, ether, 255, 7, signer, code_account)
+        self.assertEqual(len(data), 127)
+        account = unpack(bytes(data))
+        self.assertIsInstance(account, Account)
+        self.assertEqual((account.ether, account.nonce, account.trx_count), (ether, 255, 7))
+        self.assertEqual((account.signer, account.code_account), (signer, code_account))
+        self.assertIsNone(account.blocked)
+
+    def test_blocked(self):
+        data = bytearray(Account.size())
+        account = Account.pack(data, ether, 1, 0, signer, blocked=storage)
+        self.assertEqual(unpack(data).blocked, storage)
+        account.blocked = None
+        self.assertEqual(data[94], 0)
+        self.assertIsNone(unpack(data).blocked)
+
+    def test_contract(self):
+        code = bytes.fromhex("6080604052")
+        data = bytearray(Contract.size() + len(code) + 256)
+        Contract.pack(data, signer, len(code))
+        data[Contract.size():Contract.size()+len(code)] = code
+        data[Contract.size()+len(code)] = 0     # empty Hamt: last_used = 256
+        data[Contract.size()+len(code)+1] = 1
+        contract = unpack(data)
+        self.assertEqual((contract.owner, contract.code_size), (signer, 5))
+        self.assertEqual(bytes(contract.code), code)
+        self.assertEqual(contract.storage().get(1), 0)
+
+    def test_storage(self):
+        data = bytearray(Storage.size() + 2*32 + 100)
+        Storage.pack(data, ether, 3, 2, 10, 20)
+        data[Storage.size():Storage.size()+64] = signer + code_account
+        view = unpack(data)
+        self.assertEqual((view.caller, view.nonce, view.accounts_len), (ether, 3, 2))
+        self.assertEqual((view.executor_data_size, view.evm_data_size), (10, 20))
+        self.assertEqual(view.accounts, [signer, code_account])
+        Empty.pack(data)
+        self.assertIsInstance(unpack(data), Empty)
+
+    def test_pack_checks(self):
+        data = bytearray(Storage.size())
+        Storage.pack(data, ether, 1, 0)
+        with self.assertRaises(AccountDataError):
+            Account.pack(bytearray(Account.size() - 1), ether, 1, 0, signer)
+        with self.assertRaises(AccountDataError):
+            Contract.pack(data, signer, 0)
+
+    def test_invalid(self):
+        for data in (b'', b'\x04' + bytes(200), b'\x01' + bytes(100)):
+            with self.assertRaises(AccountDataError):
+                unpack(data)
+
+    def test_program_accounts(self):
+        account = bytearray(Account.size())
+        Account.pack(account, ether, 1, 5, signer)
+        entries = [(b'A', account), (b'B', b'\x03' + bytes(10)), (b'C', b'\x00')]
+        response = {'result': [
+            {'pubkey': key.decode(), 'account': {'data': [base64.b64encode(data).decode(), 'base64']}}
+            for (key, data) in entries]}
+        decoded = decode_program_accounts(response)
+        self.assertEqual(sorted(decoded), ['A', 'C'])
+        self.assertEqual(decoded['A'].trx_count, 5)
+        self.assertEqual(list(decode_program_accounts(response, account_data.ACCOUNT_TAG)), ['A'])
+
+
+if __name__ == '__main__':
+    unittest.main()
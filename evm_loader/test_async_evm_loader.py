@@ -0,0 +1,176 @@
+import asyncio
+import base64
+import unittest
+from base58 import b58encode
+from solana.account import Account
+from solana.rpc.api import SendTransactionError
+from solana.rpc.types import TxOpts
+from account_data import Account as AccountView
+from iterative_call import StepCountTuner, call_accounts
+from async_evm_loader import AsyncClient, AsyncEvmLoader, getBalance, getTransactionCount
+
+loader = "eeLSJgWzzxrqKv1UxtRVVH8FX3qCQWUs9QuAjJpETGU"
+
+
+def key(i):
+    return b58encode(bytes([i]) * 32).decode()
+
+
+class FakeClient(AsyncClient):
+    """Answers RPC requests locally; a Continue with enough steps returns."""
+
+    def __init__(self, total_steps=1000):
+        super().__init__(poll_interval=0)
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.total_steps = total_steps
+        self.done_steps = 0
+        self.transactions = {}
+        self.error = None
+        self.max_steps = None
+
+    async def make_request(self, method, *params):
+        self.requests.append(method)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(0)
+        self.in_flight -= 1
+        return getattr(self, method)(*params)
+
+    def getBalance(self, pubkey, opts):
+        return {'result': {'value': 42}}
+
+    def getAccountInfo(self, pubkey, opts):
+        data = bytearray(AccountView.size())
+        AccountView.pack(data, bytes(20), 255, 7, bytes(32))
+        return {'result': {'value': {'data': [base64.b64encode(bytes(data)).decode(), 'base64']}}}
+
+    def getRecentBlockhash(self, opts):
+        return {'result': {'context': {'slot': 100}, 'value': {'blockhash': key(7)}}}
+
+    def getSlot(self, opts):
+        return {'result': 132}
+
+    def getSignatureStatuses(self, signatures):
+        return {'result': {'value': [{'err': None} for _ in signatures]}}
+
+    def sendTransaction(self, txn, opts):
+        if self.error is not None:
+            return {'error': {'message': self.error}}
+        data = base64.b64decode(txn)
+        if self.max_steps is not None and data[-9] == 0x0a and int.from_bytes(data[-8:], 'little') > self.max_steps:
+            return {'error': {
+                'code': -32002,
+                'message': "Transaction simulation failed: Error processing Instruction 0: Program failed to complete",
+                'data': {'err': {'InstructionError': [0, 'ProgramFailedToComplete']}, 'logs': [
+                    "Program {} invoke [1]".format(loader),
+                    "Program {} consumed 200000 of 200000 compute units".format(loader),
+                    "Program failed to complete: exceeded maximum number of instructions allowed (200000) "
+                    "at instruction #41852",
+                    "Program {} failed: Program failed to complete".format(loader)]}}}
+        signature = "sig{}".format(len(self.transactions))
+        self.transactions[signature] = data
+        return {'result': signature}
+
+    def getConfirmedTransaction(self, signature, encoding):
+        data = self.transactions[signature]
+        inner = []
+        logs = []
+        # the wire format ends with the data of the last instruction,
+        # for a Continue: 0A and the step count (u64)
+        if data[-9] == 0x0a:
+            steps = int.from_bytes(data[-8:], 'little')
+            self.done_steps += steps
+            logs = ["Program {} invoke [1]".format(loader),
+                    "Program {} consumed {} of 200000 compute units".format(loader, steps * 100),
+                    "Program {} success".format(loader)]
+            if self.done_steps >= self.total_steps:
+                inner = [{'index': 0, 'instructions': [{'programIdIndex': 0,
+                                                       'data': b58encode(bytes([6, 0x11])).decode()}]}]
+        return {'result': {'transaction': {'signatures': [signature]}, 'slot': 1,
+                           'meta': {'err': None, 'logMessages': logs, 'innerInstructions': inner}}}
+
+
+class Wallet:
+    def __init__(self):
+        self.account = Account(bytes([1]) * 32)
+
+    def get_acc(self):
+        return self.account
+
+
+class AsyncHelpersTest(unittest.TestCase):
+    def test_requests_in_flight(self):
+        client = FakeClient()
+
+        async def main():
+            return await asyncio.gather(*[getBalance(client, key(i)) for i in range(50)],
+                                        getTransactionCount(client, key(1)))
+
+        results = asyncio.run(main())
+        self.assertEqual(results, [42] * 50 + [7])
+        self.assertGreater(client.max_in_flight, 1)
+
+    def test_blockhash_shared(self):
+        client = FakeClient()
+        evm = AsyncEvmLoader(Wallet(), client, loader)
+        accounts = call_accounts(loader, key(1), key(2), key(3))
+
+        async def main():
+            return await asyncio.gather(*[evm.call(accounts, bytes(20), bytes(65), bytes(10)) for _ in range(10)])
+
+        results = asyncio.run(main())
+        self.assertEqual(len(results), 10)
+        self.assertEqual(client.requests.count("getRecentBlockhash"), 1)
+        self.assertEqual(client.requests.count("sendTransaction"), 10)
+
+    def test_send_error(self):
+        client = FakeClient()
+        client.error = "Transaction simulation failed"
+        evm = AsyncEvmLoader(Wallet(), client, loader, opts=TxOpts(skip_confirmation=True))
+        with self.assertRaises(SendTransactionError):
+            asyncio.run(evm.call(call_accounts(loader, key(1), key(2), key(3)), bytes(20), bytes(65), bytes(10)))
+
+
+class AsyncIterativeCallTest(unittest.TestCase):
+    def test_runs_until_return(self):
+        client = FakeClient(total_steps=1000)
+        tuner = StepCountTuner(default_steps=50, target=0.8, max_growth=100)
+        evm = AsyncEvmLoader(Wallet(), client, loader, tuner=tuner)
+        accounts = call_accounts(loader, key(1), key(2), key(3))
+        result = asyncio.run(evm.iterative_call(key(9), accounts, bytes(20), bytes(65), bytes(10),
+                                                key=('contract', b'1234')))
+        self.assertEqual(result['meta']['innerInstructions'][0]['index'], 0)
+        # 50 steps used 5000 units: the next Continue gets 160000/100 steps
+        self.assertEqual(client.done_steps, 50 + 1600)
+        self.assertEqual(client.requests.count("sendTransaction"), 3)
+
+    def test_budget_exceeded_halves_steps(self):
+        client = FakeClient(total_steps=1000)
+        client.max_steps = 150
+        evm = AsyncEvmLoader(Wallet(), client, loader, tuner=StepCountTuner(default_steps=400, max_growth=1))
+        accounts = call_accounts(loader, key(1), key(2), key(3))
+        result = asyncio.run(evm.iterative_call(key(9), accounts, bytes(20), bytes(65), bytes(10),
+                                                key=('contract', b'1234')))
+        self.assertEqual(result['meta']['innerInstructions'][0]['index'], 0)
+        # 400 and 200 steps fail the preflight, 100 steps at a time succeed
+        self.assertEqual(client.done_steps, 1000)
+        self.assertEqual(client.requests.count("sendTransaction"), 1 + 2 + 10)
+
+    def test_pipelined(self):
+        client = FakeClient(total_steps=1000)
+        evm = AsyncEvmLoader(Wallet(), client, loader, tuner=StepCountTuner(default_steps=100, max_growth=1),
+                             pipeline_window=4, poll_interval=0)
+        accounts = call_accounts(loader, key(1), key(2), key(3))
+        result = asyncio.run(evm.iterative_call(key(9), accounts, bytes(20), bytes(65), bytes(10),
+                                                key=('contract', b'1234')))
+        self.assertEqual(result['meta']['innerInstructions'][0]['index'], 0)
+        # the Continues of a window have different step counts
+        steps = [int.from_bytes(data[-8:], 'little') for data in client.transactions.values() if data[-9] == 0x0a]
+        self.assertEqual(steps[:4], [100, 101, 102, 103])
+        self.assertGreaterEqual(client.done_steps, 1000)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+import unittest
+from blockhash_cache import BlockhashCache, RecentBlockhash
+
+
+class FakeClient:
+    def __init__(self):
+        self.slot = 100         # context slot of the hash at "max"
+        self.tip = None         # slot the node is processing, `slot` if None
+        self.requests = 0
+        self.sent = []
+        self.unknown = set()
+
+    def get_recent_blockhash(self, commitment="max"):
+        self.requests += 1
+        return {'result': {'context': {'slot': self.slot}, 'value': {'blockhash': "hash{}".format(self.slot)}}}
+
+    def get_slot(self, commitment="max"):
+        return {'result': self.slot if self.tip is None else self.tip}
+
+    def send_raw_transaction(self, data, opts=None):
+        if data in self.unknown:
+            raise Exception('Transaction simulation failed: Blockhash not found')
+        self.sent.append(data)
+        return {'result': "sig"}
+
+
+class FakeTransaction:
+    def __init__(self):
+        self.recent_blockhash = None
+        self.signed = []
+
+    def sign(self, *signers):
+        self.signed.append(self.recent_blockhash)
+
+    def serialize(self):
+        return self.recent_blockhash
+
+
+class BlockhashCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.client = FakeClient()
+        # refresh thread effectively disabled, slots advance only by hand
+        self.cache = BlockhashCache(self.client, refresh_slots=1000, slot_time=1000)
+
+    def tearDown(self):
+        self.cache.stop()
+
+    def test_shared_hash(self):
+        for _ in range(5):
+            self.cache.send_transaction(FakeTransaction(), None)
+        self.assertEqual(self.client.requests, 1)
+        self.assertEqual(self.client.sent, ["hash100"] * 5)
+
+    def test_expiry(self):
+        recent = self.cache.get()
+        self.assertEqual(recent.last_valid_slot, 250)
+        self.assertFalse(self.cache.is_expiring(recent))
+        self.cache.current = recent._replace(tip_slot=240)
+        self.assertTrue(self.cache.is_expiring(recent))
+
+    def test_tip_ahead_of_context(self):
+        # the hash of the rooted bank at 100 expires after slot 250, counted
+        # from the slot the node is processing
+        self.client.tip = 235
+        recent = self.cache.get()
+        self.assertEqual((recent.slot, recent.last_valid_slot, recent.tip_slot), (100, 250, 235))
+        self.assertEqual(self.cache.estimated_slot(), 235)
+        self.assertTrue(self.cache.is_expiring(recent))
+        self.client.tip = 132
+        self.assertFalse(self.cache.is_expiring(self.cache.fetch()))
+
+    def test_resign_stale_transaction(self):
+        trx = FakeTransaction()
+        recent = self.cache.sign(trx, None)
+        self.assertIs(self.cache.resign(trx, recent, None), recent)
+
+        self.client.slot = 240
+        self.cache.current = RecentBlockhash("hash200", 240, 390, recent.fetched_at, 240)
+        fresh = self.cache.resign(trx, recent, None)
+        self.assertEqual(trx.recent_blockhash, "hash200")
+        self.assertEqual(fresh.blockhash, "hash200")
+        self.assertEqual(self.cache.stats['resigned'], 1)
+
+    def test_blockhash_not_found_retry(self):
+        self.cache.get()
+        self.client.unknown.add("hash100")
+        self.client.slot = 101
+        self.cache.send_transaction(FakeTransaction(), None)
+        self.assertEqual(self.client.sent, ["hash101"])
+        self.assertEqual(self.cache.stats['retries'], 1)
+
+    def test_other_errors_raise(self):
+        client = self.client
+        client.send_raw_transaction = lambda data, opts=None: (_ for _ in ()).throw(Exception("InsufficientFunds"))
+        with self.assertRaises(Exception):
+            self.cache.send_transaction(FakeTransaction(), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
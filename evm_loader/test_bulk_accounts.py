@@ -0,0 +1,130 @@
+import unittest
+from base58 import b58decode
+from solana.publickey import PublicKey
+from bulk_accounts import BulkAccountCreator, is_on_curve, create_program_address, find_program_address
+from call_packer import transaction_size
+
+loader = "eeLSJgWzzxrqKv1UxtRVVH8FX3qCQWUs9QuAjJpETGU"
+
+
+class ProgramAddressTest(unittest.TestCase):
+    def test_on_curve(self):
+        # ed25519 base point and the public key of RFC 8032 test 1
+        self.assertTrue(is_on_curve(bytes.fromhex("5866666666666666666666666666666666666666666666666666666666666666")))
+        self.assertTrue(is_on_curve(bytes.fromhex("d75a980182b10ab7d54bfed3c964073a0ee172f3daa62325af021a68f707511a")))
+
+    def test_create_program_address(self):
+        # vectors of Pubkey::create_program_address tests in solana-program
+        program_id = "BPFLoaderUpgradeab1e11111111111111111111111"
+        public_key = b58decode("SeedPubey1111111111111111111111111111111111")
+        self.assertEqual(create_program_address([b"", bytes([1])], program_id),
+                         "BwqrghZA2htAcqq8dzP1WDAhTXYTYWj7CHxF5j7TDBAe")
+        self.assertEqual(create_program_address(["☉".encode(), bytes([0])], program_id),
+                         "13yWmRpaTR4r5nAktwLqMpRNr28tnVUZw26rTvPSSB19")
+        self.assertEqual(create_program_address([b"Talking", b"Squirrels"], program_id),
+                         "2fnQrngrQT4SeLcdToJAD96phoEjNL2man2kfRLCASVk")
+        self.assertEqual(create_program_address([public_key, bytes([1])], program_id),
+                         "976ymqVnfE32QFe6NfGDctSvVa36LWnvYxhU6G2232YL")
+
+    def test_find_program_address(self):
+        for i in range(50):
+            ether = bytes([i]) * 20
+            (address, nonce) = find_program_address([ether], loader)
+            self.assertEqual(create_program_address([ether, bytes([nonce])], loader), address)
+            for higher in range(nonce + 1, 256):
+                self.assertIsNone(create_program_address([ether, bytes([higher])], loader))
+
+
+class Signer:
+    def public_key(self):
+        return PublicKey(bytes(32))
+
+
+class FakeBlockhashCache:
+    def __init__(self, client):
+        self.client = client
+
+    def send_transaction(self, trx, *signers, opts=None):
+        return self.client.send(trx)
+
+
+class FakeClient:
+    def __init__(self, existing=(), fail_first=0):
+        self.accounts = set(existing)
+        self.fail_first = fail_first
+        self.transactions = {}
+        self.max_in_flight = 0
+        self._provider = self
+
+    def make_request(self, method, keys, opts):
+        return {'result': {'context': {'slot': 1},
+                           'value': [{'data': ['', 'base64']} if key in self.accounts else None for key in keys]}}
+
+    def send(self, trx):
+        signature = "sig{}".format(len(self.transactions))
+        self.transactions[signature] = trx
+        self.max_in_flight = max(self.max_in_flight, len(self.pending()))
+        return {'result': signature}
+
+    def pending(self):
+        return [signature for (signature, trx) in self.transactions.items() if trx is not None]
+
+    def get_signature_statuses(self, signatures):
+        statuses = []
+        for signature in signatures:
+            trx = self.transactions[signature]
+            self.transactions[signature] = None
+            if self.fail_first > 0:
+                self.fail_first -= 1
+                statuses.append({'err': {'InstructionError': [0, 'Custom']}, 'confirmationStatus': 'confirmed'})
+                continue
+            for instruction in trx.instructions:
+                self.accounts.add(str(instruction.keys[1].pubkey))
+            statuses.append({'err': None, 'confirmationStatus': 'confirmed'})
+        return {'result': {'value': statuses}}
+
+
+class BulkAccountCreatorTest(unittest.TestCase):
+    def creator(self, client, **kwargs):
+        return BulkAccountCreator(Signer(), loader, client=client, poll_interval=0,
+                                  blockhash_cache=FakeBlockhashCache(client), **kwargs)
+
+    def test_pack_fits_packet(self):
+        creator = self.creator(FakeClient())
+        batches = creator.pack(creator.derive([bytes([i]) * 20 for i in range(40)]))
+        self.assertGreater(len(batches), 1)
+        self.assertEqual(sum(len(batch) for batch in batches), 40)
+        for batch in batches:
+            self.assertLessEqual(transaction_size(Signer().public_key(), batch), 1232)
+
+    def test_skips_existing(self):
+        ethers = [bytes([i]) * 20 for i in range(30)]
+        existing = [find_program_address([ether], loader)[0] for ether in ethers[:10]]
+        client = FakeClient(existing)
+        creator = self.creator(client, window=2)
+        derived = creator.create(ethers)
+        self.assertEqual([ether for (ether, _, _) in derived], ethers)
+        self.assertEqual(creator.stats['existing'], 10)
+        self.assertEqual(creator.stats['created'], 20)
+        self.assertLessEqual(client.max_in_flight, 2)
+        self.assertEqual(len(client.accounts), 30)
+
+    def test_failed_batches_are_retried(self):
+        ethers = [bytes([i]) * 20 for i in range(30)]
+        client = FakeClient(fail_first=1)
+        creator = self.creator(client)
+        creator.create(ethers)
+        self.assertEqual(creator.stats['failed'], 1)
+        self.assertEqual(len(client.accounts), 30)
+
+    def test_resume(self):
+        ethers = [bytes([i]) * 20 for i in range(5)]
+        client = FakeClient()
+        self.creator(client).create(ethers)
+        again = self.creator(client)
+        again.create(ethers)
+        self.assertEqual((again.stats['existing'], again.stats['transactions']), (5, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
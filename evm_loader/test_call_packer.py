@@ -0,0 +1,116 @@
+import struct
+import unittest
+from base58 import b58encode
+from solana.publickey import PublicKey
+from solana.transaction import AccountMeta, TransactionInstruction
+from call_packer import (CallPacker, EvmCall, multi_secp256k1_data, packed_instructions,
+                         transaction_size, receipts_by_instruction, shortvec_length)
+from iterative_call import call_accounts, keccakprog
+from eth_tx_utils import make_keccak_instruction_data
+
+loader = "eeLSJgWzzxrqKv1UxtRVVH8FX3qCQWUs9QuAjJpETGU"
+
+
+def key(i):
+    return str(PublicKey(bytes([i]) * 32))
+
+
+def make_call(caller, contract=1, msg_len=40):
+    accounts = call_accounts(loader, key(100 + contract), key(200 + contract), key(caller))
+    return EvmCall(bytes([caller]) * 20, bytes(65), bytes(msg_len), accounts)
+
+
+class Signer:
+    def public_key(self):
+        return PublicKey(bytes(32))
+
+
+class FakeClient:
+    def __init__(self):
+        self.sent = []
+
+    def send_transaction(self, trx, signer, opts=None):
+        self.sent.append(trx)
+        return {'result': "sig{}".format(len(self.sent))}
+
+    def get_confirmed_transaction(self, signature):
+        trx = self.sent[int(signature[3:]) - 1]
+        inner = [{'index': i, 'instructions': [{'programIdIndex': 0,
+                                               'data': b58encode(bytes([6, 0x11]) + instruction.data[1:2]).decode()}]}
+                 for (i, instruction) in enumerate(trx.instructions) if str(instruction.program_id) == loader]
+        return {'result': {'transaction': {'signatures': [signature], 'message': {'accountKeys': [loader]}},
+                           'slot': 1, 'meta': {'innerInstructions': inner}}}
+
+
+class InstructionDataTest(unittest.TestCase):
+    def test_single_signature_matches_keccak_instruction(self):
+        self.assertEqual(multi_secp256k1_data([(1, 100)]), make_keccak_instruction_data(1, 100, 1))
+
+    def test_offsets_per_call(self):
+        data = multi_secp256k1_data([(1, 100), (3, 50)])
+        self.assertEqual(data[0], 2)
+        self.assertEqual(len(data), 1 + 2*11)
+        self.assertEqual(struct.unpack("<HBHBHHB", data[12:23]), (21, 3, 1, 3, 86, 50, 3))
+
+    def test_layout(self):
+        calls = [make_call(1), make_call(2), make_call(3)]
+        (instructions, indexes) = packed_instructions(loader, calls)
+        self.assertEqual(indexes, [1, 3, 5])
+        self.assertEqual([str(i.program_id) == keccakprog for i in instructions],
+                         [True, False, True, False, True, False])
+        self.assertEqual(instructions[2].data, b'\x00')
+        self.assertEqual(instructions[3].data[1:21], calls[1].from_addr)
+
+    def test_transaction_size(self):
+        instruction = TransactionInstruction(program_id=loader, data=bytes(200),
+                keys=[AccountMeta(pubkey=PublicKey(key(1)), is_signer=False, is_writable=True)])
+        # signatures 1+64, header 3, keys 1+3*32, blockhash 32, instructions 1+(1+1+1+2+200)
+        self.assertEqual(transaction_size(key(0), [instruction]), 65 + 3 + 97 + 32 + 206)
+        self.assertEqual(shortvec_length(127), 1)
+        self.assertEqual(shortvec_length(128), 2)
+
+
+class CallPackerTest(unittest.TestCase):
+    def setUp(self):
+        self.client = FakeClient()
+
+    def test_pack_under_size_limit(self):
+        calls = [make_call(i, contract=1, msg_len=100) for i in range(1, 10)]
+        packer = CallPacker(Signer(), loader, client=self.client)
+        batches = packer.pack(calls)
+        self.assertGreater(len(batches), 1)
+        self.assertEqual(sorted(sum(batches, [])), list(range(len(calls))))
+        for batch in batches:
+            (instructions, _) = packed_instructions(loader, [calls[i] for i in batch])
+            self.assertLessEqual(transaction_size(Signer().public_key(), instructions), 1232)
+
+    def test_account_limit(self):
+        calls = [make_call(i, contract=i) for i in range(1, 5)]
+        packer = CallPacker(Signer(), loader, client=self.client, max_account_keys=12)
+        # fee payer, secp256k1, loader, sysvars and 3 accounts per call
+        self.assertEqual(packer.pack(calls), [[0, 1], [2, 3]])
+
+    def test_caller_order(self):
+        calls = [make_call(1, msg_len=600), make_call(2, msg_len=600), make_call(2, msg_len=10)]
+        packer = CallPacker(Signer(), loader, client=self.client)
+        # the small call fits into the first batch but follows a call of its caller
+        self.assertEqual(packer.pack(calls), [[0], [1, 2]])
+
+    def test_too_large_call(self):
+        packer = CallPacker(Signer(), loader, client=self.client)
+        with self.assertRaises(Exception):
+            packer.pack([make_call(1, msg_len=1200)])
+
+    def test_receipts_in_call_order(self):
+        calls = [make_call(i, contract=i) for i in range(1, 5)]
+        packer = CallPacker(Signer(), loader, client=self.client, max_calls=3)
+        receipts = packer.call(calls)
+        self.assertEqual(len(self.client.sent), 2)
+        self.assertEqual([bytes(r.return_data) for r in receipts], [bytes([i]) for i in range(1, 5)])
+        self.assertEqual([r.signature for r in receipts], ["sig1", "sig1", "sig1", "sig2"])
+        result = self.client.get_confirmed_transaction("sig1")['result']
+        self.assertEqual(sorted(receipts_by_instruction(result)), [1, 3, 5])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+import base64
+import unittest
+from emulation_cache import EmulationCache
+
+contract = "0xc1566af4699928fdf9be097ca3dc47ece39f8f8e"
+caller = "0x2ccb0f131443b797b46dd9690a7dec9e6eeee309"
+balance_of = "70a08231" + "%064x" % 0xa1
+
+
+class FakeClient:
+    def __init__(self):
+        self.slot = 10
+        self.accounts = {'SolContract': b'\x01' * 10, 'SolCode': b'\x02' * 100, 'SolCaller': b'\x01' * 10}
+        self.fetched = []
+        self._provider = self
+
+    def get_slot(self):
+        return {'result': self.slot}
+
+    def make_request(self, method, keys, opts):
+        self.fetched.append(list(keys))
+        value = [None if key not in self.accounts else
+                 {'lamports': 1000, 'owner': 'loader', 'data': [base64.b64encode(self.accounts[key]).decode(), 'base64']}
+                 for key in keys]
+        return {'result': {'context': {'slot': self.slot}, 'value': value}}
+
+
+def emulation_result(output):
+    return {
+        'accounts': [
+            {'address': contract, 'account': 'SolContract', 'contract': 'SolCode', 'writable': False, 'new': False},
+            {'address': caller, 'account': 'SolCaller', 'contract': None, 'writable': False, 'new': False},
+        ],
+        'result': output,
+        'exit_status': 'succeed',
+    }
+
+
+class EmulationCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.client = FakeClient()
+        self.cache = EmulationCache(self.client, slot_interval=0)
+        self.calls = 0
+
+    def emulator(self, contract, caller, data):
+        self.calls += 1
+        return emulation_result("%064x" % self.calls)
+
+    def learn(self, cache=None, data=balance_of):
+        """The first emulation of a call tells its accounts; the second,
+        with their versions read before it, is cached."""
+        cache = cache or self.cache
+        cache.emulate(contract, caller, data, self.emulator)
+        return cache.emulate(contract, caller, data, self.emulator)
+
+    def test_first_result_not_cached(self):
+        self.cache.emulate(contract, caller, balance_of, self.emulator)
+        self.assertEqual(self.cache.stats()['entries'], 0)
+        self.cache.emulate(contract, caller, balance_of, self.emulator)
+        self.cache.emulate(contract, caller, balance_of, self.emulator)
+        self.assertEqual((self.calls, self.cache.stats()['entries']), (2, 1))
+
+    def test_same_slot(self):
+        first = self.learn()
+        self.assertIs(self.cache.emulate(contract[2:].upper(), caller, balance_of, self.emulator), first)
+        self.assertEqual(self.calls, 2)
+        self.assertEqual(len(self.client.fetched), 1)
+
+    def test_unchanged_accounts(self):
+        self.learn()
+        self.client.slot = 11
+        self.cache.emulate(contract, caller, balance_of, self.emulator)
+        self.assertEqual(self.calls, 2)
+        self.assertEqual(self.cache.stats()['validations'], 1)
+
+    def test_changed_account(self):
+        self.learn()
+        self.client.slot = 11
+        self.client.accounts['SolCode'] = b'\x03' * 100
+        result = self.cache.emulate(contract, caller, balance_of, self.emulator)
+        self.assertEqual(result['result'], "%064x" % 3)
+        self.assertEqual(self.cache.stats()['invalidations'], 1)
+
+    def test_change_during_emulation(self):
+        self.cache.emulate(contract, caller, balance_of, self.emulator)
+
+        def emulator(contract, caller, data):
+            # the code account changes after the versions were read
+            self.client.accounts['SolCode'] = b'\x03' * 100
+            return self.emulator(contract, caller, data)
+
+        self.cache.emulate(contract, caller, balance_of, emulator)
+        self.client.slot = 11
+        result = self.cache.emulate(contract, caller, balance_of, self.emulator)
+        self.assertEqual(result['result'], "%064x" % 3)
+        self.assertEqual(self.cache.stats()['invalidations'], 1)
+
+    def test_invalidate_accounts(self):
+        self.learn()
+        self.learn(data="18160ddd")
+        self.assertEqual(self.cache.stats()['entries'], 2)
+        self.cache.invalidate_accounts(['SolCaller'])
+        self.assertEqual(self.cache.stats()['entries'], 0)
+        self.assertEqual(self.cache.stats()['bytes'], 0)
+
+    def test_failed_call_not_cached(self):
+        result = dict(emulation_result(""), exit_status='revert')
+        self.cache.put(contract, caller, balance_of, result)
+        self.assertIsNone(self.cache.get(contract, caller, balance_of))
+
+    def test_eviction_and_stats(self):
+        cache = EmulationCache(self.client, max_entries=2, slot_interval=0)
+        for i in range(3):
+            self.learn(cache, "%08x" % i)
+        cache.emulate(contract, caller, "%08x" % 2, self.emulator)
+        stats = cache.stats()
+        self.assertEqual((stats['entries'], stats['evictions'], stats['hits'], stats['misses']), (2, 1, 1, 6))
+        self.assertEqual(stats['hit_rate'], 1 / 7)
+        self.assertGreater(stats['bytes'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
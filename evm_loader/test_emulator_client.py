@@ -0,0 +1,55 @@
+import sys
+import unittest
+from emulator_client import EmulatorClient, EmulatorError
+
+# Stand-in for `neon-cli emulate-batch`: echoes the call back, reports an
+# error for an empty caller and exits on data "ff"; the hints come back as
+# lazy_accounts
+FAKE_NEON_CLI = r'''
+import json, sys
+for line in sys.stdin:
+    request = json.loads(line)
+    if request['data'] == 'ff':
+        sys.exit(3)
+    if not request['caller']:
+        response = {'id': request['id'], 'error': 'Missing field caller'}
+    else:
+        response = {'id': request['id'], 'accounts': [], 'result': request['data'], 'exit_status': 'succeed',
+                    'lazy_accounts': request.get('hints', [])}
+    print(json.dumps(response), flush=True)
+'''
+
+contract = bytes.fromhex("c1566af4699928fdf9be097ca3dc47ece39f8f8e")
+caller = "0x2ccb0f131443b797b46dd9690a7dec9e6eeee309"
+
+
+class EmulatorClientTest(unittest.TestCase):
+    def setUp(self):
+        self.client = EmulatorClient(command=[sys.executable, '-c', FAKE_NEON_CLI])
+
+    def tearDown(self):
+        self.client.close()
+
+    def test_pipelined(self):
+        results = self.client.emulate_many([(contract, caller, "%064x" % i) for i in range(200)], timeout=10)
+        self.assertEqual([int(r['result'], 16) for r in results], list(range(200)))
+        process = self.client.process
+        self.assertEqual(self.client.emulate(contract, caller, b'\x01', timeout=10)['result'], '01')
+        self.assertIs(self.client.process, process)
+
+    def test_hints(self):
+        result = self.client.emulate(contract, caller, "00", hints=[contract, caller], timeout=10)
+        self.assertEqual(result['lazy_accounts'], [contract.hex(), caller[2:]])
+
+    def test_error(self):
+        with self.assertRaises(EmulatorError):
+            self.client.emulate(contract, "", "00", timeout=10)
+
+    def test_restart(self):
+        with self.assertRaises(EmulatorError):
+            self.client.emulate(contract, caller, "ff", timeout=10)
+        self.assertEqual(self.client.emulate(contract, caller, "02", timeout=10)['exit_status'], 'succeed')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+import unittest
+from base58 import b58encode
+from evm_receipts import decode_on_event, decode_on_return, iter_receipts, iter_logs, find_receipt, block_results
+
+loader = "eeLSJgWzzxrqKv1UxtRVVH8FX3qCQWUs9QuAjJpETGU"
+other = "Memo1UhkJRfHyvLMcVucJwxXeuD728EqVDDwQDxFMNo"
+contract = bytes.fromhex("c1566af4699928fdf9be097ca3dc47ece39f8f8e")
+topic = bytes.fromhex("%064x" % 0xabcdef)
+
+
+def on_event(address, topics, data):
+    return b'\x07' + address + len(topics).to_bytes(8, 'little') + b''.join(topics) + data
+
+
+def on_return(status, data):
+    return b'\x06' + bytes([status]) + data
+
+
+def transaction(signature, slot, inner, keys=(other, loader)):
+    return {
+        'slot': slot,
+        'transaction': {'signatures': [signature], 'message': {'accountKeys': list(keys)}},
+        'meta': {'err': None, 'innerInstructions': [
+            {'index': index, 'instructions': [
+                {'programIdIndex': program, 'data': b58encode(data).decode()} for (program, data) in instructions]}
+            for (index, instructions) in inner]},
+    }
+
+
+class DecodeTest(unittest.TestCase):
+    def test_on_event(self):
+        (address, topics, data) = decode_on_event(on_event(contract, [topic, topic], bytes.fromhex("%064x" % 3)))
+        self.assertEqual(bytes(address), contract)
+        self.assertEqual([bytes(t) for t in topics], [topic, topic])
+        self.assertEqual(bytes(data), bytes.fromhex("%064x" % 3))
+
+    def test_on_event_without_topics(self):
+        (address, topics, data) = decode_on_event(on_event(contract, [], b''))
+        self.assertEqual(topics, [])
+        self.assertEqual(len(data), 0)
+
+    def test_truncated_event(self):
+        with self.assertRaises(Exception):
+            decode_on_event(on_event(contract, [topic], b'')[:40])
+
+    def test_on_return(self):
+        (status, data) = decode_on_return(on_return(0x12, b'\x01\x02'))
+        self.assertEqual(status, 0x12)
+        self.assertEqual(bytes(data), b'\x01\x02')
+
+    def test_wrong_tag(self):
+        with self.assertRaises(Exception):
+            decode_on_return(on_event(contract, [], b''))
+
+
+class StreamTest(unittest.TestCase):
+    def results(self):
+        # Two calls in one transaction, like test_events_of_different_instructions
+        yield transaction("sig1", 10, [
+            (1, [(1, on_event(contract, [topic], b'\x01')), (1, on_return(0x11, b''))]),
+            (3, [(1, on_event(contract, [topic], b'\x02')), (1, on_event(contract, [], b'\x03')), (1, on_return(0xd0, b'revert'))]),
+        ])
+        yield None
+        yield transaction("sig2", 11, [(0, [(0, on_return(0x12, b'\x05'))]), (0, [(1, on_return(0x12, b'\x07'))])])
+
+    def test_receipts(self):
+        receipts = list(iter_receipts(self.results(), loader))
+        self.assertEqual([(r.signature, r.slot, r.instruction_index, r.status) for r in receipts],
+                         [("sig1", 10, 1, 1), ("sig1", 10, 3, 0), ("sig2", 11, 0, 1)])
+        self.assertEqual(len(receipts[0].logs), 1)
+        self.assertEqual(bytes(receipts[0].logs[0].address), contract)
+        self.assertEqual([log.log_index for log in receipts[1].logs], [0, 1])
+        # The OnReturn of the other program is skipped
+        self.assertEqual(bytes(receipts[2].return_data), b'\x07')
+
+    def test_logs_of_successful_calls(self):
+        logs = list(iter_logs(self.results(), loader))
+        self.assertEqual([bytes(log.data) for log in logs], [b'\x01'])
+
+    def test_block_results(self):
+        block = {'transactions': [next(self.results()), transaction("sig4", None, [
+            (0, [(1, on_event(contract, [], b'\x04')), (1, on_return(0x12, b''))])])]}
+        logs = list(iter_logs(block_results(block, 20), loader))
+        self.assertEqual([(log.signature, log.slot, log.transaction_index) for log in logs],
+                         [("sig1", 20, 0), ("sig4", 20, 1)])
+        self.assertIsNone(next(iter_logs(self.results(), loader)).transaction_index)
+
+    def test_find_receipt(self):
+        self.assertIsNone(find_receipt(transaction("sig3", 12, [])))
+        self.assertEqual(find_receipt(next(self.results())).exit_status, 0x11)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,217 @@
+import random
+import struct
+import unittest
+from hamt import Hamt, HamtError, HamtIndex, HEADER_LEN, CONTRACT_TAG, diff
+
+
+class HamtWriter:
+    """Port of Hamt::insert from program/src/hamt.rs, used to build storage
+    images the way the evm_loader writes them."""
+
+    def __init__(self, size=64*1024):
+        self.data = bytearray(size)
+        self.save_u32(0, HEADER_LEN)
+
+    def restore_u32(self, pos):
+        return struct.unpack_from('<I', self.data, pos)[0]
+
+    def save_u32(self, pos, value):
+        struct.pack_into('<I', self.data, pos, value)
+
+    def save_value(self, pos, value):
+        self.data[pos:pos+32] = value.to_bytes(32, 'little')
+
+    def restore_value(self, pos):
+        return int.from_bytes(self.data[pos:pos+32], 'little')
+
+    def allocate_item(self, item_type):
+        size = 64 if item_type == 0 else 4 + item_type*4
+        free_pos = item_type*4
+        if 0 < item_type < 32:
+            item_pos = self.restore_u32(free_pos)
+            if item_pos != 0:
+                self.save_u32(free_pos, self.restore_u32(item_pos))
+                return item_pos
+        item_pos = self.restore_u32(0)
+        if item_pos + size > len(self.data):
+            raise Exception("AccountDataTooSmall")
+        self.save_u32(0, item_pos + size)
+        return item_pos
+
+    def release_item(self, item_type, item_pos):
+        self.save_u32(item_pos, self.restore_u32(item_type*4))
+        self.save_u32(item_type*4, item_pos)
+
+    def place_item(self, key, value):
+        pos = self.allocate_item(0)
+        self.save_value(pos, key)
+        self.save_value(pos+32, value)
+        return pos | 1
+
+    def insert(self, key, value):
+        self.insert_item(128 + (key & 31)*4, key >> 5, value)
+
+    def insert_item(self, ptr_pos, key, value):
+        d = self.restore_u32(ptr_pos)
+        if d == 0:
+            self.save_u32(ptr_pos, self.place_item(key, value))
+        elif d & 1:
+            pos = d & ~1
+            old_key = self.restore_value(pos)
+            if old_key == key:
+                self.save_value(pos+32, value)
+                return
+            (old_key, old_tag) = (old_key >> 5, old_key & 31)
+            (new_key, new_tag) = (key >> 5, key & 31)
+            while old_tag == new_tag:
+                array_pos = self.allocate_item(1)
+                self.save_u32(array_pos, 1 << old_tag)
+                self.save_u32(ptr_pos, array_pos)
+                ptr_pos = array_pos+4
+                (old_key, old_tag) = (old_key >> 5, old_key & 31)
+                (new_key, new_tag) = (new_key >> 5, new_key & 31)
+            item_pos = self.place_item(new_key, value)
+            self.save_value(pos, old_key)
+            (item1, item2) = (pos | 1, item_pos) if old_tag < new_tag else (item_pos, pos | 1)
+            array_pos = self.allocate_item(2)
+            self.save_u32(array_pos, (1 << old_tag) | (1 << new_tag))
+            self.save_u32(array_pos+4, item1)
+            self.save_u32(array_pos+8, item2)
+            self.save_u32(ptr_pos, array_pos)
+        else:
+            pos = d
+            (key, tag) = (key >> 5, key & 31)
+            tags = self.restore_u32(pos)
+            shift = bin(tags & ((1 << tag)-1)).count('1')
+            if tags & (1 << tag):
+                return self.insert_item(pos+4+shift*4, key, value)
+            total = bin(tags).count('1')
+            array_pos = self.allocate_item(total+1)
+            item_pos = self.place_item(key, value)
+            self.save_u32(array_pos, tags | (1 << tag))
+            self.data[array_pos+4:array_pos+4+shift*4] = self.data[pos+4:pos+4+shift*4]
+            self.save_u32(array_pos+4+shift*4, item_pos)
+            self.data[array_pos+8+shift*4:array_pos+4+total*4+4] = self.data[pos+4+shift*4:pos+4+total*4]
+            self.release_item(total, pos)
+            self.save_u32(ptr_pos, array_pos)
+
+
+def build(items, size=256*1024):
+    writer = HamtWriter(size)
+    for (key, value) in items:
+        writer.insert(key, value)
+    return writer
+
+
+def sample_items(count, seed=1):
+    rnd = random.Random(seed)
+    items = {}
+    # Sequential slots like Solidity state variables, colliding low bits
+    # like test_new in hamt.rs, and random mapping slots
+    for i in range(count):
+        items[i] = rnd.getrandbits(256)
+        items[0x31423415 + i*32*0x60] = rnd.getrandbits(64)
+        items[rnd.getrandbits(256)] = rnd.getrandbits(256)
+    return items
+
+
+class HamtReaderTest(unittest.TestCase):
+    def test_empty(self):
+        hamt = Hamt(build([]).data)
+        self.assertIsNone(hamt.find(1))
+        self.assertEqual(hamt.get(1), 0)
+        self.assertEqual(list(hamt.items()), [])
+
+    def test_find(self):
+        items = sample_items(100)
+        hamt = Hamt(build(items.items()).data)
+        for (key, value) in items.items():
+            self.assertEqual(hamt.find(key), value)
+        self.assertIsNone(hamt.find(0x31423415 + 32))
+        self.assertNotIn(12345678, hamt)
+
+    def test_overwrite(self):
+        hamt = Hamt(build([(5, 1), (37, 2), (5, 3)]).data)
+        self.assertEqual(dict(hamt.items()), {5: 3, 37: 2})
+
+    def test_items(self):
+        items = sample_items(100)
+        hamt = Hamt(build(items.items()).data)
+        iterator = hamt.items()
+        self.assertEqual(next(iterator)[0] & 31, 0)
+        self.assertEqual(dict(hamt.items()), items)
+        self.assertEqual(len(list(hamt)), len(items))
+
+    def test_find_many(self):
+        items = sample_items(50)
+        hamt = Hamt(build(items.items()).data)
+        keys = list(items)[:60] + [1 << 200, 0x31423415 + 32]
+        expected = {key: items[key] for key in keys if key in items}
+        self.assertEqual(hamt.find_many(keys), expected)
+
+    def test_code_account(self):
+        code = bytes.fromhex("6080604052")
+        header = bytes([CONTRACT_TAG]) + bytes(32) + len(code).to_bytes(4, 'little')
+        account = header + code + bytes(build([(1, 2)]).data)
+        self.assertEqual(Hamt.from_code_account(account).get(1), 2)
+
+    def test_invalid(self):
+        with self.assertRaises(HamtError):
+            Hamt(bytes(HEADER_LEN))
+        with self.assertRaises(HamtError):
+            Hamt(bytes(16))
+
+
+class HamtDiffTest(unittest.TestCase):
+    def snapshot(self, writer):
+        return Hamt(bytes(writer.data))
+
+    def expected(self, before, after):
+        keys = before.keys() | after.keys()
+        return {key: (before.get(key), after.get(key)) for key in keys if before.get(key) != after.get(key)}
+
+    def changes(self, old, new, index=None):
+        return {key: (a, b) for (key, a, b) in diff(old, new, index)}
+
+    def test_no_changes(self):
+        hamt = Hamt(build(sample_items(50).items()).data)
+        self.assertEqual(list(diff(hamt, Hamt(bytes(hamt.data)))), [])
+
+    def test_changes(self):
+        items = sample_items(100)
+        writer = build(items.items())
+        old = self.snapshot(writer)
+        updated = dict(items)
+        # Value update in place, a new slot, an item split into arrays
+        # and growth of an array (the freed array is reused below)
+        changes = [(0, 1), (1 << 255, 2), (0x31423415 + 32, 3), (0x31423415 + 32*0x60*1000, 4), (12345, 5)]
+        for (key, value) in changes:
+            writer.insert(key, value)
+            updated[key] = value
+        new = self.snapshot(writer)
+        self.assertEqual(self.changes(old, new), self.expected(items, updated))
+
+    def test_index_follows_snapshots(self):
+        items = sample_items(100)
+        writer = build(items.items())
+        snapshots = [self.snapshot(writer)]
+        states = [dict(items)]
+        for (i, key) in enumerate([7, 1 << 100, 0x31423415 + 64, 7, 99999, 1 << 100]):
+            writer.insert(key, i + 1)
+            snapshots.append(self.snapshot(writer))
+            states.append(dict(states[-1]))
+            states[-1][key] = i + 1
+
+        index = HamtIndex(snapshots[0])
+        for i in range(1, len(snapshots)):
+            self.assertEqual(self.changes(snapshots[i-1], snapshots[i], index), self.expected(states[i-1], states[i]))
+            self.assertEqual(index.nodes, HamtIndex(snapshots[i]).nodes)
+
+    def test_stale_index(self):
+        hamt = Hamt(build([(1, 2)]).data)
+        with self.assertRaises(HamtError):
+            list(diff(hamt, hamt, HamtIndex(Hamt(build([]).data))))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,218 @@
+import unittest
+from base58 import b58encode
+from solana.rpc.api import SendTransactionError
+from iterative_call import StepCountTuner, IterativeCaller, compute_units_consumed, is_budget_exceeded
+from evm_receipts import find_receipt
+
+loader = "eeLSJgWzzxrqKv1UxtRVVH8FX3qCQWUs9QuAjJpETGU"
+other = "Memo1UhkJRfHyvLMcVucJwxXeuD728EqVDDwQDxFMNo"
+
+
+class StepCountTunerTest(unittest.TestCase):
+    def test_default_without_history(self):
+        tuner = StepCountTuner(default_steps=50)
+        self.assertEqual(tuner.initial_steps(('contract', b'1234')), 50)
+
+    def test_steps_follow_consumed_units(self):
+        tuner = StepCountTuner(compute_budget=200000, target=0.8, max_growth=100)
+        key = ('contract', b'1234')
+        # 50 steps used 20000 units: 400 units per step -> 160000/400
+        self.assertEqual(tuner.next_steps(key, 50, 20000, 200000), 400)
+        self.assertEqual(tuner.initial_steps(key), 400)
+
+    def test_growth_is_limited(self):
+        tuner = StepCountTuner(max_growth=4)
+        self.assertEqual(tuner.next_steps(None, 50, 1000), 200)
+
+    def test_budget_exceeded_halves_steps(self):
+        tuner = StepCountTuner(min_steps=10)
+        key = ('contract', b'1234')
+        self.assertEqual(tuner.budget_exceeded(key, 400), 200)
+        self.assertEqual(tuner.budget_exceeded(key, 15), 10)
+        self.assertLessEqual(tuner.initial_steps(key), 400)
+
+
+class LogParsingTest(unittest.TestCase):
+    def test_top_level_units(self):
+        result = {'meta': {'logMessages': [
+            "Program {} invoke [1]".format(loader),
+            "Program {} invoke [2]".format(loader),
+            "Program {} consumed 1000 of 150000 compute units".format(loader),
+            "Program {} success".format(loader),
+            "Program {} invoke [2]".format(other),
+            "Program {} consumed 500 of 140000 compute units".format(other),
+            "Program {} success".format(other),
+            "Program {} consumed 123456 of 200000 compute units".format(loader),
+            "Program {} success".format(loader),
+        ]}}
+        self.assertEqual(compute_units_consumed(result, loader), (123456, 200000))
+
+    def test_no_logs(self):
+        self.assertIsNone(compute_units_consumed({'meta': {'logMessages': None}}, loader))
+
+    def test_budget_errors(self):
+        self.assertTrue(is_budget_exceeded(budget_exceeded_error()))
+        self.assertTrue(is_budget_exceeded({'InstructionError': [0, 'ProgramFailedToComplete']}))
+        self.assertFalse(is_budget_exceeded(Exception("invalid account data for instruction")))
+        self.assertFalse(is_budget_exceeded({'InstructionError': [0, 'InvalidAccountData']}))
+        # same error kind, but the logs show another VM failure
+        self.assertFalse(is_budget_exceeded(budget_exceeded_error(failure="Access violation in stack frame 3")))
+
+
+OUT_OF_BUDGET = "exceeded maximum number of instructions allowed (200000) at instruction #41852"
+
+
+def budget_exceeded_error(instruction=0, failure=OUT_OF_BUDGET):
+    """SendTransactionError of a preflight that ran out of compute units
+    (or failed with another VM `failure`), as Solana 1.6 reports it."""
+    return SendTransactionError({
+        'code': -32002,
+        'message': "Transaction simulation failed: Error processing Instruction {}: "
+                   "Program failed to complete".format(instruction),
+        'data': {
+            'accounts': None,
+            'err': {'InstructionError': [instruction, 'ProgramFailedToComplete']},
+            'logs': [
+                "Program {} invoke [1]".format(loader),
+                "Program {} consumed 200000 of 200000 compute units".format(loader),
+                "Program failed to complete: {}".format(failure),
+                "Program {} failed: Program failed to complete".format(loader),
+            ],
+        },
+    })
+
+
+class FakeClient:
+    """Executes Continue transactions in order of arrival against a call
+    that needs `total_steps` EVM steps."""
+    def __init__(self, total_steps):
+        self.remaining = total_steps
+        self.statuses = {}
+        self.transactions = {}
+        self.step_counts = []
+
+    def signature(self, step_count):
+        return "sig{}".format(len(self.statuses))
+
+    def send_transaction(self, trx, *signers, opts=None):
+        step_count = int.from_bytes(trx.instructions[0].data[1:9], 'little')
+        signature = self.signature(step_count)
+        self.step_counts.append(step_count)
+        if self.remaining <= 0:
+            self.statuses[signature] = {'err': {'InstructionError': [0, 'InvalidAccountData']}}
+            return {'result': signature}
+        self.remaining -= step_count
+        inner = []
+        if self.remaining <= 0:
+            inner = [{'index': 0, 'instructions': [{'data': b58encode(b'\x06\x11').decode()}]}]
+        self.statuses[signature] = {'err': None}
+        self.transactions[signature] = {'meta': {'innerInstructions': inner, 'logMessages': [
+            "Program {} invoke [1]".format(loader),
+            "Program {} consumed {} of 200000 compute units".format(loader, step_count*100),
+            "Program {} success".format(loader)]}}
+        return {'result': signature}
+
+    def get_signature_statuses(self, signatures):
+        return {'result': {'value': [self.statuses.get(s) for s in signatures]}}
+
+    def get_confirmed_transaction(self, signature):
+        return {'result': self.transactions.get(signature)}
+
+
+class BudgetLimitedClient(FakeClient):
+    """FakeClient confirming every Continue; the preflight of a Continue
+    of more than `max_steps` runs out of compute units."""
+    def __init__(self, total_steps, max_steps, failure=OUT_OF_BUDGET):
+        super().__init__(total_steps)
+        self.max_steps = max_steps
+        self.failure = failure
+
+    def send_transaction(self, trx, *signers, opts=None):
+        step_count = int.from_bytes(trx.instructions[0].data[1:9], 'little')
+        if step_count > self.max_steps:
+            self.step_counts.append(step_count)
+            raise budget_exceeded_error(failure=self.failure)
+        signature = super().send_transaction(trx, *signers, opts=opts)['result']
+        return {'result': self.transactions[signature]}
+
+
+class SameBlockhashClient(FakeClient):
+    """FakeClient whose blockhash only changes every `blockhash_sends`
+    sends: a Continue repeating an earlier one has its signature and isn't
+    executed again."""
+    def __init__(self, total_steps, blockhash_sends):
+        super().__init__(total_steps)
+        self.blockhash_sends = blockhash_sends
+        self.sends = 0
+        self.duplicates = 0
+        self.fetched = []
+
+    def signature(self, step_count):
+        return "{}:{}".format(self.sends // self.blockhash_sends, step_count)
+
+    def send_transaction(self, trx, *signers, opts=None):
+        self.sends += 1
+        signature = self.signature(int.from_bytes(trx.instructions[0].data[1:9], 'little'))
+        if signature in self.statuses:
+            self.duplicates += 1
+            return {'result': signature}
+        return super().send_transaction(trx, *signers, opts=opts)
+
+    def get_confirmed_transaction(self, signature):
+        self.fetched.append(signature)
+        return super().get_confirmed_transaction(signature)
+
+
+class RunTest(unittest.TestCase):
+    def test_budget_exceeded_halves_steps(self):
+        client = BudgetLimitedClient(total_steps=1000, max_steps=150)
+        caller = IterativeCaller(None, loader, client=client, tuner=StepCountTuner(default_steps=400))
+        result = caller.run(None, [], key='key')
+        self.assertIsNotNone(find_receipt(result))
+        self.assertEqual(client.step_counts[:3], [400, 200, 100])
+
+    def test_other_vm_errors_raised(self):
+        client = BudgetLimitedClient(total_steps=1000, max_steps=150, failure="Access violation in stack frame 3")
+        caller = IterativeCaller(None, loader, client=client, tuner=StepCountTuner(default_steps=400))
+        with self.assertRaises(SendTransactionError):
+            caller.run(None, [], key='key')
+        self.assertEqual(client.step_counts, [400])
+
+
+class PipelinedRunTest(unittest.TestCase):
+    def test_stops_at_on_return(self):
+        client = FakeClient(total_steps=10000)
+        caller = IterativeCaller(None, loader, client=client, pipeline_window=4, poll_interval=0)
+        result = caller.run(None, [], key='key')
+        self.assertIsNotNone(find_receipt(result))
+        self.assertLessEqual(client.remaining, 0)
+        # Continues of one window never share a step count (and signature)
+        self.assertEqual(len(set(client.step_counts[:4])), 4)
+
+    def test_duplicate_signatures_not_tracked_twice(self):
+        # the step count never changes, so later windows repeat the first one
+        client = SameBlockhashClient(total_steps=2000, blockhash_sends=10)
+        tuner = StepCountTuner(default_steps=50, min_steps=50, max_steps=50)
+        caller = IterativeCaller(None, loader, client=client, tuner=tuner, pipeline_window=4, poll_interval=0)
+        result = caller.run(None, [], key='key')
+        self.assertIsNotNone(find_receipt(result))
+        self.assertGreater(client.duplicates, 0)
+        # an earlier transaction is never taken for a new one
+        self.assertEqual(len(client.fetched), len(set(client.fetched)))
+
+    def test_drain_waits_for_every_signature(self):
+        client = FakeClient(total_steps=0)
+        polls = []
+
+        def get_signature_statuses(signatures):
+            polls.append(sorted(signatures))
+            return {'result': {'value': [{'err': None} if len(polls) > 1 or s == 'a' else None
+                                         for s in signatures]}}
+
+        client.get_signature_statuses = get_signature_statuses
+        IterativeCaller(None, loader, client=client, poll_interval=0)._drain(['a', 'lost'])
+        self.assertEqual(polls, [['a', 'lost'], ['lost']])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,38 @@
+import unittest
+from load_benchmark import percentile, summarize, failure_cause, parse_mix
+
+
+class LoadBenchmarkReportTest(unittest.TestCase):
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual([percentile(values, q) for q in (50, 95, 99, 100)], [50, 95, 99, 100])
+        self.assertEqual(percentile([7], 99), 7)
+        self.assertIsNone(percentile([], 50))
+
+    def test_summarize(self):
+        records = [('call', 0.5, None)] * 90 + [('call', 2.0, None)] * 10 + \
+                  [('partial', 3.0, None), ('partial', 0.1, 'budget_exceeded'), ('call', 0.2, 'account_in_use')]
+        report = summarize(records, 10.0, 4)
+        self.assertEqual((report['operations'], report['succeeded'], report['failed']), (103, 101, 2))
+        self.assertEqual(report['tps'], 10.1)
+        self.assertEqual(report['workloads']['call']['latency']['p50'], 0.5)
+        self.assertEqual(report['workloads']['call']['latency']['p95'], 2.0)
+        self.assertEqual(report['workloads']['partial']['failed'], 1)
+        self.assertNotIn('deploy', report['workloads'])
+        self.assertEqual(report['failures'], {'budget_exceeded': 1, 'account_in_use': 1})
+
+    def test_failure_cause(self):
+        self.assertEqual(failure_cause(Exception("Transaction simulation failed: Blockhash not found")),
+                         "blockhash_not_found")
+        self.assertEqual(failure_cause(Exception({'InstructionError': [1, 'ComputationalBudgetExceeded']})),
+                         "budget_exceeded")
+        self.assertEqual(failure_cause(KeyError('x')), "KeyError")
+
+    def test_parse_mix(self):
+        self.assertEqual(parse_mix("call=8,partial"), {'call': 8.0, 'partial': 1.0})
+        with self.assertRaises(ValueError):
+            parse_mix("transfer=1")
+
+
+if __name__ == '__main__':
+    unittest.main()
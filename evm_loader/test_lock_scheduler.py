@@ -0,0 +1,128 @@
+import base64
+import threading
+import time
+import unittest
+from base58 import b58encode
+from solana.transaction import AccountMeta
+from solana.publickey import PublicKey
+from account_data import Account
+from iterative_call import call_accounts
+from lock_scheduler import LockScheduler, accounts_from_emulation, accounts_from_metas
+
+loader = "eeLSJgWzzxrqKv1UxtRVVH8FX3qCQWUs9QuAjJpETGU"
+
+
+def key(i):
+    return b58encode(bytes([i]) * 32).decode()
+
+
+class FakeClient:
+    def __init__(self):
+        self.blocked = {}
+        self._provider = self
+
+    def make_request(self, method, keys, opts):
+        value = []
+        for account in keys:
+            data = bytearray(Account.size())
+            storage = self.blocked.get(account)
+            Account.pack(data, bytes(20), 255, 0, bytes(32),
+                         blocked=None if storage is None else PublicKey(storage))
+            value.append({'lamports': 1, 'owner': loader, 'data': [base64.b64encode(bytes(data)).decode(), 'base64']})
+        return {'result': {'context': {'slot': 1}, 'value': value}}
+
+
+class AccountSetTest(unittest.TestCase):
+    def test_from_emulation(self):
+        result = {'accounts': [{'account': key(1), 'contract': key(2)}, {'account': key(3), 'contract': None}]}
+        self.assertEqual(accounts_from_emulation(result), [key(1), key(3)])
+
+    def test_from_metas(self):
+        metas = call_accounts(loader, key(1), key(2), key(3),
+                              extra=[AccountMeta(pubkey=PublicKey(key(4)), is_signer=False, is_writable=False)])
+        self.assertEqual(accounts_from_metas(metas, loader), [key(1), key(2), key(3)])
+
+
+class LockSchedulerTest(unittest.TestCase):
+    def setUp(self):
+        self.client = FakeClient()
+        self.scheduler = LockScheduler(loader, client=self.client, max_parallel=4)
+
+    def tearDown(self):
+        self.scheduler.close()
+
+    def test_disjoint_calls_run_in_parallel(self):
+        barrier = threading.Barrier(2, timeout=5)
+        first = self.scheduler.submit([key(1)], barrier.wait)
+        second = self.scheduler.submit([key(2)], barrier.wait)
+        first.result(5)
+        second.result(5)
+
+    def test_conflicting_calls_run_in_order(self):
+        order = []
+        release = threading.Event()
+
+        def call(name):
+            def run():
+                if name == 'a':
+                    release.wait(5)
+                order.append(name)
+            return run
+
+        a = self.scheduler.submit([key(1), key(2)], call('a'))
+        b = self.scheduler.submit([key(2)], call('b'))
+        c = self.scheduler.submit([key(3)], call('c'))
+        c.result(5)
+        self.assertEqual(self.scheduler.waiting(), 1)
+        self.assertEqual(self.scheduler.holders(), {key(1): None, key(2): None})
+        release.set()
+        b.result(5)
+        self.assertEqual(order, ['c', 'a', 'b'])
+        self.assertTrue(a.done())
+
+    def test_failure_releases_dependents(self):
+        def fail():
+            raise Exception("InvalidAccountData")
+        first = self.scheduler.submit([key(1)], fail)
+        second = self.scheduler.submit([key(1)], lambda: 42)
+        self.assertEqual(second.result(5), 42)
+        self.assertRaises(Exception, first.result)
+
+    def test_external_lock(self):
+        self.client.blocked[key(1)] = key(9)
+        self.assertEqual(self.scheduler.reconcile([key(1)]), {key(1): key(9)})
+        future = self.scheduler.submit([key(1)], lambda: 'done')
+        self.assertFalse(future.done())
+        self.assertEqual(self.scheduler.waiting(), 1)
+
+        del self.client.blocked[key(1)]
+        self.assertEqual(self.scheduler.reconcile(), {})
+        self.assertEqual(future.result(5), 'done')
+
+    def test_deferred_calls_reconciled_in_background(self):
+        scheduler = LockScheduler(loader, client=self.client, reconcile_interval=0.01, max_reconcile_interval=0.04)
+        self.client.blocked[key(1)] = key(9)
+        scheduler.reconcile([key(1)])
+        future = scheduler.submit([key(1)], lambda: 'done')
+        while scheduler.stats['reconciles'] < 4:
+            time.sleep(0.01)
+        self.assertFalse(future.done())
+        self.assertEqual(scheduler.stats['deferred'], 1)
+        self.assertEqual(scheduler.reconcile_delay, 0.04)
+
+        del self.client.blocked[key(1)]
+        self.assertEqual(future.result(5), 'done')
+        scheduler.close()
+        self.assertEqual(scheduler.stats['deferred'], 1)
+
+    def test_own_lock_is_not_external(self):
+        release = threading.Event()
+        self.client.blocked[key(1)] = key(9)
+        future = self.scheduler.submit([key(1)], lambda: release.wait(5), storage=key(9))
+        self.assertEqual(self.scheduler.reconcile([key(1)]), {})
+        release.set()
+        future.result(5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+import os
+import tempfile
+import unittest
+from evm_receipts import EvmLog
+from log_index import LogIndex, Bloom
+
+token = bytes.fromhex("c1566af4699928fdf9be097ca3dc47ece39f8f8e")
+other = bytes.fromhex("2ccb0f131443b797b46dd9690a7dec9e6eeee309")
+transfer = bytes.fromhex("ddf252ad1be2c89b69c2b068fc378daa952ba7f163c4a11628f55a4df523b3ef")
+approval = bytes.fromhex("8c5be1e5ebec7d5bd14f71427d1e84f3dd0314c0f7b2291e5b200ac8c7c3b925")
+alice = bytes(12) + bytes.fromhex("00000000000000000000000000000000000000a1")
+bob = bytes(12) + bytes.fromhex("00000000000000000000000000000000000000b0")
+
+
+def log(slot, address, topics, index=0, signature=None, position=None):
+    return EvmLog(address, topics, b'\x01', signature or "sig{}".format(slot), slot, 1, index, position)
+
+
+class BloomTest(unittest.TestCase):
+    def test_contains(self):
+        bloom = Bloom()
+        bloom.add(b'item')
+        self.assertIn(b'item', bloom)
+        self.assertNotIn(b'other', bloom)
+        self.assertIn(b'item', Bloom(bytes(bloom.bits)))
+        bloom.add(b'item')
+        self.assertEqual(bloom.count, 1)
+
+    def test_sized(self):
+        (size, hashes) = Bloom.sized(1000, 0.01)
+        bloom = Bloom(None, size, hashes)
+        for i in range(1000):
+            bloom.add(b'in' + i.to_bytes(4, 'little'))
+        false_positives = sum(b'out' + i.to_bytes(4, 'little') in bloom for i in range(10000))
+        self.assertLess(false_positives, 200)
+
+
+class LogIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, "logs.db")
+        self.index = LogIndex(self.path, segment_slots=100)
+        self.index.add_logs([
+            log(5, token, [transfer, alice, bob]),
+            log(5, token, [approval, alice, bob], index=1),
+            log(150, other, [transfer, bob, alice]),
+            log(420, token, [transfer, bob, alice]),
+            log(421, token, []),
+        ])
+
+    def tearDown(self):
+        self.index.close()
+        self.dir.cleanup()
+
+    def slots(self, logs):
+        return [(entry.slot, entry.log_index) for entry in logs]
+
+    def test_range(self):
+        self.assertEqual(self.slots(self.index.get_logs(0, 200)), [(5, 0), (5, 1), (150, 0)])
+        self.assertEqual(self.slots(self.index.get_logs(400)), [(420, 0), (421, 0)])
+        self.assertEqual(self.index.last_slot(), 421)
+
+    def test_address(self):
+        self.assertEqual(self.slots(self.index.get_logs(address=other)), [(150, 0)])
+        self.assertEqual(len(self.index.get_logs(address=[token, other])), 5)
+
+    def test_topics(self):
+        self.assertEqual(self.slots(self.index.get_logs(topics=[transfer])), [(5, 0), (150, 0), (420, 0)])
+        self.assertEqual(self.slots(self.index.get_logs(topics=[None, bob])), [(150, 0), (420, 0)])
+        self.assertEqual(self.slots(self.index.get_logs(topics=[[transfer, approval], alice])), [(5, 0), (5, 1)])
+        self.assertEqual(self.index.get_logs(topics=[None, None, None, transfer]), [])
+
+    def test_record(self):
+        (entry,) = self.index.get_logs(150, 150)
+        self.assertEqual(entry.address, other)
+        self.assertEqual(entry.topics, [transfer, bob, alice])
+        self.assertEqual(entry.signature, "sig150")
+
+    def test_reopen_and_duplicates(self):
+        self.index.close()
+        self.index = LogIndex(self.path, segment_slots=5000)
+        self.assertEqual(self.index.segment_slots, 100)
+        self.index.add_logs([log(5, token, [transfer, alice, bob])])
+        self.assertEqual(len(self.index.get_logs(0, 10)), 2)
+
+    def test_position_in_block(self):
+        self.index.add_logs([
+            log(700, token, [transfer], signature="a", position=2),
+            log(700, token, [transfer], signature="b", position=0),
+            log(700, token, [transfer], index=1, signature="b", position=0),
+            log(700, token, [transfer], signature="c", position=1),
+        ])
+        logs = self.index.get_logs(700, 700)
+        self.assertEqual([(entry.signature, entry.log_index) for entry in logs], [("b", 0), ("b", 1), ("c", 0), ("a", 0)])
+        self.assertEqual([entry.transaction_index for entry in logs], [0, 0, 1, 2])
+
+
+class BusySegmentTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, "logs.db")
+        self.index = LogIndex(self.path, segment_slots=1000, bloom_capacity=64)
+        # 4 items per log: 16 logs per filter
+        self.index.add_logs([log(slot, token, [transfer, alice, slot.to_bytes(32, 'big')]) for slot in range(500)])
+
+    def tearDown(self):
+        self.index.close()
+        self.dir.cleanup()
+
+    def test_filters_dont_saturate(self):
+        blooms = self.index._segment_blooms(0)
+        self.assertGreater(len(blooms), 1)
+        self.assertTrue(all(bloom.count <= 64 for bloom in blooms))
+        self.assertEqual(self.index._slot_ranges(0, 999, [other], []), [])
+        self.assertEqual(self.index._slot_ranges(0, 999, None, [None, None, (999).to_bytes(32, 'big')]), [])
+
+    def test_reopen(self):
+        self.index.close()
+        self.index = LogIndex(self.path, bloom_capacity=5000)
+        self.assertEqual(self.index.bloom_capacity, 64)
+        count = len(self.index._segment_blooms(0))
+        self.index.add_logs([log(5, token, [transfer, alice, (5).to_bytes(32, 'big')])])
+        self.assertEqual(len(self.index._segment_blooms(0)), count)
+        (entry,) = self.index.get_logs(topics=[None, None, (499).to_bytes(32, 'big')])
+        self.assertEqual(entry.slot, 499)
+
+
+if __name__ == '__main__':
+    unittest.main()
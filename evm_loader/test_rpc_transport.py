@@ -0,0 +1,100 @@
+import json
+import unittest
+import requests
+from rpc_transport import RpcTransport, RpcError, make_client
+from solana_utils import getMultipleAccounts
+
+
+class FakeResponse:
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self.body = body
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError("HTTP {}".format(self.status_code))
+
+    def json(self):
+        return self.body
+
+
+class FakeSession:
+    """Answers with the queued failures first, then with `answer`."""
+
+    def __init__(self, failures=()):
+        self.failures = list(failures)
+        self.posted = []
+
+    def post(self, url, data, timeout, headers):
+        payload = json.loads(data)
+        self.posted.append(payload)
+        if self.failures:
+            failure = self.failures.pop(0)
+            if isinstance(failure, Exception):
+                raise failure
+            if isinstance(failure, int):
+                return FakeResponse(failure, None)
+            return FakeResponse(200, dict(failure, id=payload['id']))
+        if isinstance(payload, list):
+            return FakeResponse(200, [self.answer(request) for request in reversed(payload)])
+        return FakeResponse(200, self.answer(payload))
+
+    def answer(self, request):
+        if request['method'] == 'getMultipleAccounts':
+            (keys, _) = request['params']
+            return {'id': request['id'], 'result': {'context': {'slot': 5}, 'value': [{'key': key} for key in keys]}}
+        return {'id': request['id'], 'result': request['params']}
+
+
+class RpcTransportTest(unittest.TestCase):
+    def transport(self, failures=()):
+        self.session = FakeSession(failures)
+        self.delays = []
+        return RpcTransport("http://localhost:8899", session=self.session, retries=3, sleep=self.delays.append)
+
+    def test_request(self):
+        transport = self.transport()
+        self.assertEqual(transport.make_request("getBalance", "key")['result'], ["key"])
+        stats = transport.stats()['getBalance']
+        self.assertEqual((stats['requests'], stats['errors'], stats['retries']), (1, {}, 0))
+        self.assertEqual(sum(stats['buckets'].values()), 1)
+
+    def test_retry_transient_errors(self):
+        transport = self.transport([requests.ConnectionError(), 503, {'error': {'code': -32005, 'message': 'behind'}}])
+        self.assertEqual(transport.make_request("getSlot")['result'], [])
+        stats = transport.stats()['getSlot']
+        self.assertEqual(stats['retries'], 3)
+        self.assertEqual(stats['errors'], {'ConnectionError': 1, 'HTTP 503': 1, 'rpc -32005': 1})
+        self.assertEqual(len(self.delays), 3)
+        self.assertTrue(self.delays[0] <= self.delays[1] <= self.delays[2] * 2)
+
+    def test_retries_exhausted(self):
+        transport = self.transport([502] * 4)
+        with self.assertRaises(RpcError):
+            transport.make_request("getSlot")
+        self.assertEqual(len(self.session.posted), 4)
+
+    def test_rpc_errors_not_retried(self):
+        transport = self.transport([{'error': {'code': -32002, 'message': 'simulation failed'}}])
+        self.assertEqual(transport.make_request("sendTransaction", "trx")['error']['code'], -32002)
+        self.assertEqual(len(self.session.posted), 1)
+
+    def test_batch_keeps_order(self):
+        transport = self.transport()
+        answers = transport.batch([("getBalance", ("a",)), ("getBalance", ("b",)), ("getSlot", ())])
+        self.assertEqual([answer['result'] for answer in answers], [["a"], ["b"], []])
+        self.assertEqual(len(self.session.posted), 1)
+        self.assertIn("batch:getBalance+getSlot", transport.stats())
+
+    def test_multiple_accounts_batched(self):
+        client = make_client(self.transport())
+        keys = ["key{}".format(i) for i in range(250)]
+        (slot, infos) = getMultipleAccounts(client, keys)
+        self.assertEqual(slot, 5)
+        self.assertEqual([info['key'] for info in infos], keys)
+        self.assertEqual(len(self.session.posted), 1)
+        self.assertEqual([len(request['params'][0]) for request in self.session.posted[0]], [100, 100, 50])
+
+
+if __name__ == '__main__':
+    unittest.main()
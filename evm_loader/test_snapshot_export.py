@@ -0,0 +1,126 @@
+import base64
+import json
+import os
+import tempfile
+import unittest
+from base58 import b58encode
+from account_data import Account, Storage
+from snapshot_export import SnapshotExporter, KINDS, iter_json_array, read_records
+
+ether = bytes.fromhex("c1566af4699928fdf9be097ca3dc47ece39f8f8e")
+signer = bytes(range(32))
+kinds = {kind.name: kind for kind in KINDS}
+
+
+def entry(i, data):
+    return {'pubkey': b58encode(bytes([i]) * 32).decode(),
+            'account': {'data': [base64.b64encode(data).decode(), 'base64'], 'lamports': 1000 + i}}
+
+
+def chunked(text, size):
+    return (text[i:i+size] for i in range(0, len(text), size))
+
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+        self.closed = False
+
+    def raise_for_status(self):
+        pass
+
+    def iter_content(self, chunk_size):
+        return chunked(self.text.encode(), 7)
+
+    def close(self):
+        self.closed = True
+
+
+class FakeSession:
+    """getProgramAccounts of the entries that pass the filters."""
+
+    def __init__(self, programs):
+        self.programs = programs
+        self.responses = []
+
+    def post(self, url, data, timeout, headers, stream):
+        (program, opts) = json.loads(data)['params']
+        result = []
+        for item in self.programs[program]:
+            raw = base64.b64decode(item['account']['data'][0])
+            if all(self.matches(raw, f) for f in opts['filters']):
+                length = opts['dataSlice']['length']
+                result.append(dict(item, account=dict(item['account'], data=[
+                    base64.b64encode(raw[:length]).decode(), 'base64'])))
+        response = FakeResponse(json.dumps({'jsonrpc': '2.0', 'result': result, 'id': 1}))
+        self.responses.append(response)
+        return response
+
+    @staticmethod
+    def matches(raw, f):
+        if 'dataSize' in f:
+            return len(raw) == f['dataSize']
+        return raw[0] == {'2': 1, '3': 2, '4': 3}[f['memcmp']['bytes']]
+
+
+class IterJsonArrayTest(unittest.TestCase):
+    def test_items(self):
+        items = [{'pubkey': str(i), 'account': {'data': ['x' * i, 'base64']}} for i in range(50)]
+        text = json.dumps({'jsonrpc': '2.0', 'result': items, 'id': 1}, indent=1)
+        for size in (1, 7, 4096):
+            self.assertEqual(list(iter_json_array(chunked(text, size), max_buffer=64)), items)
+        self.assertEqual(list(iter_json_array(['{"jsonrpc":"2.0","result":[ ],"id":1}'])), [])
+
+    def test_lazy(self):
+        text = json.dumps({'result': [{'n': i} for i in range(1000)]})
+        read = []
+        chunks = (read.append(chunk) or chunk for chunk in chunked(text, 16))
+        self.assertEqual(next(iter_json_array(chunks)), {'n': 0})
+        self.assertLess(len(read), 5)
+
+    def test_errors(self):
+        with self.assertRaises(Exception):
+            list(iter_json_array(chunked('{"jsonrpc":"2.0","error":{"code":-32600},"id":1}', 5)))
+        with self.assertRaises(Exception):
+            list(iter_json_array(chunked('{"result":[{"a":1},{"a"', 5)))
+
+
+class SnapshotExporterTest(unittest.TestCase):
+    def test_export(self):
+        account = bytearray(Account.size())
+        Account.pack(account, ether, 255, 7, signer, blocked=bytes([9]) * 32)
+        storage = bytearray(Storage.size() + 64 + 500)
+        Storage.pack(storage, ether, 3, 2, 100, 400)
+        loader = [entry(1, bytes(account)), entry(2, bytes(storage)), entry(3, b'\x02' + signer + bytes(4))]
+        wrapper = [entry(4, ether + bytes([5, 0, 0, 0])), entry(5, signer + ether),
+                   entry(6, signer + ether + ether)]
+        session = FakeSession({'wrapper': wrapper, 'loader': loader})
+        exporter = SnapshotExporter('wrapper', 'loader', session=session)
+
+        with tempfile.TemporaryDirectory() as directory:
+            counts = exporter.export(directory)
+            self.assertEqual(counts, {kind.name: (1, 0) for kind in KINDS})
+            rows = {kind.name: list(read_records(os.path.join(directory, kind.name + '.bin'), kind))
+                    for kind in KINDS}
+
+        self.assertTrue(all(response.closed for response in session.responses))
+        row = rows['loader_account'][0]
+        self.assertEqual((row.pubkey, row.lamports), (bytes([1]) * 32, 1001))
+        self.assertEqual((row.ether, row.nonce, row.trx_count, row.is_blocked), (ether, 255, 7, 1))
+        self.assertEqual(row.blocked_by, bytes([9]) * 32)
+        row = rows['loader_storage'][0]
+        self.assertEqual((row.caller, row.nonce, row.accounts_len, row.evm_data_size), (ether, 3, 2, 400))
+        self.assertEqual(tuple(rows['loader_contract'][0])[2:], (signer, 0))
+        self.assertEqual(tuple(rows['wrapper_account_info'][0])[2:], (ether, 5))
+        self.assertEqual(tuple(rows['wrapper_token_info'][0])[2:], (signer, ether))
+        self.assertEqual(tuple(rows['wrapper_balance_info'][0])[2:], (signer, ether, ether))
+
+    def test_loader_only(self):
+        session = FakeSession({'loader': []})
+        with tempfile.TemporaryDirectory() as directory:
+            counts = SnapshotExporter(loader_program='loader', session=session).export(directory)
+        self.assertEqual(sorted(counts), ['loader_account', 'loader_contract', 'loader_storage'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+import base64
+import unittest
+from base58 import b58encode, b58decode
+from account_data import Account, Storage
+from storage_inspector import StorageInspector, storage_accounts
+
+caller = bytes.fromhex("c1566af4699928fdf9be097ca3dc47ece39f8f8e")
+contract = bytes(range(32))
+code = bytes(range(32, 64))
+sysinstruct = "Sysvar1nstructions1111111111111111111111111"
+loader = "eeLSJgWzzxrqKv1UxtRVVH8FX3qCQWUs9QuAjJpETGU"
+S1 = b58encode(bytes([1]) * 32).decode()
+S2 = b58encode(bytes([2]) * 32).decode()
+
+
+def storage_view(nonce, accounts, evm_data_size=1000, executor_data_size=200, max_accounts=64):
+    data = bytearray(Storage.size() + 32*len(accounts))
+    Storage.pack(data, caller, nonce, len(accounts), executor_data_size, evm_data_size)
+    data[Storage.size():] = b''.join(accounts)
+    return Storage(bytes(data[:Storage.size() + 32*max_accounts]))
+
+
+def account_info(blocked=None, owner=loader):
+    data = bytearray(Account.size())
+    Account.pack(data, caller, 1, 0, bytes(32), blocked=blocked)
+    return {'owner': owner, 'data': [base64.b64encode(bytes(data)).decode(), 'base64']}
+
+
+class StorageInspectorTest(unittest.TestCase):
+    def test_scan(self):
+        inspector = StorageInspector(program_id=loader, client=None)
+        inspector.scan({S1: storage_view(1, [contract, code])}, slot=100)
+        inspector.scan({S1: storage_view(1, [contract, code]), S2: storage_view(2, [])}, slot=150)
+        infos = inspector.scan({S1: storage_view(1, [contract, code]), S2: storage_view(2, [])}, slot=160)
+
+        self.assertEqual([info.storage for info in infos], [S1, S2])
+        self.assertEqual(infos[0].accounts, [b58encode(contract).decode(), b58encode(code).decode()])
+        self.assertEqual(infos[0].data_size, Storage.size() + 64 + 1200)
+        self.assertEqual([info.storage for info in inspector.stale(infos, 50)], [S1])
+
+        report = inspector.report(infos, {b58encode(contract).decode(): account_info(blocked=bytes([1]) * 32)})
+        self.assertEqual((report['calls'], report['locked_accounts']), (2, 1))
+        self.assertEqual([s['age_slots'] for s in report['storages']], [60, 10])
+
+    def test_lock_holders(self):
+        # the account list of a call also has sysvars, the loader and
+        # accounts that aren't blocked, or blocked by another call
+        accounts = [contract, code, b58decode(sysinstruct), b58decode(loader), bytes([7]) * 32]
+        account_infos = {
+            b58encode(contract).decode(): account_info(blocked=bytes([1]) * 32),
+            b58encode(code).decode(): account_info(),
+            sysinstruct: {'owner': "Sysvar1111111111111111111111111111111111111", 'data': ['', 'base64']},
+            loader: {'owner': "BPFLoader2111111111111111111111111111111111", 'data': ['', 'base64']},
+            b58encode(bytes([7]) * 32).decode(): account_info(blocked=bytes([2]) * 32),
+        }
+        inspector = StorageInspector(program_id=loader, client=None)
+        infos = inspector.scan({S1: storage_view(1, accounts)}, slot=100)
+        self.assertEqual(inspector.lock_holders(infos, account_infos), {b58encode(contract).decode(): S1})
+
+    def test_new_call_in_same_storage(self):
+        inspector = StorageInspector(program_id=None, client=None)
+        inspector.scan({S1: storage_view(1, [contract])}, slot=100)
+        (info,) = inspector.scan({S1: storage_view(2, [contract])}, slot=200)
+        self.assertEqual(info.first_seen_slot, 200)
+
+    def test_sliced_accounts(self):
+        view = storage_view(1, [contract, code], max_accounts=1)
+        self.assertEqual(view.accounts_len, 2)
+        self.assertEqual(storage_accounts(view), [b58encode(contract).decode()])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+import base64
+import threading
+import time
+import unittest
+from solana.account import Account
+from storage_pool import StorageAccountPool, StoragePoolExhausted
+
+loader = "eeLSJgWzzxrqKv1UxtRVVH8FX3qCQWUs9QuAjJpETGU"
+SPACE = 16
+
+
+class FakeClient:
+    """Storage accounts by address string: their first data byte is the
+    AccountData tag."""
+
+    def __init__(self):
+        self.accounts = {}
+        self.transactions = 0
+        self.gate = None        # send_transaction waits for it when set
+
+    def get_balance(self, storage):
+        return {'result': {'value': 10**9 if str(storage) in self.accounts else 0}}
+
+    def get_account_info(self, storage):
+        data = bytes([self.accounts[str(storage)]]) + bytes(SPACE - 1)
+        return {'result': {'value': {'data': [base64.b64encode(data).decode(), 'base64']}}}
+
+    def send_transaction(self, trx, *signers, opts=None):
+        if self.gate is not None:
+            self.gate.wait(5)
+        self.transactions += 1
+        for instruction in trx.instructions:
+            self.accounts[str(instruction.keys[1].pubkey)] = 0
+        return {'result': 'sig{}'.format(self.transactions)}
+
+
+class StorageAccountPoolTest(unittest.TestCase):
+    def pool(self, client, **kwargs):
+        return StorageAccountPool(Account(bytes([1]) * 32), loader, client=client, space=SPACE, **kwargs)
+
+    def test_acquire_release(self):
+        client = FakeClient()
+        pool = self.pool(client, min_size=2, max_size=4)
+        pool.warm_up()
+        self.assertEqual((pool.stats['created'], client.transactions), (2, 1))
+        first = pool.acquire()
+        second = pool.acquire()
+        self.assertNotEqual(first, second)
+        pool.release(first)
+        self.assertEqual(pool.acquire(), first)
+        self.assertEqual(pool.utilization()['leased'], 2)
+
+    def test_grow_to_max(self):
+        pool = self.pool(FakeClient(), min_size=1, max_size=3)
+        leased = [pool.acquire() for _ in range(3)]
+        self.assertEqual(len(set(leased)), 3)
+        with self.assertRaises(StoragePoolExhausted):
+            pool.acquire(timeout=0)
+        pool.release(leased[0])
+        self.assertEqual(pool.acquire(timeout=0), leased[0])
+
+    def test_recycle_existing_accounts(self):
+        client = FakeClient()
+        self.pool(client, min_size=3).warm_up()
+        # a restarted pool finds the accounts of the same seeds; one of
+        # them still holds a call and is quarantined
+        storage = list(client.accounts)
+        client.accounts[storage[1]] = 3
+        pool = self.pool(client, min_size=3)
+        pool.warm_up()
+        self.assertEqual((pool.stats['created'], pool.stats['reused']), (0, 2))
+        self.assertEqual(pool.quarantined, {storage[1]})
+        client.accounts[storage[1]] = 0
+        pool.restore(storage[1])
+        self.assertEqual(pool.utilization()['free'], 3)
+
+    def test_release_check(self):
+        client = FakeClient()
+        pool = self.pool(client, min_size=1)
+        with self.assertRaises(ValueError):
+            with pool.lease() as storage:
+                client.accounts[storage] = 3
+                raise ValueError()
+        self.assertEqual(pool.quarantined, {storage})
+
+    def test_release_during_creation(self):
+        client = FakeClient()
+        pool = self.pool(client, min_size=1, max_size=4)
+        pool.warm_up()
+        leased = pool.acquire()
+        client.gate = threading.Event()
+        grower = threading.Thread(target=pool.acquire)
+        grower.start()
+        while pool.utilization()['creating'] == 0:
+            time.sleep(0.001)
+        # the lock isn't held while the new account is being confirmed
+        pool.release(leased)
+        self.assertEqual(pool.acquire(timeout=0), leased)
+        client.gate.set()
+        grower.join()
+        self.assertEqual(pool.utilization()['leased'], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
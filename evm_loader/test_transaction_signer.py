@@ -0,0 +1,51 @@
+import unittest
+from solana.account import Account
+from solana.publickey import PublicKey
+from solana.transaction import AccountMeta, TransactionInstruction
+from transaction_signer import TransactionSigner, plain_instruction
+
+memo = "Memo1UhkJRfHyvLMcVucJwxXeuD728EqVDDwQDxFMNo"
+blockhash = "EETubP5AKHgjPAhzPAFcb8BAY1hMH639CWCFTqi3hq1k"
+
+
+def memo_instruction(signer, text):
+    return TransactionInstruction(program_id=PublicKey(memo), data=text.encode(),
+            keys=[AccountMeta(pubkey=signer.public_key(), is_signer=True, is_writable=False)])
+
+
+class TransactionSignerTest(unittest.TestCase):
+    def setUp(self):
+        self.payers = [Account(bytes([i]) * 32) for i in range(1, 3)]
+        self.jobs = [(payer.public_key(), [memo_instruction(payer, "{}".format(i))])
+                     for i in range(20) for payer in self.payers]
+
+    def test_plain_instruction(self):
+        (program_id, keys, data) = plain_instruction(memo_instruction(self.payers[0], "x"))
+        self.assertEqual(program_id, memo)
+        self.assertEqual(keys, [(str(self.payers[0].public_key()), True, False)])
+        self.assertEqual(data, b"x")
+
+    def test_pool_keeps_order(self):
+        with TransactionSigner(self.payers, processes=0) as signer:
+            expected = signer.prepare(self.jobs, blockhash)
+        with TransactionSigner(self.payers, processes=2, chunksize=3) as signer:
+            self.assertEqual(signer.prepare(self.jobs, blockhash), expected)
+        self.assertEqual(len(set(expected)), len(self.jobs))
+
+    def test_several_signers(self):
+        (first, second) = self.payers
+        job = ([second.public_key(), first.public_key()],
+               [memo_instruction(first, "a"), memo_instruction(second, "b")])
+        with TransactionSigner(self.payers, processes=0) as signer:
+            (raw,) = signer.prepare([job], blockhash)
+        # signed by both, the fee payer first
+        self.assertLess(raw.index(bytes(second.public_key())), raw.index(bytes(first.public_key())))
+
+    def test_unknown_signer(self):
+        with TransactionSigner(self.payers[:1], processes=0) as signer:
+            with self.assertRaises(Exception):
+                signer.prepare(self.jobs, blockhash)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from solana.account import Account
+from solana.publickey import PublicKey
+from solana.transaction import AccountMeta, TransactionInstruction, Transaction
+
+# Signers of the current worker process: public key -> Account
+_signers = {}
+
+
+def plain_instruction(instruction):
+    """Picklable form of a TransactionInstruction."""
+    return (str(instruction.program_id),
+            [(str(meta.pubkey), meta.is_signer, meta.is_writable) for meta in instruction.keys],
+            bytes(instruction.data))
+
+
+def _accounts(secrets):
+    accounts = (Account(secret) for secret in secrets)
+    return {str(account.public_key()): account for account in accounts}
+
+
+def _init_worker(secrets):
+    _signers.clear()
+    _signers.update(_accounts(secrets))
+
+
+def _sign(job, signers=None):
+    (signer_keys, instructions, blockhash) = job
+    trx = Transaction()
+    for (program_id, keys, data) in instructions:
+        trx.add(TransactionInstruction(program_id=PublicKey(program_id), data=data,
+                keys=[AccountMeta(pubkey=PublicKey(key), is_signer=is_signer, is_writable=is_writable)
+                      for (key, is_signer, is_writable) in keys]))
+    trx.recent_blockhash = blockhash
+    signers = _signers if signers is None else signers
+    trx.sign(*[signers[key] for key in signer_keys])
+    return trx.serialize()
+
+
+class TransactionSigner:
+    """Signs and serializes many transactions in a process pool.
+
+    The secret keys are handed to every worker once, when it starts; a
+    job carries only the public keys of its signers (the first one pays the
+    fee), its instructions and the blockhash, and comes back as wire bytes
+    for `send_raw_transaction`. With `processes=0` the jobs are signed in
+    the calling thread."""
+
+    def __init__(self, signers, processes=None, chunksize=16):
+        self.secrets = [bytes(signer.secret_key()) for signer in signers]
+        self.keys = [str(signer.public_key()) for signer in signers]
+        self.processes = os.cpu_count() if processes is None else processes
+        self.chunksize = chunksize
+        self.pool = None
+
+    def _pool(self):
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(self.processes, initializer=_init_worker, initargs=(self.secrets,))
+        return self.pool
+
+    def _job(self, job, blockhash):
+        (payer, instructions) = job
+        signer_keys = [str(payer)] if isinstance(payer, (str, PublicKey)) else [str(key) for key in payer]
+        for key in signer_keys:
+            if key not in self.keys:
+                raise Exception("Unknown signer {}".format(key))
+        return (signer_keys, [plain_instruction(instruction) for instruction in instructions], str(blockhash))
+
+    def prepare(self, jobs, blockhash):
+        """Raw transactions for (payer, instructions) jobs, in the order of
+        `jobs`. `payer` is the public key of the fee payer, or a list of
+        public keys of all signers with the fee payer first."""
+        jobs = [self._job(job, blockhash) for job in jobs]
+        if self.processes == 0:
+            signers = _accounts(self.secrets)
+            return [_sign(job, signers) for job in jobs]
+        return list(self._pool().map(_sign, jobs, chunksize=self.chunksize))
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,229 @@
+import base64
+import os
+import tempfile
+import unittest
+from unittest import mock
+from hashlib import sha256
+from solana.account import Account
+from solana.publickey import PublicKey
+from eth_keys import keys as eth_keys
+import wrapper
+from wrapper import (WrapperProgram, TokenCache, TokenInfo, TransferResult, EthereumAddresses, find_program_address,
+                     transaction_size, account_keys, token_id, BALANCE_INFO_LAYOUT, TOKEN_INFO_LAYOUT,
+                     SPL_ACCOUNT_LAYOUT, SPL_ACCOUNT_SIZE, MINT_SIZE, MINT_DECIMALS_OFFSET, PACKET_DATA_SIZE)
+
+program = "HB7yN5ZLPi1cLUAZs6QF4y6ZdRN1K4YhGzyRgewF23rD"
+
+
+def key(i):
+    return str(PublicKey(bytes([i]) * 32))
+
+
+def info(owner, data):
+    return {'owner': owner, 'lamports': 1, 'data': [base64.b64encode(data).decode(), 'base64']}
+
+
+class FakeProvider:
+    """getMultipleAccounts and getProgramAccounts of `accounts`, an info by key."""
+
+    def __init__(self):
+        self.accounts = {}
+        self.requests = []
+
+    def make_request(self, method, *params):
+        self.requests.append(method)
+        if method == "getMultipleAccounts":
+            return {'result': {'context': {'slot': 1},
+                               'value': [self.accounts.get(str(account)) for account in params[0]]}}
+        if method == "getProgramAccounts":
+            size = params[1]['filters'][0]['dataSize']
+            return {'result': [{'pubkey': account, 'account': value} for (account, value) in self.accounts.items()
+                               if value['owner'] == params[0] and len(base64.b64decode(value['data'][0])) == size]}
+        raise NotImplementedError(method)
+
+
+class FakeClient:
+    def __init__(self):
+        self._provider = FakeProvider()
+        self.sent = []
+        self.fail = None        # transactions with an instruction data ending so fail
+
+    def get_account_info(self, account):
+        self._provider.requests.append("getAccountInfo")
+        return {'result': {'value': self._provider.accounts.get(str(account))}}
+
+    @staticmethod
+    def signature(trx):
+        return sha256(b''.join(instruction.data for instruction in trx.instructions)).hexdigest()
+
+    def fails(self, trx):
+        return self.fail is not None and any(instruction.data.endswith(self.fail) for instruction in trx.instructions)
+
+    def send_transaction(self, trx, *signers, opts=None):
+        self.sent.append(trx)
+        if self.fails(trx):
+            raise Exception("Transaction simulation failed")
+        return {'result': self.signature(trx)}
+
+
+class BalancesTest(unittest.TestCase):
+    def setUp(self):
+        self.client = FakeClient()
+        self.wrapper = WrapperProgram(self.client, program)
+        self.accounts = self.client._provider.accounts
+
+    def add_balance(self, eth_token, eth_acc, account, amount, info_owner=program, token_owner=token_id):
+        (address, nonce) = find_program_address([eth_token, eth_acc], program)
+        self.accounts[address] = info(info_owner, BALANCE_INFO_LAYOUT.build(dict(
+            account=bytes(PublicKey(account)), eth_token=eth_token, eth_acc=eth_acc)))
+        data = SPL_ACCOUNT_LAYOUT.build(dict(mint=bytes(PublicKey(key(9))), owner=bytes(32), amount=amount))
+        self.accounts[account] = info(token_owner, data + bytes(SPL_ACCOUNT_SIZE - len(data)))
+
+    def test_get_balances(self):
+        eth_acc = bytes([1]) * 20
+        tokens = [bytes([10 + i]) * 20 for i in range(5)]
+        self.add_balance(tokens[0], eth_acc, key(1), 100)
+        self.add_balance(tokens[2], eth_acc, key(3), 300, token_owner=program)
+        self.add_balance(tokens[3], eth_acc, key(4), 400)
+        self.add_balance(tokens[4], eth_acc, key(5), 500, info_owner=wrapper.system_id)
+        # tokens[1]: no balance info; tokens[2]: the token account isn't an SPL
+        # one; tokens[4]: the balance info isn't the program's
+        balances = self.wrapper.getBalances(eth_acc, tokens)
+        self.assertEqual([None if balance is None else balance.amount for balance in balances],
+                         [100, None, None, 400, None])
+        self.assertEqual(balances[3], wrapper.Balance(tokens[3], eth_acc, PublicKey(key(4)), PublicKey(key(9)), 400))
+        self.assertEqual(self.client._provider.requests, ["getMultipleAccounts"] * 2)
+
+    def test_many_waves(self):
+        pairs = [(bytes([1]) * 20, bytes([i]) * 20) for i in range(150)]
+        self.assertEqual(self.wrapper.getBalancesMany(pairs), [None] * 150)
+        self.assertEqual(self.client._provider.requests, ["getMultipleAccounts"] * 2)
+
+
+class TokenCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.client = FakeClient()
+        self.accounts = self.client._provider.accounts
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'tokens.json')
+        for i in range(3):
+            self.add_token(bytes([10 + i]) * 20, key(i + 1), 6 + i)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def add_token(self, eth_token, token, decimals):
+        (address, nonce) = find_program_address([eth_token], program)
+        self.accounts[address] = info(program, TOKEN_INFO_LAYOUT.build(dict(
+            token=bytes(PublicKey(token)), eth_token=eth_token)))
+        mint = bytearray(MINT_SIZE)
+        mint[MINT_DECIMALS_OFFSET] = decimals
+        self.accounts[token] = info(token_id, bytes(mint))
+
+    # the solana CLI isn't there: misses get the token info address in memory
+    @mock.patch('wrapper.create_program_address', find_program_address)
+    def test_cache_hits(self):
+        program_wrapper = WrapperProgram(self.client, program, TokenCache(self.path))
+        eth_token = bytes([11]) * 20
+        for _ in range(2):
+            self.assertEqual(program_wrapper.getTokenInfo(eth_token), TokenInfo(PublicKey(key(2)), eth_token))
+            self.assertEqual(program_wrapper.getTokenDecimals(key(2)), 7)
+        self.assertEqual(self.client._provider.requests, ["getAccountInfo"] * 2)
+        # misses aren't written until saved
+        self.assertFalse(os.path.exists(self.path))
+        program_wrapper.token_cache.save()
+
+        self.client._provider.requests.clear()
+        program_wrapper = WrapperProgram(self.client, program, TokenCache(self.path))
+        self.assertEqual(program_wrapper.getTokenInfo(eth_token), TokenInfo(PublicKey(key(2)), eth_token))
+        self.assertEqual(program_wrapper.getTokenDecimals(key(2)), 7)
+        self.assertEqual(self.client._provider.requests, [])
+
+    def test_warm_up(self):
+        program_wrapper = WrapperProgram(self.client, program, TokenCache(self.path))
+        self.assertEqual(program_wrapper.warmTokenCache(), 3)
+        self.assertEqual(self.client._provider.requests, ["getProgramAccounts", "getMultipleAccounts"])
+
+        cache = TokenCache(self.path)
+        self.assertEqual(cache.getTokenInfo(bytes([12]) * 20), TokenInfo(PublicKey(key(3)), bytes([12]) * 20))
+        self.assertEqual({key(i + 1): cache.getDecimals(key(i + 1)) for i in range(3)},
+                         {key(1): 6, key(2): 7, key(3): 8})
+        self.assertFalse(cache.dirty)
+
+
+class TransferTest(unittest.TestCase):
+    def setUp(self):
+        self.client = FakeClient()
+        self.wrapper = WrapperProgram(self.client, program)
+        self.signer = Account(bytes(32))
+
+    def test_pack_limits(self):
+        transfers = [(bytes([1]) * 20, bytes([i]) * 20, key(i), key(100 + i), i) for i in range(40)]
+        # one at a time, so that they are sent in order
+        self.assertEqual(len(self.wrapper.transferMany(self.signer, transfers, max_workers=1)), 40)
+        payer = self.signer.public_key()
+        self.assertGreater(len(self.client.sent), 1)
+        for (trx, following) in zip(self.client.sent, self.client.sent[1:]):
+            self.assertLessEqual(transaction_size(payer, trx.instructions), PACKET_DATA_SIZE)
+            # the fewest transactions: the next instruction didn't fit
+            instructions = trx.instructions + following.instructions[:1]
+            self.assertTrue(transaction_size(payer, instructions) > PACKET_DATA_SIZE or
+                            len(account_keys(payer, instructions)) > wrapper.MAX_ACCOUNT_KEYS)
+        amounts = [wrapper.TRANSFER_LAYOUT.parse(instruction.data).amount for trx in self.client.sent
+                   for instruction in trx.instructions]
+        self.assertEqual(amounts, list(range(40)))
+
+    def test_account_limit(self):
+        transfers = [(bytes([i]) * 20, key(100 + i), i) for i in range(30)]
+        self.wrapper.transferLamportsMany(self.signer, transfers, max_account_keys=12)
+        for trx in self.client.sent:
+            self.assertLessEqual(len(account_keys(self.signer.public_key(), trx.instructions)), 12)
+        self.assertEqual(sum(len(trx.instructions) for trx in self.client.sent), 30)
+
+    def test_results_per_transfer(self):
+        transfers = [(bytes([i]) * 20, key(100 + i), i) for i in range(30)]
+        self.client.fail = bytes([13]) * 20
+        results = self.wrapper.transferLamportsMany(self.signer, transfers, max_account_keys=12)
+        self.assertEqual(len(results), 30)
+        # the result of a transfer is the one of the transaction it was sent in
+        for (amount, result) in enumerate(results):
+            (trx,) = [trx for trx in self.client.sent for instruction in trx.instructions
+                      if wrapper.TRANSFER_LAMPORTS_LAYOUT.parse(instruction.data).amount == amount]
+            if self.client.fails(trx):
+                self.assertEqual(result.signature, None)
+                self.assertIsInstance(result.error, Exception)
+            else:
+                self.assertEqual(result, TransferResult(self.client.signature(trx), None))
+        self.assertEqual(sum(self.client.fails(trx) for trx in self.client.sent), 1)
+        self.assertIsNotNone(results[13].error)
+
+
+class EthereumAddressesTest(unittest.TestCase):
+    def test_generate(self):
+        addresses = EthereumAddresses.generate(10, chunksize=3)
+        self.assertEqual(len(addresses), 10)
+        self.assertEqual(len(set(addresses.address(i) for i in range(10))), 10)
+        for (i, address) in enumerate(addresses):
+            self.assertEqual(address.data, addresses.address(i))
+            self.assertEqual(address.private.public_key.to_canonical_address(), address.data)
+        self.assertEqual(addresses[-1].data, addresses.address(9))
+        with self.assertRaises(IndexError):
+            addresses[10]
+
+    def test_generate_in_processes(self):
+        addresses = EthereumAddresses.generate(4, processes=2, chunksize=1)
+        self.assertEqual([address.private.public_key.to_canonical_address() for address in addresses],
+                         [addresses.address(i) for i in range(4)])
+
+    def test_save_load(self):
+        addresses = EthereumAddresses.generate(5)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'addresses')
+            addresses.save(path)
+            loaded = EthereumAddresses.load(path)
+        self.assertEqual((loaded.addresses, loaded.keys), (addresses.addresses, addresses.keys))
+        self.assertEqual(loaded[2].private, eth_keys.PrivateKey(addresses.keys[64:96]))
+
+
+if __name__ == '__main__':
+    unittest.main()
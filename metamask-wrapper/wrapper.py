@@ -4,13 +4,25 @@ from solana.account import Account
 from solana.publickey import PublicKey
 from solana._layouts.shared import PUBLIC_KEY_LAYOUT, RUST_STRING_LAYOUT
 from solana.transaction import AccountMeta, TransactionInstruction, Transaction
+from solana.rpc.types import TxOpts
 import base58
 import base64
 from construct import Bytes, Int8ul, Int32ul, Int64ul, Pass  # type: ignore
 from construct import Struct as cStruct
 import subprocess
+import json
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from eth_keys import keys as eth_keys
-import random
+
+# Program addresses, transaction sizes and getMultipleAccounts are the
+# ones of evm_loader
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'evm_loader'))
+from bulk_accounts import is_on_curve, find_program_address
+from call_packer import PACKET_DATA_SIZE, MAX_ACCOUNT_KEYS, account_keys, transaction_size
+from solana_utils import getMultipleAccounts
 
 system_id = '11111111111111111111111111111111'
 rent_id = 'SysvarRent111111111111111111111111111111111'
@@ -26,6 +38,19 @@ def create_program_address(seeds, programId):
     (account, nonce) = result.decode('utf8').split('  ')
     return account, int(nonce)
 
+# order of the secp256k1 group: private keys are 1..N-1
+SECP256K1_N = 0xFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFEBAAEDCE6AF48A03BBFD25E8CD0364141
+
+def random_private_key():
+    while True:
+        key = os.urandom(32)
+        if 0 < int.from_bytes(key, 'big') < SECP256K1_N:
+            return key
+
+def _derive_addresses(keys):
+    return b''.join(eth_keys.PrivateKey(keys[i:i+32]).public_key.to_canonical_address()
+                    for i in range(0, len(keys), 32))
+
 class EthereumAddress:
     def __init__(self, data, private=None):
         if isinstance(data, str):
@@ -35,9 +60,7 @@ class EthereumAddress:
 
     @staticmethod
     def random():
-        letters = '0123456789abcdef'
-        data = bytearray.fromhex(''.join([random.choice(letters) for k in range(64)]))
-        pk = eth_keys.PrivateKey(data)
+        pk = eth_keys.PrivateKey(random_private_key())
         return EthereumAddress(pk.public_key.to_canonical_address(), pk)
 
     def __str__(self):
@@ -48,6 +71,59 @@ class EthereumAddress:
 
     def __bytes__(self): return self.data
 
+class EthereumAddresses:
+    """Many random addresses with their private keys, packed into two
+    byte strings (20 bytes per address, 32 per key); EthereumAddress
+    objects are only built by indexing."""
+
+    def __init__(self, addresses, keys):
+        assert len(addresses) * 32 == len(keys) * 20
+        self.addresses = addresses
+        self.keys = keys
+
+    @staticmethod
+    def generate(count, processes=0, chunksize=1024):
+        """`count` random addresses; with `processes` other than 0 the
+        public keys are derived in a process pool (None: one per CPU)."""
+        keys = bytearray(os.urandom(32 * count))
+        for i in range(0, len(keys), 32):
+            if not 0 < int.from_bytes(keys[i:i+32], 'big') < SECP256K1_N:
+                keys[i:i+32] = random_private_key()
+        keys = bytes(keys)
+        chunks = [keys[i:i+32*chunksize] for i in range(0, len(keys), 32*chunksize)]
+        if processes == 0:
+            addresses = map(_derive_addresses, chunks)
+            return EthereumAddresses(b''.join(addresses), keys)
+        with ProcessPoolExecutor(processes) as executor:
+            return EthereumAddresses(b''.join(executor.map(_derive_addresses, chunks)), keys)
+
+    @staticmethod
+    def load(path):
+        with open(path, 'rb') as f:
+            data = f.read()
+        count = len(data) // 52
+        return EthereumAddresses(data[:20*count], data[20*count:])
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            f.write(self.addresses)
+            f.write(self.keys)
+
+    def __len__(self):
+        return len(self.addresses) // 20
+
+    def address(self, index):
+        return self.addresses[20*index:20*index+20]
+
+    def __getitem__(self, index):
+        if not -len(self) <= index < len(self):
+            raise IndexError(index)
+        index %= len(self)
+        return EthereumAddress(self.address(index), eth_keys.PrivateKey(self.keys[32*index:32*index+32]))
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
 INITIALIZE_ACCOUNT_LAYOUT = cStruct(
     "instruction" / Int8ul,
     "eth_acc" / Bytes(20),
@@ -129,10 +205,81 @@ class BalanceInfo(NamedTuple):
         return BalanceInfo(PublicKey(cont.account), cont.eth_token.hex(), cont.eth_acc.hex())
 
 
+SPL_ACCOUNT_LAYOUT = cStruct(
+    "mint" / PUBLIC_KEY_LAYOUT,
+    "owner" / PUBLIC_KEY_LAYOUT,
+    "amount" / Int64ul,
+)
+SPL_ACCOUNT_SIZE = 165
+
+
+class Balance(NamedTuple):
+    eth_token: bytes
+    eth_acc: bytes
+    account: PublicKey    # SPL token account of the balance
+    mint: PublicKey
+    amount: int
+
+
+class TransferResult(NamedTuple):
+    signature: str      # of the transaction with the transfer, None if it failed
+    error: Exception
+
+MINT_SIZE = 82
+MINT_DECIMALS_OFFSET = 44
+
+class TokenCache:
+    """TokenInfo by eth_token and decimals by mint. Both never change once
+    initialized, so entries are never invalidated; with `path` they are
+    also kept in a JSON file between runs. New entries are written by
+    `save` (WrapperProgram.warmTokenCache calls it), not on every update."""
+
+    def __init__(self, path=None):
+        self.path = path
+        self.tokens = {}      # eth_token hex -> TokenInfo
+        self.decimals = {}    # mint -> decimals
+        self.lock = threading.Lock()
+        self.save_lock = threading.Lock()    # keeps saves in order, lookups go on
+        self.dirty = False
+        if path is not None and os.path.exists(path):
+            with open(path) as f:
+                data = json.load(f)
+            for (eth_token, token) in data['tokens'].items():
+                self.tokens[eth_token] = TokenInfo(PublicKey(token), bytes.fromhex(eth_token))
+            self.decimals.update(data['decimals'])
+
+    def getTokenInfo(self, eth_token):
+        return self.tokens.get(bytes(eth_token).hex())
+
+    def getDecimals(self, token):
+        return self.decimals.get(str(token))
+
+    def update(self, tokens=(), decimals=None):
+        with self.lock:
+            for info in tokens:
+                self.tokens[bytes(info.eth_token).hex()] = info
+            self.decimals.update(decimals or {})
+            self.dirty = True
+
+    def save(self):
+        """Write the entries to `path` if any were added since the last save."""
+        with self.save_lock:
+            with self.lock:
+                if self.path is None or not self.dirty:
+                    return
+                data = {'tokens': {eth_token: str(info.token) for (eth_token, info) in self.tokens.items()},
+                        'decimals': dict(self.decimals)}
+                self.dirty = False
+            with open(self.path + '.tmp', 'w') as f:
+                json.dump(data, f)
+            os.replace(self.path + '.tmp', self.path)
+
+
 class WrapperProgram():
-    def __init__(self, client, program):
+    def __init__(self, client, program, token_cache=None):
         self.program = program
         self.client = client
+        self.token_cache = token_cache or TokenCache()
 
     def program_address(self, seeds):
         return create_program_address(seeds, self.program)
@@ -157,9 +304,13 @@ class WrapperProgram():
         return AccountInfo.frombytes(data)
 
     def getTokenInfo(self, eth_token):
-        (token_info, nonce) = create_program_address([bytes(eth_token)], self.program)
-        data = self._getAccountData(token_info, TOKEN_INFO_LAYOUT.sizeof())
-        return TokenInfo.frombytes(data)
+        info = self.token_cache.getTokenInfo(eth_token)
+        if info is None:
+            (token_info, nonce) = create_program_address([bytes(eth_token)], self.program)
+            data = self._getAccountData(token_info, TOKEN_INFO_LAYOUT.sizeof())
+            info = TokenInfo.frombytes(data)
+            self.token_cache.update(tokens=[info])
+        return info
 
     def getBalanceInfo(self, eth_token, eth_acc):
         (account_info, nonce) = create_program_address([bytes(eth_token), bytes(eth_acc)], self.program)
@@ -170,13 +321,77 @@ class WrapperProgram():
         (account, nonce) = create_program_address([bytes(eth_acc), 'lamports'.encode('ascii')], self.program)
         return int(self.client.get_balance(account)['result']['value'])
 
+    def _getMultipleAccounts(self, accounts):
+        (slot, infos) = getMultipleAccounts(self.client, accounts)
+        return infos
+
+    @staticmethod
+    def _accountData(info, owner, expected_length):
+        if info is None or info['owner'] != owner:
+            return None
+        data = base64.b64decode(info['data'][0])
+        return data if len(data) == expected_length else None
+
+    def getBalancesMany(self, pairs):
+        """Balances of (eth_token, eth_acc) pairs, None where the balance
+        isn't initialized: the balance infos in one getMultipleAccounts
+        wave, then their SPL token accounts in another."""
+        pairs = [(bytes(eth_token), bytes(eth_acc)) for (eth_token, eth_acc) in pairs]
+        addresses = [find_program_address([eth_token, eth_acc], self.program)[0] for (eth_token, eth_acc) in pairs]
+        infos = []
+        for info in self._getMultipleAccounts(addresses):
+            data = self._accountData(info, self.program, BALANCE_INFO_LAYOUT.sizeof())
+            infos.append(None if data is None else BalanceInfo.frombytes(data))
+
+        accounts = [str(info.account) for info in infos if info is not None]
+        tokens = dict(zip(accounts, self._getMultipleAccounts(accounts)))
+        balances = []
+        for ((eth_token, eth_acc), info) in zip(pairs, infos):
+            data = None if info is None else self._accountData(tokens[str(info.account)], token_id, SPL_ACCOUNT_SIZE)
+            if data is None:
+                balances.append(None)
+                continue
+            cont = SPL_ACCOUNT_LAYOUT.parse(data)
+            balances.append(Balance(eth_token, eth_acc, info.account, PublicKey(cont.mint), cont.amount))
+        return balances
+
+    def getBalances(self, eth_acc, eth_tokens):
+        return self.getBalancesMany([(eth_token, eth_acc) for eth_token in eth_tokens])
+
     def getTokenDecimals(self, token):
-        data = self._getAccountData(token, 82, owner=token_id)
-        return int.from_bytes(data[36+8:36+8+1], "little")
+        decimals = self.token_cache.getDecimals(token)
+        if decimals is None:
+            data = self._getAccountData(token, MINT_SIZE, owner=token_id)
+            decimals = data[MINT_DECIMALS_OFFSET]
+            self.token_cache.update(decimals={str(token): decimals})
+        return decimals
+
+    def warmTokenCache(self):
+        """Load every token info of the program (one getProgramAccounts)
+        and the decimals of their mints into the token cache."""
+        response = self.client._provider.make_request("getProgramAccounts", self.program, {
+                "encoding": "base64",
+                "filters": [{"dataSize": TOKEN_INFO_LAYOUT.sizeof()}]})
+        if 'error' in response:
+            raise Exception("getProgramAccounts failed: {}".format(response['error']))
+        tokens = [TokenInfo.frombytes(base64.b64decode(item['account']['data'][0])) for item in response['result']]
+
+        mints = sorted(set(str(info.token) for info in tokens) - set(self.token_cache.decimals))
+        decimals = {}
+        for (mint, info) in zip(mints, self._getMultipleAccounts(mints)):
+            data = self._accountData(info, token_id, MINT_SIZE)
+            if data is not None:
+                decimals[mint] = data[MINT_DECIMALS_OFFSET]
+        self.token_cache.update(tokens=tokens, decimals=decimals)
+        self.token_cache.save()
+        return len(tokens)
 
     def transfer(self, eth_token, eth_acc, source, destination, amount):
         print('--- transfer:', eth_token, eth_acc, source, destination, amount)
         (authority, nonceAuthority) = create_program_address([bytes(eth_token), bytes(eth_acc)], self.program)
+        return self._transferInstruction(eth_token, eth_acc, source, destination, amount, authority, nonceAuthority)
+
+    def _transferInstruction(self, eth_token, eth_acc, source, destination, amount, authority, nonceAuthority):
         data = TRANSFER_LAYOUT.build(dict(
             instruction=3,
             amount=amount,
@@ -196,6 +411,9 @@ class WrapperProgram():
         if isinstance(destination, EthereumAddress):
             (destination, nonceDest) = create_program_address([bytes(destination), 'lamports'.encode('ascii')], self.program)
         print('--- transfer lamports:', eth_acc, source, destination, amount)
+        return self._transferLamportsInstruction(eth_acc, source, nonce, destination, amount)
+
+    def _transferLamportsInstruction(self, eth_acc, source, nonce, destination, amount):
         data = TRANSFER_LAMPORTS_LAYOUT.build(dict(
             instruction=4,
             amount=amount,
@@ -207,6 +425,65 @@ class WrapperProgram():
                 AccountMeta(pubkey=destination, is_signer=False, is_writable=True),
                 AccountMeta(pubkey=system_id, is_signer=False, is_writable=False)])
 
+    def transferMany(self, signer, transfers, **kwargs):
+        """Send (eth_token, eth_acc, source, destination, amount) transfers,
+        several per transaction; returns a TransferResult per transfer."""
+        instructions = []
+        for (eth_token, eth_acc, source, destination, amount) in transfers:
+            (authority, nonce) = find_program_address([bytes(eth_token), bytes(eth_acc)], self.program)
+            instructions.append(self._transferInstruction(eth_token, eth_acc, source, destination, amount, authority, nonce))
+        return self.sendMany(signer, instructions, **kwargs)
+
+    def transferLamportsMany(self, signer, transfers, **kwargs):
+        """Send (eth_acc, destination, amount) lamport transfers, several per
+        transaction; returns a TransferResult per transfer."""
+        instructions = []
+        for (eth_acc, destination, amount) in transfers:
+            (source, nonce) = find_program_address([bytes(eth_acc), b'lamports'], self.program)
+            if isinstance(destination, EthereumAddress):
+                (destination, nonceDest) = find_program_address([bytes(destination), b'lamports'], self.program)
+            instructions.append(self._transferLamportsInstruction(eth_acc, source, nonce, destination, amount))
+        return self.sendMany(signer, instructions, **kwargs)
+
+    def packInstructions(self, payer, instructions, max_size=PACKET_DATA_SIZE, max_account_keys=MAX_ACCOUNT_KEYS):
+        """Split `instructions` in order into the fewest transactions within
+        `max_size` bytes and `max_account_keys` distinct accounts."""
+        batches = []
+        batch = []
+        for instruction in instructions:
+            if batch and (transaction_size(payer, batch + [instruction]) > max_size or
+                          len(account_keys(payer, batch + [instruction])) > max_account_keys):
+                batches.append(batch)
+                batch = []
+            batch.append(instruction)
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def sendMany(self, signer, instructions, opts=None, max_workers=8, **kwargs):
+        """Send `instructions` packed by packInstructions, up to `max_workers`
+        transactions at once. A transaction succeeds or fails as a whole,
+        so every instruction gets the result of its transaction."""
+        opts = opts or TxOpts(skip_confirmation=True, preflight_commitment="confirmed")
+        batches = self.packInstructions(signer.public_key(), instructions, **kwargs)
+
+        def send(batch):
+            trx = Transaction()
+            trx.add(*batch)
+            try:
+                result = self.client.send_transaction(trx, signer, opts=opts)
+            except Exception as err:
+                return TransferResult(None, err)
+            if 'error' in result:
+                return TransferResult(None, Exception(result['error']))
+            if isinstance(result['result'], dict):
+                return TransferResult(result['result']['transaction']['signatures'][0], None)
+            return TransferResult(result['result'], None)
+
+        with ThreadPoolExecutor(max_workers) as executor:
+            results = list(executor.map(send, batches))
+        return [result for (batch, result) in zip(batches, results) for _ in batch]
+
 
     def initializeAccount(self, eth_acc, signer_key):
         (account_info, nonce) = create_program_address([bytes(eth_acc)], self.program)